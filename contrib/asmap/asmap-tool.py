@@ -141,7 +141,7 @@ def main():
         state2 = load_file(args.infile2)
         ipv4_changed = 0
         ipv6_changed = 0
-        for prefix, old_asn, new_asn in state1.diff(state2):
+        for prefix, old_asn, new_asn in state1.iter_diff(state2):
             if args.ignore_unassigned and old_asn == 0:
                 continue
             net = asmap.prefix_to_net(prefix)
@@ -166,13 +166,12 @@ def main():
         state1 = load_file(args.infile1)
         state2 = load_file(args.infile2)
         address_info = json.load(args.addrs_file)
-        addrs = {a["address"] for a in address_info if a["network"] in ["ipv4", "ipv6"]}
+        addrs = list({a["address"] for a in address_info if a["network"] in ["ipv4", "ipv6"]})
+        addr_ints = [asmap.ip_to_int(ipaddress.ip_address(addr)) for addr in addrs]
+        old_asns = state1.compile().lookup_many(addr_ints)
+        new_asns = state2.compile().lookup_many(addr_ints)
         reassignments = defaultdict(list)
-        for addr in addrs:
-            net = ipaddress.ip_network(addr)
-            prefix = asmap.net_to_prefix(net)
-            old_asn = state1.lookup(prefix)
-            new_asn = state2.lookup(prefix)
+        for addr, old_asn, new_asn in zip(addrs, old_asns, new_asns):
             if new_asn != old_asn:
                 reassignments[(old_asn, new_asn)].append(addr)
         reassignments = sorted(reassignments.items(), key=lambda item: len(item[1]), reverse=True)
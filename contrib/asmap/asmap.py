@@ -3,14 +3,15 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php.
 
 """
-This module provides the ASNEntry and ASMap classes.
+This module provides the ASNEntry, ASMap and CompiledASMap classes.
 """
 
+import bisect
 import copy
 import ipaddress
 import random
 import unittest
-from collections.abc import Callable, Iterable
+from collections.abc import Callable, Iterable, Iterator
 from enum import Enum
 from functools import total_ordering
 from typing import Optional, Union, overload
@@ -47,6 +48,16 @@ def prefix_to_net(prefix: list[bool]) -> Union[ipaddress.IPv4Network,ipaddress.I
     # Return IPv6 range otherwise.
     return ipaddress.IPv6Network((netrange, num_bits), True)
 
+def ip_to_int(addr: Union[ipaddress.IPv4Address,ipaddress.IPv6Address]) -> int:
+    """
+    Convert an IPv4 or IPv6 address to the integer that CompiledASMap looks up.
+
+    IPv4 addresses are remapped to their IPv4-mapped IPv6 address (::ffff:0:0/96), as in net_to_prefix.
+    """
+    if isinstance(addr, ipaddress.IPv4Address):
+        return 0xffff00000000 + int(addr)
+    return int(addr)
+
 # Shortcut for (prefix, ASN) entries.
 ASNEntry = tuple[list[bool], int]
 
@@ -76,11 +87,15 @@ class _VarLenCoder:
       other classes start one past the last element of the class before it.
     """
 
+    # Maximum number of values whose packed encoding is cached.
+    MAX_CACHED = 1 << 16
+
     def __init__(self, minval: int, clsbits: list[int]):
         """Construct a new _VarLenCoder."""
         self._minval = minval
         self._clsbits = clsbits
         self._maxval = minval + sum(1 << b for b in clsbits) - 1
+        self._packed: dict[int, tuple[int, int]] = {}
 
     def can_encode(self, val: int) -> bool:
         """Check whether value val is in the range this coder supports."""
@@ -106,8 +121,37 @@ class _VarLenCoder:
         # And then encode v (now the position within the class) in big endian.
         ret.extend((val >> (bits - 1 - b)) & 1 for b in range(bits))
 
+    def encode_packed(self, val: int) -> tuple[int, int]:
+        """Return the encoding of val as an integer whose lowest bit is the first bit, and its number of bits."""
+        packed = self._packed.get(val)
+        if packed is not None:
+            return packed
+        assert self._minval <= val <= self._maxval
+        rem = val - self._minval
+        ret = 0
+        nbits = 0
+        bits = 0
+        for k, bits in enumerate(self._clsbits):
+            if rem >> bits:
+                rem -= 1 << bits
+                ret |= 1 << nbits
+                nbits += 1
+            else:
+                nbits += k + 1 < len(self._clsbits)
+                break
+        if bits:
+            # The position within the class is in big endian: reverse its bits.
+            ret |= int(format(rem, f'0{bits}b')[::-1], 2) << nbits
+        packed = ret, nbits + bits
+        if len(self._packed) < self.MAX_CACHED:
+            self._packed[val] = packed
+        return packed
+
     def encode_size(self, val: int) -> int:
         """Compute how many bits are needed to encode val."""
+        packed = self._packed.get(val)
+        if packed is not None:
+            return packed[1]
         assert self._minval <= val <= self._maxval
         val -= self._minval
         ret = 0
@@ -121,23 +165,34 @@ class _VarLenCoder:
                 break
         return ret + bits
 
-    def decode(self, stream, bitpos) -> tuple[int,int]:
-        """Decode a number starting at bitpos in stream, returning value and new bitpos."""
+    def decode(self, stream: str, bitpos: int) -> tuple[int,int]:
+        """
+        Decode a number starting at bitpos in stream, a string of '0' and '1' characters,
+        returning value and new bitpos.
+        """
         val = self._minval
         bits = 0
         for k, bits in enumerate(self._clsbits):
-            bit = 0
+            bit = False
             if k + 1 < len(self._clsbits):
-                bit = stream[bitpos]
+                bit = stream[bitpos] == '1'
                 bitpos += 1
             if not bit:
                 break
             val += 1 << bits
-        for i in range(bits):
-            bit = stream[bitpos]
-            bitpos += 1
-            val += bit << (bits - 1 - i)
-        return val, bitpos
+        if bits:
+            if bitpos + bits > len(stream):
+                raise IndexError("Truncated number")
+            val += int(stream[bitpos:bitpos + bits], 2)
+        return val, bitpos + bits
+
+# The bits of every byte value, as a string of '0' and '1' characters, lowest bit first.
+_BYTE_BITS = [format(byte, '08b')[::-1] for byte in range(256)]
+
+# When encoding, the _BinNode objects of subtries of at most _MAX_SHARED_SIZE bits are shared
+# between identical subtries, remembering up to _MAX_SHARED_COUNT subtries at a time.
+_MAX_SHARED_SIZE = 64
+_MAX_SHARED_COUNT = 1 << 12
 
 # Variable-length encoders used in the binary asmap format.
 _CODER_INS = _VarLenCoder(0, [0, 0, 1])
@@ -266,6 +321,34 @@ class _BinNode:
             return sub
         return _BinNode(_Instruction.DEFAULT, val, sub)
 
+class CompiledASMap:
+    """
+    A read-only mapping from IP addresses to ASNs, compiled from an ASMap object for fast lookups.
+
+    The mapping is stored as an interval table: the sorted start addresses (as returned by
+    ip_to_int) of the ranges of consecutive addresses with the same ASN, and the ASN of each
+    range. Looking up an address is a binary search for the last range starting at or before it.
+    """
+
+    def __init__(self, starts: list[int], asns: list[int]):
+        """Construct a CompiledASMap from its interval table. Use ASMap.compile instead."""
+        assert starts[0] == 0 and len(starts) == len(asns)
+        self._starts = starts
+        self._asns = asns
+
+    def __len__(self) -> int:
+        """Return the number of ranges in the interval table."""
+        return len(self._starts)
+
+    def lookup(self, addr: int) -> int:
+        """Look up an address, as returned by ip_to_int. Returns ASN, or 0 if unassigned."""
+        return self._asns[bisect.bisect_right(self._starts, addr) - 1]
+
+    def lookup_many(self, addrs: Iterable[int]) -> list[int]:
+        """Look up addresses, as returned by ip_to_int. Returns their ASNs, or 0 for unassigned ones."""
+        starts, asns, bisect_right = self._starts, self._asns, bisect.bisect_right
+        return [asns[bisect_right(starts, addr) - 1] for addr in addrs]
+
 @total_ordering
 class ASMap:
     """
@@ -315,13 +398,19 @@ class ASMap:
 
     def _set_trie(self, trie) -> None:
         """Set trie directly. Internal use only."""
-        def recurse(node: list) -> None:
+        # Merge identical leaf children, visiting children before their parent.
+        stack = [(trie, False)]
+        while stack:
+            node, children_done = stack.pop()
             if len(node) < 2:
-                return
-            recurse(node[0])
-            recurse(node[1])
+                continue
+            if not children_done:
+                stack.append((node, True))
+                stack.append((node[1], False))
+                stack.append((node[0], False))
+                continue
             if len(node[0]) == 2:
-                return
+                continue
             if node[0] == node[1]:
                 if len(node[0]) == 0:
                     node.clear()
@@ -329,7 +418,6 @@ class ASMap:
                     asn = node[0][0]
                     node.clear()
                     node.append(asn)
-        recurse(trie)
         self._trie = trie
 
     def __init__(self, entries: Optional[Iterable[ASNEntry]] = None) -> None:
@@ -354,6 +442,24 @@ class ASMap:
             return node[0]
         return None
 
+    def compile(self) -> CompiledASMap:
+        """Compile this ASMap object to a CompiledASMap, for fast lookups of many addresses."""
+        starts: list[int] = []
+        asns: list[int] = []
+        # Visit the leaves in address order, merging adjacent ones with the same ASN.
+        stack = [(self._trie, 0, 0)]
+        while stack:
+            node, start, depth = stack.pop()
+            if len(node) == 2:
+                stack.append((node[1], start | (1 << (127 - depth)), depth + 1))
+                stack.append((node[0], start, depth + 1))
+                continue
+            asn = node[0] if node else 0
+            if not asns or asns[-1] != asn:
+                starts.append(start)
+                asns.append(asn)
+        return CompiledASMap(starts, asns)
+
     def _to_entries_flat(self, fill: bool = False) -> list[ASNEntry]:
         """Convert an ASMap object to a list of non-overlapping (prefix, asn) objects."""
         prefix : list[bool] = []
@@ -473,14 +579,14 @@ class ASMap:
 
     def _to_binnode(self, fill: bool = False) -> _BinNode:
         """Convert a trie to a _BinNode object."""
-        def recurse(node: list) -> tuple[dict[Optional[int], _BinNode], bool]:
-            if len(node) == 1 and node[0] == 0:
+        def leaf(asn: int) -> tuple[dict[Optional[int], _BinNode], bool]:
+            if asn == 0:
                 return {(None if fill else 0): _BinNode.make_end()}, True
-            if len(node) == 1:
-                return {None: _BinNode.make_leaf(node[0]), node[0]: _BinNode.make_end()}, False
+            return {None: _BinNode.make_leaf(asn), asn: _BinNode.make_end()}, False
+
+        def branch(left: dict[Optional[int], _BinNode], lhole: bool, right: dict[Optional[int], _BinNode],
+                   rhole: bool) -> tuple[dict[Optional[int], _BinNode], bool]:
             ret: dict[Optional[int], _BinNode] = {}
-            left, lhole = recurse(node[0])
-            right, rhole = recurse(node[1])
             hole = (lhole or rhole) and not fill
 
             def candidate(ctx: Optional[int], arg1, arg2, func: Callable):
@@ -504,35 +610,40 @@ class ASMap:
             if hole:
                 ret = {ctx:enc for ctx, enc in ret.items() if ctx is None or ctx == 0}
             return ret, hole
-        res, _ = recurse(self._trie)
-        return res[0] if 0 in res else res[None]
 
-    @staticmethod
-    def _from_binnode(binnode: _BinNode) -> "ASMap":
-        """Construct an ASMap object from a _BinNode. Internal use only."""
-        def recurse(node: _BinNode, default: int) -> list:
-            if node.ins == _Instruction.RETURN:
-                return [node.arg1]
-            if node.ins == _Instruction.JUMP:
-                return [recurse(node.arg1, default), recurse(node.arg2, default)]
-            if node.ins == _Instruction.MATCH:
-                val = node.arg1
-                sub = recurse(node.arg2, default)
-                while val >= 2:
-                    bit = val & 1
-                    val >>= 1
-                    if bit:
-                        sub = [[default], sub]
-                    else:
-                        sub = [sub, [default]]
-                return sub
-            assert node.ins == _Instruction.DEFAULT
-            return recurse(node.arg2, node.arg1)
-        ret = ASMap()
-        if binnode.ins != _Instruction.END:
-            #pylint: disable=protected-access
-            ret._set_trie(recurse(binnode, 0))
-        return ret
+        # Visit the trie in post-order. Identical subtries have identical encodings, so those
+        # of small subtries are memoized (hash-consed) by the subtrie's structure: the ASN of
+        # a leaf, or the ids of the two children of other nodes. The memo is cleared when full,
+        # which keeps the memory use bounded while still finding nearby repeats.
+        memo: dict[tuple[int, ...], tuple[int, dict[Optional[int], _BinNode], bool]] = {}
+        results: list[tuple[int, dict[Optional[int], _BinNode], bool]] = []
+        next_id = 0
+        stack = [(self._trie, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if len(node) == 2 and not children_done:
+                stack.append((node, True))
+                stack.append((node[1], False))
+                stack.append((node[0], False))
+                continue
+            if len(node) == 2:
+                right_id, right, rhole = results.pop()
+                left_id, left, lhole = results.pop()
+                key: tuple[int, ...] = (left_id, right_id)
+            else:
+                key = (node[0],)
+            result = memo.get(key)
+            if result is None:
+                ret, hole = leaf(node[0]) if len(key) == 1 else branch(left, lhole, right, rhole)
+                result = (next_id, ret, hole)
+                next_id += 1
+                if min(enc.size for enc in ret.values()) <= _MAX_SHARED_SIZE:
+                    if len(memo) >= _MAX_SHARED_COUNT:
+                        memo.clear()
+                    memo[key] = result
+            results.append(result)
+        res = results[0][1]
+        return res[0] if 0 in res else res[None]
 
     def to_binary(self, fill: bool = False) -> bytes:
         """
@@ -545,85 +656,111 @@ class ASMap:
         Returns:
             A bytes object with the encoding of this ASMap object.
         """
-        bits: list[int] = []
-
-        def recurse(node: _BinNode) -> None:
-            _CODER_INS.encode(node.ins.value, bits)
+        binnode = self._to_binnode(fill)
+        ins_bits = {ins: _CODER_INS.encode_packed(ins.value) for ins in _Instruction if ins != _Instruction.END}
+
+        # Encode the nodes in pre-order. The bits are accumulated in an integer (the first bit in
+        # its lowest bit), which is flushed to the output in 64-bit little-endian words.
+        ret = bytearray()
+        acc = 0
+        nacc = 0
+        stack = [binnode] if binnode.ins != _Instruction.END else []
+        while stack:
+            node = stack.pop()
+            val, nbits = ins_bits[node.ins]
             if node.ins == _Instruction.RETURN:
-                _CODER_ASN.encode(node.arg1, bits)
+                arg, argbits = _CODER_ASN.encode_packed(node.arg1)
             elif node.ins == _Instruction.JUMP:
-                _CODER_JUMP.encode(node.arg1.size, bits)
-                recurse(node.arg1)
-                recurse(node.arg2)
-            elif node.ins == _Instruction.DEFAULT:
-                _CODER_ASN.encode(node.arg1, bits)
-                recurse(node.arg2)
+                arg, argbits = _CODER_JUMP.encode_packed(node.arg1.size)
+                stack.append(node.arg2)
+                stack.append(node.arg1)
             else:
-                assert node.ins == _Instruction.MATCH
-                _CODER_MATCH.encode(node.arg1, bits)
-                recurse(node.arg2)
-
-        binnode = self._to_binnode(fill)
-        if binnode.ins != _Instruction.END:
-            recurse(binnode)
-
-        val = 0
-        nbits = 0
-        ret = []
-        for bit in bits:
-            val += (bit << nbits)
-            nbits += 1
-            if nbits == 8:
-                ret.append(val)
-                val = 0
-                nbits = 0
-        if nbits:
-            ret.append(val)
+                coder = _CODER_ASN if node.ins == _Instruction.DEFAULT else _CODER_MATCH
+                arg, argbits = coder.encode_packed(node.arg1)
+                stack.append(node.arg2)
+            acc |= (val | (arg << nbits)) << nacc
+            nacc += nbits + argbits
+            if nacc >= 64:
+                ret += (acc & 0xFFFFFFFFFFFFFFFF).to_bytes(8, 'little')
+                acc >>= 64
+                nacc -= 64
+        ret += acc.to_bytes((nacc + 7) // 8, 'little')
+        assert len(ret) == (binnode.size + 7) // 8
         return bytes(ret)
 
     @staticmethod
-    def from_binary(bindata: bytes) -> Optional["ASMap"]:
-        """Decode an ASMap object from the provided binary encoding."""
-
-        bits: list[int] = []
-        for byte in bindata:
-            bits.extend((byte >> i) & 1 for i in range(8))
+    def _decode_trie(bits: str) -> tuple[list, int]:
+        """
+        Decode a binary asmap program from a string of '0' and '1' characters to a trie.
 
-        def recurse(bitpos: int) -> tuple[_BinNode, int]:
+        Returns the trie, and the position of the first bit after the program.
+        """
+        # Instructions waiting for their subprogram(s) to be decoded, with the default ASN of
+        # their context: (JUMP, default, expected end of the first subprogram),
+        # (None, default, trie of the first subprogram of a JUMP), (MATCH, default, match value)
+        # and (DEFAULT, default, None).
+        stack: list[tuple[Optional[_Instruction], int, Union[int, list, None]]] = []
+        default = 0
+        bitpos = 0
+        while True:
             insval, bitpos = _CODER_INS.decode(bits, bitpos)
             ins = _Instruction(insval)
-            if ins == _Instruction.RETURN:
-                asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-                return _BinNode(ins, asn), bitpos
             if ins == _Instruction.JUMP:
                 jump, bitpos = _CODER_JUMP.decode(bits, bitpos)
-                left, bitpos1 = recurse(bitpos)
-                if bitpos1 != bitpos + jump:
-                    raise ValueError("Inconsistent jump")
-                right, bitpos = recurse(bitpos1)
-                return _BinNode(ins, left, right), bitpos
+                stack.append((ins, default, bitpos + jump))
+                continue
             if ins == _Instruction.MATCH:
                 match, bitpos = _CODER_MATCH.decode(bits, bitpos)
-                sub, bitpos = recurse(bitpos)
-                return _BinNode(ins, match, sub), bitpos
-            assert ins == _Instruction.DEFAULT
+                stack.append((ins, default, match))
+                continue
+            if ins == _Instruction.DEFAULT:
+                asn, bitpos = _CODER_ASN.decode(bits, bitpos)
+                stack.append((ins, default, None))
+                default = asn
+                continue
+            assert ins == _Instruction.RETURN
             asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-            sub, bitpos = recurse(bitpos)
-            return _BinNode(ins, asn, sub), bitpos
+            node: list = [asn]
+            # Complete the instructions waiting for this subprogram, until one waits for another.
+            while stack:
+                ins, default, arg = stack.pop()
+                if ins == _Instruction.JUMP:
+                    if bitpos != arg:
+                        raise ValueError("Inconsistent jump")
+                    stack.append((None, default, node))
+                    break
+                if ins is None:
+                    node = [arg, node]
+                elif ins == _Instruction.MATCH:
+                    assert isinstance(arg, int)
+                    while arg >= 2:
+                        bit = arg & 1
+                        arg >>= 1
+                        if bit:
+                            node = [[default], node]
+                        else:
+                            node = [node, [default]]
+            else:
+                return node, bitpos
 
+    @staticmethod
+    def from_binary(bindata: bytes) -> Optional["ASMap"]:
+        """Decode an ASMap object from the provided binary encoding."""
+        bits = "".join(map(_BYTE_BITS.__getitem__, bindata))
+        ret = ASMap()
         if len(bits) == 0:
-            binnode = _BinNode(_Instruction.END)
-        else:
-            try:
-                binnode, bitpos = recurse(0)
-            except (ValueError, IndexError):
-                return None
-            if bitpos < len(bits) - 7:
-                return None
-            if not all(bit == 0 for bit in bits[bitpos:]):
-                return None
-
-        return ASMap._from_binnode(binnode)
+            return ret
+        try:
+            trie, bitpos = ASMap._decode_trie(bits)
+        except (ValueError, IndexError):
+            return None
+        if bitpos < len(bits) - 7:
+            return None
+        if '1' in bits[bitpos:]:
+            return None
+        #pylint: disable=protected-access
+        ret._set_trie(trie)
+        return ret
 
     def __lt__(self, other: "ASMap") -> bool:
         return self._trie < other._trie
@@ -651,27 +788,32 @@ class ASMap:
 
     def diff(self, other: "ASMap") -> list[ASNDiff]:
         """Compute the diff from self to other."""
-        prefix: list[bool] = []
-        ret: list[ASNDiff] = []
+        return list(self.iter_diff(other))
 
-        def recurse(old_node: list, new_node: list):
+    def iter_diff(self, other: "ASMap") -> Iterator[ASNDiff]:
+        """Compute the diff from self to other, yielding its entries in prefix order."""
+        assert isinstance(other, ASMap)
+        prefix: list[bool] = []
+        # Pairs of nodes to compare, with the length of their prefix and its last bit.
+        #pylint: disable=protected-access
+        stack: list[tuple[list, list, int, bool]] = [(self._trie, other._trie, 0, False)]
+        while stack:
+            old_node, new_node, depth, bit = stack.pop()
+            # Skip identical subtries without walking them in Python.
+            if old_node == new_node:
+                continue
+            if depth:
+                del prefix[depth - 1:]
+                prefix.append(bit)
             if len(old_node) == 1 and len(new_node) == 1:
-                if old_node[0] != new_node[0]:
-                    ret.append((list(prefix), old_node[0], new_node[0]))
+                yield list(prefix), old_node[0], new_node[0]
             else:
                 old_left: list = old_node if len(old_node) == 1 else old_node[0]
                 old_right: list = old_node if len(old_node) == 1 else old_node[1]
                 new_left: list = new_node if len(new_node) == 1 else new_node[0]
                 new_right: list = new_node if len(new_node) == 1 else new_node[1]
-                prefix.append(False)
-                recurse(old_left, new_left)
-                prefix[-1] = True
-                recurse(old_right, new_right)
-                prefix.pop()
-        assert isinstance(other, ASMap)
-        #pylint: disable=protected-access
-        recurse(self._trie, other._trie)
-        return ret
+                stack.append((old_right, new_right, depth + 1, True))
+                stack.append((old_left, new_left, depth + 1, False))
 
     def __copy__(self) -> "ASMap":
         """Construct a copy of this ASMap object. Its state will not be shared."""
@@ -814,5 +956,32 @@ class TestASMap(unittest.TestCase):
                                 # And such a patch must exist.
                                 self.assertTrue(found)
 
+    def test_compiled_lookup(self) -> None:
+        """Test that CompiledASMap lookups match ASMap lookups."""
+        for leaves in range(1, 40):
+            for pct in (0, 50, 100):
+                asmap = ASMap.from_random(num_leaves=leaves, max_asn=1 + (1 << random.randrange(24)),
+                                          unassigned_prob=0.01 * pct)
+                compiled = asmap.compile()
+                # Look up random addresses and the first and last address of every range.
+                #pylint: disable=protected-access
+                addrs = [random.getrandbits(128) for _ in range(20)]
+                addrs += compiled._starts + [start - 1 for start in compiled._starts[1:]] + [(1 << 128) - 1]
+                asns = compiled.lookup_many(addrs)
+                for addr, asn in zip(addrs, asns):
+                    prefix = [((addr >> (127 - i)) & 1) != 0 for i in range(128)]
+                    self.assertEqual(asmap.lookup(prefix), asn)
+                    self.assertEqual(compiled.lookup(addr), asn)
+                # Adjacent ranges have different ASNs.
+                self.assertTrue(all(a != b for a, b in zip(compiled._asns, compiled._asns[1:])))
+        for net in ["1.2.3.0/24", "2001:db8::/32"]:
+            network = ipaddress.ip_network(net)
+            asmap = ASMap([(net_to_prefix(network), 7)])
+            compiled = asmap.compile()
+            self.assertEqual(compiled.lookup(ip_to_int(network.network_address)), 7)
+            self.assertEqual(compiled.lookup(ip_to_int(network.broadcast_address)), 7)
+            self.assertEqual(compiled.lookup(ip_to_int(network.broadcast_address + 1)), 0)
+            self.assertEqual(compiled.lookup(ip_to_int(network.network_address - 1)), 0)
+
 if __name__ == '__main__':
     unittest.main()
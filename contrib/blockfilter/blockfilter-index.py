@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Build, verify and query a BIP158 basic block filter index from a node's block files.
+
+The index is built directly from the blk*.dat and rev*.dat files of a blocks directory, so
+the node does not need to run with -blockfilterindex. See README.md for usage examples."""
+
+import argparse
+import importlib.util
+from io import BytesIO
+from multiprocessing import Pool
+import os
+from pathlib import Path
+import struct
+import sys
+import urllib.parse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../test/functional'))
+
+from test_framework.authproxy import AuthServiceProxy       # noqa: E402
+from test_framework.blockfilter import (                    # noqa: E402
+    BasicBlockFilter,
+    bip158_basic_filter,
+)
+from test_framework.compressor import decompress_script     # noqa: E402
+from test_framework.messages import (                       # noqa: E402
+    CBlock,
+    deser_compact_size,
+    deser_varint,
+    hash256,
+)
+from test_framework.script import OP_RETURN                 # noqa: E402
+
+INDEX_MAGIC = b'bfidx'
+INDEX_VERSION = 1
+INDEX_HEADER_SIZE = len(INDEX_MAGIC) + 1
+# Per block height: block hash, filter header, offset and size of the filter in filters.dat
+INDEX_RECORD = struct.Struct("<32s32sQI")
+# Number of heights handed to a worker at once when querying
+QUERY_CHUNK_SIZE = 1000
+# Number of getblockfilter calls per RPC batch when verifying
+VERIFY_BATCH_SIZE = 500
+
+
+def load_linearize_data():
+    """Load contrib/linearize/linearize-data.py, for its blocksdir XOR key handling."""
+    path = Path(__file__).resolve().parent.parent / "linearize" / "linearize-data.py"
+    spec = importlib.util.spec_from_file_location("linearize_data", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+linearize_data = load_linearize_data()
+
+
+def read_records(path, netmagic, xor_key):
+    """Read a blk or rev file and yield the payloads of its records (netmagic, size, payload)."""
+    with open(path, 'rb') as f:
+        data = linearize_data.read_xored(f, os.path.getsize(path), xor_key)
+    pos = 0
+    while True:
+        pos = data.find(netmagic, pos)
+        if pos == -1 or pos + 8 > len(data):
+            return
+        size = int.from_bytes(data[pos + 4:pos + 8], 'little')
+        start = pos + 8
+        if start + size > len(data):
+            return
+        # rev records are followed by a 32 byte checksum, which is not counted in the size
+        yield data[start:start + size], data[start + size:start + size + 32]
+        pos = start + size
+
+
+def parse_block_undo(data):
+    """Parse a serialized CBlockUndo into the spent scriptPubKeys, per non-coinbase transaction."""
+    f = BytesIO(data)
+    txs_spent = []
+    for _ in range(deser_compact_size(f)):
+        spent = []
+        for _ in range(deser_compact_size(f)):
+            code = deser_varint(f)
+            if code >> 1 > 0:
+                deser_varint(f)  # unused transaction version, see TxInUndoFormatter
+            deser_varint(f)  # compressed amount
+            spent.append(decompress_script(f))
+        txs_spent.append(spent)
+    return txs_spent
+
+
+def scan_block_file(args):
+    """Build the filters of all blocks in a blk file, using the undo data of the matching rev file.
+
+    Returns a list of (block hash, previous block hash, nBits, filter) tuples, with hashes in internal
+    byte order. The filter is None for blocks without undo data (blocks that were never connected).
+    """
+    blocks_dir, file_number, netmagic, xor_key = args
+    # Undo records are matched to blocks by the number of inputs of each transaction, and then by
+    # their checksum, which commits to the previous block hash.
+    undos = {}
+    rev_path = blocks_dir / f"rev{file_number:05d}.dat"
+    if rev_path.exists():
+        for payload, checksum in read_records(rev_path, netmagic, xor_key):
+            txs_spent = parse_block_undo(payload)
+            key = tuple(len(spent) for spent in txs_spent)
+            undos.setdefault(key, []).append((payload, checksum, txs_spent))
+
+    results = []
+    for payload, _ in read_records(blocks_dir / f"blk{file_number:05d}.dat", netmagic, xor_key):
+        block = CBlock()
+        block.deserialize(BytesIO(payload))
+        block_hash, prev_hash = hash256(payload[:80]), payload[4:36]
+        bits = int.from_bytes(payload[72:76], 'little')
+        key = tuple(len(tx.vin) for tx in block.vtx[1:])
+        spent_scripts = None
+        if not key:
+            spent_scripts = []
+        for undo_payload, checksum, txs_spent in undos.get(key, []):
+            if hash256(prev_hash + undo_payload) == checksum:
+                spent_scripts = [spk for spent in txs_spent for spk in spent]
+                break
+        if spent_scripts is None:
+            results.append((block_hash, prev_hash, bits, None))
+            continue
+        output_scripts = [bytes(txout.scriptPubKey) for tx in block.vtx for txout in tx.vout
+                          if txout.scriptPubKey[:1] != bytes([OP_RETURN])]
+        results.append((block_hash, prev_hash, bits, bip158_basic_filter(block_hash[::-1].hex(), spent_scripts + output_scripts)))
+    return results
+
+
+def block_work(bits):
+    """Return the expected number of hashes needed for a block with the compact target bits, like GetBlockProof()."""
+    exponent, mantissa = bits >> 24, bits & 0x007fffff
+    target = mantissa << 8 * (exponent - 3) if exponent >= 3 else mantissa >> 8 * (3 - exponent)
+    if bits & 0x00800000 or target == 0 or target >= 1 << 256:
+        return 0
+    return (1 << 256) // (target + 1)
+
+
+def select_chain(headers, hashlist):
+    """Return the block hashes (internal byte order) of the chain to index, ordered by height.
+
+    headers maps the hash of every block found to its previous block hash and nBits, in the order the
+    blocks were found in the block files. Without a hashlist (as written by linearize-hashes.py), the
+    chain with the most work starting at a block with a null previous block hash is used. Of chains
+    with equal work, the one whose tip comes first in the block files is used, as the node prefers the
+    one it received first. The node's active chain can still differ, e.g. if the chain with the most
+    work has an invalid block, so pass a hashlist when the exact chain matters.
+    """
+    if hashlist is not None:
+        with open(hashlist, encoding="utf8") as f:
+            return [bytes.fromhex(line.strip())[::-1] for line in f if line.strip()]
+    order = {block_hash: i for i, block_hash in enumerate(headers)}
+    children = {}
+    for block_hash, (prev_hash, _) in headers.items():
+        children.setdefault(prev_hash, []).append(block_hash)
+    chainwork, tip = {}, None
+    todo = [(block_hash, 0) for block_hash in children.get(bytes(32), [])]
+    while todo:
+        block_hash, prev_work = todo.pop()
+        chainwork[block_hash] = prev_work + block_work(headers[block_hash][1])
+        if tip is None or (chainwork[block_hash], -order[block_hash]) > (chainwork[tip], -order[tip]):
+            tip = block_hash
+        todo += [(child, chainwork[block_hash]) for child in children.get(block_hash, [])]
+    chain = []
+    while tip in chainwork:
+        chain.append(tip)
+        tip = headers[tip][0]
+    return chain[::-1]
+
+
+def build(args):
+    blocks_dir = Path(args.blocksdir)
+    netmagic = bytes.fromhex(args.netmagic)
+    xor_key = linearize_data.read_xor_key(blocks_dir)
+    file_numbers = sorted(int(path.name[3:8]) for path in blocks_dir.glob("blk[0-9][0-9][0-9][0-9][0-9].dat"))
+    index_dir = Path(args.index)
+    index_dir.mkdir(parents=True, exist_ok=True)
+
+    # Filters are appended to filters.dat in the order the block files are scanned, only their
+    # location is kept in memory.
+    headers, locations = {}, {}
+    with open(index_dir / "filters.dat", 'wb') as filters_file, Pool(args.jobs) as pool:
+        tasks = [(blocks_dir, file_number, netmagic, xor_key) for file_number in file_numbers]
+        for file_number, results in zip(file_numbers, pool.imap(scan_block_file, tasks)):
+            for block_hash, prev_hash, bits, filter_bytes in results:
+                headers[block_hash] = (prev_hash, bits)
+                if filter_bytes is not None:
+                    locations[block_hash] = (filters_file.tell(), len(filter_bytes), hash256(filter_bytes))
+                    filters_file.write(filter_bytes)
+            print(f"Scanned blk{file_number:05d}.dat ({len(headers)} blocks)", file=sys.stderr)
+
+    chain = select_chain(headers, args.hashlist)
+    if not chain or chain[0] not in locations:
+        sys.exit("Genesis block not found in the block files (is the node pruned?)")
+    filter_header, indexed = bytes(32), 0
+    with open(index_dir / "index.dat", 'wb') as index_file:
+        index_file.write(INDEX_MAGIC + bytes([INDEX_VERSION]))
+        for block_hash in chain:
+            if block_hash not in locations:
+                # Blocks which are stored but not connected (yet) have no undo data.
+                print(f"No block or undo data for block {block_hash[::-1].hex()}, stopping at height {indexed - 1}", file=sys.stderr)
+                break
+            offset, size, filter_hash = locations[block_hash]
+            filter_header = hash256(filter_hash + filter_header)
+            index_file.write(INDEX_RECORD.pack(block_hash, filter_header, offset, size))
+            indexed += 1
+    print(f"Indexed {indexed} blocks, up to block {chain[indexed - 1][::-1].hex()}")
+
+
+class FilterIndex:
+    """Read access to an index created by the build command."""
+
+    def __init__(self, path):
+        path = Path(path)
+        with open(path / "index.dat", 'rb') as f:
+            assert f.read(INDEX_HEADER_SIZE) == INDEX_MAGIC + bytes([INDEX_VERSION]), "not a filter index"
+            self.records = f.read()
+        self.filters_path = path / "filters.dat"
+        self.filters_file = None
+
+    def __len__(self):
+        return len(self.records) // INDEX_RECORD.size
+
+    def __getitem__(self, height):
+        """Return the block hash, filter header (both hex) and the serialized filter at a height."""
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError(height)
+        block_hash, filter_header, offset, size = INDEX_RECORD.unpack_from(self.records, height * INDEX_RECORD.size)
+        if self.filters_file is None:
+            self.filters_file = open(self.filters_path, 'rb')
+        self.filters_file.seek(offset)
+        return block_hash[::-1].hex(), filter_header[::-1].hex(), self.filters_file.read(size)
+
+
+def verify(args):
+    index = FilterIndex(args.index)
+    url = urllib.parse.urlparse(args.rpcurl)
+    if args.rpccookiefile is not None:
+        with open(args.rpccookiefile, encoding="utf8") as f:
+            userpass = f.read().strip()
+        url = url._replace(netloc=f"{userpass}@{url.hostname}:{url.port}")
+    rpc = AuthServiceProxy(url.geturl())
+    mismatches = 0
+    for start in range(0, len(index), VERIFY_BATCH_SIZE):
+        heights = range(start, min(start + VERIFY_BATCH_SIZE, len(index)))
+        entries = [index[height] for height in heights]
+        responses = rpc.batch([rpc.getblockfilter.get_request(block_hash, "basic") for block_hash, _, _ in entries])
+        for height, (block_hash, filter_header, filter_bytes), response in zip(heights, entries, responses):
+            if response.get('error') is not None:
+                sys.exit(f"getblockfilter failed for block {block_hash}: {response['error']['message']}")
+            if response['result'] != {"filter": filter_bytes.hex(), "header": filter_header}:
+                print(f"Mismatch at height {height}, block {block_hash}")
+                mismatches += 1
+    if mismatches:
+        sys.exit(f"{mismatches} of {len(index)} filters differ from the node's")
+    print(f"All {len(index)} filters and filter headers match")
+
+
+def query_worker_init(index_path, scripts):
+    global query_index, query_scripts
+    query_index = FilterIndex(index_path)
+    query_scripts = scripts
+
+
+def query_range(heights):
+    matches = []
+    for height in heights:
+        block_hash, _, filter_bytes = query_index[height]
+        matching = BasicBlockFilter(block_hash, filter_bytes).matching(query_scripts)
+        if matching:
+            matches.append((height, block_hash, matching))
+    return matches
+
+
+def query(args):
+    index = FilterIndex(args.index)
+    scripts = [bytes.fromhex(script) for script in args.scripts]
+    if args.scripts_file is not None:
+        with open(args.scripts_file, encoding="utf8") as f:
+            scripts += [bytes.fromhex(line.strip()) for line in f if line.strip()]
+    end = len(index) if args.end is None else min(args.end + 1, len(index))
+    chunks = [range(start, min(start + QUERY_CHUNK_SIZE, end)) for start in range(args.start, end, QUERY_CHUNK_SIZE)]
+    with Pool(args.jobs, initializer=query_worker_init, initargs=(args.index, scripts)) as pool:
+        for matches in pool.imap(query_range, chunks):
+            for height, block_hash, matching in matches:
+                print(height, block_hash, *(script.hex() for script in matching))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="build the index from blk*.dat and rev*.dat files")
+    verify_parser = subparsers.add_parser('verify', help="compare the index with the node's getblockfilter results")
+    query_parser = subparsers.add_parser('query', help="list the blocks whose filters match any of the given scriptPubKeys")
+    for subparser in [build_parser, verify_parser, query_parser]:
+        subparser.add_argument('index', help="index directory")
+    for subparser in [build_parser, query_parser]:
+        subparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="number of worker processes (default: number of CPUs)")
+
+    build_parser.add_argument('--blocksdir', required=True, help="blocks directory of the node")
+    build_parser.add_argument('--netmagic', default='f9beb4d9', help="network magic of the block files (default: mainnet)")
+    build_parser.add_argument('--hashlist', help="file with the block hashes of the chain to index, as written by linearize-hashes.py "
+                                                 "(default: the chain with the most work in the block files)")
+    build_parser.set_defaults(func=build)
+
+    verify_parser.add_argument('--rpcurl', default='http://127.0.0.1:8332', help="RPC URL of the node, optionally including user and password")
+    verify_parser.add_argument('--rpccookiefile', help="use the credentials from this RPC cookie file")
+    verify_parser.set_defaults(func=verify)
+
+    query_parser.add_argument('scripts', nargs='*', metavar='script', help="hex encoded scriptPubKey")
+    query_parser.add_argument('--scripts-file', help="file with one hex encoded scriptPubKey per line")
+    query_parser.add_argument('--start', type=int, default=0, help="first height to query (default: 0)")
+    query_parser.add_argument('--end', type=int, help="last height to query (default: tip of the index)")
+    query_parser.set_defaults(func=query)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
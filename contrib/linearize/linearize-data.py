@@ -7,6 +7,10 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 
+import errno
+import io
+import mmap
+from multiprocessing import Pool
 import struct
 import re
 import os
@@ -86,6 +90,141 @@ def read_xor_key(blocks_path):
     except FileNotFoundError:
         return bytes([0] * NUM_XOR_BYTES)
 
+# Number of bytes XORed at once as a single integer, bounding the memory used for large blocks
+XOR_WINDOW_SIZE = 1 << 20
+
+def xor_bytes(data, xor_key, offset):
+    """XOR data, found at offset in its block file, with the blocksdir xor_key.
+
+    The key is repeated to the length of the data, so that the data can be XORed as one large
+    integer instead of byte by byte.
+    """
+    if not any(xor_key) or not data:
+        return bytes(data)
+    shift = offset % len(xor_key)
+    key = xor_key[shift:] + xor_key[:shift]
+    window = min(len(data), XOR_WINDOW_SIZE)
+    window_key = key * (window // len(key)) + key[:window % len(key)]
+    window_key_int = int.from_bytes(window_key, 'little')
+    data = memoryview(data)
+    chunks = []
+    # Windows are a multiple of the key size (except for the last one), so every window starts with the same key byte.
+    for start in range(0, len(data), window):
+        chunk = data[start:start + window]
+        chunk_key_int = window_key_int if len(chunk) == window else int.from_bytes(window_key[:len(chunk)], 'little')
+        chunks.append((int.from_bytes(chunk, 'little') ^ chunk_key_int).to_bytes(len(chunk), 'little'))
+    return b"".join(chunks)
+
+def read_xored(f, size, xor_key):
+    """Read size bytes from f and de-obfuscate them with the blocksdir xor_key."""
+    offset = f.tell()
+    return xor_bytes(f.read(size), xor_key, offset)
+
+def open_block_file(path):
+    """Memory-map a block file for reading. The result supports read(), seek() and tell() like a file."""
+    with open(path, "rb") as f:
+        # Empty files can't be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return io.BytesIO()
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def seek_forward(f, size):
+    """Seek size bytes forward in a mapped block file, stopping at its end."""
+    f.seek(min(f.tell() + size, len(f)))
+
+def find_magic(f, start, magic, xor_key):
+    """Return the position of the first obfuscated magic at or after start in a mapped block file, or None."""
+    if not any(xor_key):
+        pos = f.find(magic, start)
+        return None if pos == -1 else pos
+    # The magic looks different depending on its position relative to the key
+    positions = []
+    for phase in range(len(xor_key)):
+        pattern = xor_bytes(magic, xor_key, phase)
+        pos = f.find(pattern, start)
+        while pos != -1 and pos % len(xor_key) != phase:
+            pos = f.find(pattern, pos + 1)
+        if pos != -1:
+            positions.append(pos)
+    return min(positions, default=None)
+
+# Extent index of the blocks in the block files, used by ExtentIndexCopier
+EXTENT_INDEX_MAGIC = b'lnidx'
+EXTENT_INDEX_VERSION = 2
+# Magic, version, netmagic, xor key, length of the input path and number of block files, followed by the
+# resolved input path
+EXTENT_INDEX_HEADER = struct.Struct("<5sB4s8sHI")
+# Per block file: file number, offset up to which it was scanned, modification time (ns) before the scan and
+# number of blocks found. bitcoind preallocates block files, so they are written to without growing.
+EXTENT_INDEX_FILE = struct.Struct("<IQqI")
+# Per block: block hash, offset and size of its record (netmagic, size, header and block data)
+EXTENT_INDEX_BLOCK = struct.Struct("<32sQI")
+# Number of input files kept open while copying
+MAX_OPEN_INPUT_FILES = 64
+
+def scan_block_file(task):
+    '''Find the blocks in a block file from an offset on, in a worker process.
+
+    Returns the file number, the offset after the last complete block, from which scanning continues
+    once the file has grown, and a list of (block hash, record offset, record size).
+    '''
+    fn, path, start, netmagic, xor_key = task
+    blocks = []
+    with open_block_file(path) as f:
+        pos = scanned = start
+        while pos + 88 <= len(f):
+            inhdr = xor_bytes(f[pos:pos + 8], xor_key, pos)
+            size = 8 + struct.unpack("<I", inhdr[4:])[0]
+            if inhdr[:4] != netmagic or size < 88 or pos + size > len(f):
+                # Not a block, or one that is still being written
+                pos = find_magic(f, pos + 1, netmagic, xor_key)
+                if pos is None:
+                    break
+                continue
+            blk_hdr = xor_bytes(f[pos + 8:pos + 88], xor_key, pos + 8)
+            blocks.append((hashlib.sha256(hashlib.sha256(blk_hdr).digest()).digest(), pos, size))
+            pos = scanned = pos + size
+    return fn, scanned, blocks
+
+def read_extent_index(path, input_path, netmagic, xor_key):
+    '''Read an extent index as a dict of file number to (scanned offset, modification time, blocks).
+
+    Returns an empty index if there is none yet, or it belongs to another network or blocks directory.
+    '''
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {}
+    if len(data) < EXTENT_INDEX_HEADER.size:
+        return {}
+    magic, version, index_netmagic, index_xor_key, path_size, file_count = EXTENT_INDEX_HEADER.unpack_from(data)
+    pos = EXTENT_INDEX_HEADER.size
+    index_input_path = data[pos:pos + path_size]
+    pos += path_size
+    if (magic, version, index_netmagic, index_xor_key, index_input_path) != (EXTENT_INDEX_MAGIC, EXTENT_INDEX_VERSION, netmagic, xor_key, os.fsencode(input_path)):
+        print("Ignoring extent index " + path + " of other block data")
+        return {}
+    files = {}
+    for _ in range(file_count):
+        fn, scanned, mtime, block_count = EXTENT_INDEX_FILE.unpack_from(data, pos)
+        pos += EXTENT_INDEX_FILE.size
+        end = pos + block_count * EXTENT_INDEX_BLOCK.size
+        files[fn] = (scanned, mtime, list(EXTENT_INDEX_BLOCK.iter_unpack(data[pos:end])))
+        pos = end
+    return files
+
+def write_extent_index(path, input_path, netmagic, xor_key, files):
+    '''Write an extent index, replacing the previous one only once complete.'''
+    input_path = os.fsencode(input_path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(EXTENT_INDEX_HEADER.pack(EXTENT_INDEX_MAGIC, EXTENT_INDEX_VERSION, netmagic, xor_key, len(input_path), len(files)))
+        f.write(input_path)
+        for fn, (scanned, mtime, blocks) in sorted(files.items()):
+            f.write(EXTENT_INDEX_FILE.pack(fn, scanned, mtime, len(blocks)))
+            f.write(b"".join(EXTENT_INDEX_BLOCK.pack(*block) for block in blocks))
+    os.replace(path + ".tmp", path)
+
 # Block header and extent on disk
 BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'inhdr', 'blkhdr', 'size'])
 
@@ -125,14 +264,18 @@ class BlockDataCopier:
         self.outOfOrderSize = 0 # running total size for items in outOfOrderData
 
     def read_xored(self, f, size):
-        offset = f.tell()
-        data = bytearray(f.read(size))
-        for i in range(len(data)):
-            data[i] ^= self.xor_key[(i + offset) % len(self.xor_key)]
-        return bytes(data)
+        return read_xored(f, size, self.xor_key)
 
     def writeBlock(self, inhdr, blk_hdr, rawblock):
         blockSizeOnDisk = len(inhdr) + len(blk_hdr) + len(rawblock)
+        blkTS = self.startBlock(blockSizeOnDisk, blk_hdr)
+        self.outF.write(inhdr)
+        self.outF.write(blk_hdr)
+        self.outF.write(rawblock)
+        self.finishBlock(blockSizeOnDisk, blkTS)
+
+    def startBlock(self, blockSizeOnDisk, blk_hdr):
+        '''Switch to the output file the next block goes into, returning the block's timestamp.'''
         if not self.fileOutput and ((self.outsz + blockSizeOnDisk) > self.maxOutSz):
             self.outF.close()
             if self.setFileTime:
@@ -162,11 +305,10 @@ class BlockDataCopier:
                 self.outFname = os.path.join(self.settings['output'], "blk%05d.dat" % self.outFn)
             print("Output file " + self.outFname)
             self.outF = open(self.outFname, "wb")
+        return blkTS
 
-        self.outF.write(inhdr)
-        self.outF.write(blk_hdr)
-        self.outF.write(rawblock)
-        self.outsz = self.outsz + len(inhdr) + len(blk_hdr) + len(rawblock)
+    def finishBlock(self, blockSizeOnDisk, blkTS):
+        self.outsz = self.outsz + blockSizeOnDisk
 
         self.blkCountOut = self.blkCountOut + 1
         if blkTS > self.highTS:
@@ -181,7 +323,7 @@ class BlockDataCopier:
 
     def fetchBlock(self, extent):
         '''Fetch block contents from disk given extents'''
-        with open(self.inFileName(extent.fn), "rb") as f:
+        with open_block_file(self.inFileName(extent.fn)) as f:
             f.seek(extent.offset)
             return self.read_xored(f, extent.size)
 
@@ -203,7 +345,7 @@ class BlockDataCopier:
                 fname = self.inFileName(self.inFn)
                 print("Input file " + fname)
                 try:
-                    self.inF = open(fname, "rb")
+                    self.inF = open_block_file(fname)
                 except IOError:
                     print("Premature end of block data")
                     return
@@ -217,10 +359,10 @@ class BlockDataCopier:
 
             inMagic = inhdr[:4]
             if (inMagic != self.settings['netmagic']):
-                # Seek backwards 7 bytes (skipping the first byte in the previous search)
-                # and continue searching from the new position if the magic bytes are not
-                # found.
-                self.inF.seek(-7, os.SEEK_CUR)
+                # Continue searching from the second byte of the previous search, jumping to the
+                # next magic bytes, or to the end of the file if there are none.
+                pos = find_magic(self.inF, self.inF.tell() - len(inhdr) + 1, self.settings['netmagic'], self.xor_key)
+                self.inF.seek(len(self.inF) if pos is None else pos)
                 continue
             inLenLE = inhdr[4:]
             su = struct.unpack("<I", inLenLE)
@@ -234,7 +376,7 @@ class BlockDataCopier:
                 # may encounter blocks it doesn't know about. Treat as debug output.
                 if settings['debug_output'] == 'true':
                     print("Skipping unknown block " + self.hash_str)
-                self.inF.seek(inLen, os.SEEK_CUR)
+                seek_forward(self.inF, inLen)
                 continue
 
             blkHeight = self.blkmap[self.hash_str]
@@ -258,7 +400,171 @@ class BlockDataCopier:
                     self.outOfOrderData[blkHeight] = self.read_xored(self.inF, inLen)
                     self.outOfOrderSize += inLen
                 else: # If no space in cache, seek forward
-                    self.inF.seek(inLen, os.SEEK_CUR)
+                    seek_forward(self.inF, inLen)
+
+        print("Done (%i blocks written)" % (self.blkCountOut))
+
+class ExtentIndexCopier(BlockDataCopier):
+    '''Copy the blocks in two phases: find all blocks in the block files in parallel, then write them in order.
+
+    The locations of the blocks are kept in an extent index file, so that a later run only scans the data
+    appended to the block files since. Blocks already written by an earlier run are kept.
+    '''
+    def __init__(self, settings, blkindex, blkmap):
+        super().__init__(settings, blkindex, blkmap)
+        self.inFiles = {}
+        # Without obfuscation, blocks can be copied by the kernel
+        self.copyFileRange = hasattr(os, 'copy_file_range') and not any(self.xor_key)
+
+    def scanBlockFiles(self, rescan=False):
+        '''Update the extent index, or rebuild it if rescan is set, and return a dict of block hash to
+        (file number, offset, size).'''
+        netmagic = self.settings['netmagic']
+        index_path = self.settings['extent_index']
+        # The index is only valid for the blocks directory it was built from
+        input_path = os.path.realpath(self.settings['input'])
+        index_files = {} if rescan else read_extent_index(index_path, input_path, netmagic, self.xor_key)
+        files = {}
+        tasks = []
+        for path in sorted(glob.glob(os.path.join(self.settings['input'], "blk[0-9][0-9][0-9][0-9][0-9].dat"))):
+            fn = int(os.path.basename(path)[3:8])
+            scanned, mtime, blocks = index_files.get(fn, (0, None, []))
+            # Taken before scanning, so that a file written to during the scan is scanned again next time
+            stat = os.stat(path)
+            if stat.st_size < scanned:
+                # The file was rewritten, e.g. by -reindex
+                scanned, blocks = 0, []
+            files[fn] = (scanned, stat.st_mtime_ns, blocks)
+            if stat.st_mtime_ns != mtime:
+                tasks.append((fn, path, scanned, netmagic, self.xor_key))
+
+        if tasks:
+            jobs = min(self.settings['scan_jobs'], len(tasks))
+            print("Scanning %i block files with %i processes" % (len(tasks), jobs))
+            with Pool(jobs) as pool:
+                for fn, scanned, blocks in pool.imap_unordered(scan_block_file, tasks):
+                    files[fn] = (scanned, files[fn][1], files[fn][2] + blocks)
+        if tasks or files.keys() != index_files.keys():
+            write_extent_index(index_path, input_path, netmagic, self.xor_key, files)
+
+        # Use the first copy of blocks found more than once
+        extents = {}
+        for fn in sorted(files, reverse=True):
+            for blkhash, offset, size in reversed(files[fn][2]):
+                extents[blkhash] = (fn, offset, size)
+        print("Found %i blocks in %i block files" % (len(extents), len(files)))
+        return extents
+
+    def outFileName(self, fn):
+        if self.fileOutput:
+            return self.settings['output_file']
+        return os.path.join(self.settings['output'], "blk%05d.dat" % fn)
+
+    def resumeOutput(self):
+        '''Keep the blocks at the start of the output which match the hash list, and append after them.'''
+        fn = 0
+        resume = None
+        while os.path.exists(self.outFileName(fn)):
+            fname = self.outFileName(fn)
+            fsize = os.path.getsize(fname)
+            pos = 0
+            with open(fname, "rb") as f:
+                while self.blkCountOut < len(self.blkindex):
+                    hdr = f.read(88)
+                    if len(hdr) < 88 or hdr[:4] != self.settings['netmagic']:
+                        break
+                    size = 8 + struct.unpack("<I", hdr[4:8])[0]
+                    if pos + size > fsize or calc_hash_str(hdr[8:]) != self.blkindex[self.blkCountOut]:
+                        break
+                    (blkDate, blkTS) = get_blk_dt(hdr[8:])
+                    self.lastDate = max(self.lastDate, blkDate)
+                    self.highTS = max(self.highTS, blkTS)
+                    self.blkCountOut += 1
+                    pos += size
+                    f.seek(pos)
+            if pos > 0:
+                resume = (fn, pos)
+            if pos < fsize or self.fileOutput:
+                break
+            fn += 1
+
+        if resume is None:
+            return
+        self.outFn, self.outsz = resume
+        self.outFname = self.outFileName(self.outFn)
+        print("Keeping %i blocks in %s and earlier output files" % (self.blkCountOut, self.outFname))
+        self.outF = open(self.outFname, "r+b")
+        self.outF.truncate(self.outsz)
+        self.outF.seek(self.outsz)
+        # Remove output files of the earlier run past the point where it diverged
+        fn = self.outFn + 1
+        while not self.fileOutput and os.path.exists(self.outFileName(fn)):
+            os.remove(self.outFileName(fn))
+            fn += 1
+
+    def inFile(self, fn):
+        '''Return the open input file fn, keeping the most recently used ones open.'''
+        f = self.inFiles.pop(fn, None)
+        if f is None:
+            if len(self.inFiles) >= MAX_OPEN_INPUT_FILES:
+                self.inFiles.pop(next(iter(self.inFiles))).close()
+            f = open(self.inFileName(fn), "rb")
+        self.inFiles[fn] = f
+        return f
+
+    def copyBlock(self, fn, offset, size):
+        '''Copy the block self.hash_str from its extent. Returns False, without writing anything, if the
+        extent holds another block, because the block file changed since the extent index was updated.'''
+        f = self.inFile(fn)
+        f.seek(offset)
+        hdr = self.read_xored(f, 88)
+        if len(hdr) < 88 or hdr[:4] != self.settings['netmagic'] or calc_hash_str(hdr[8:]) != self.hash_str:
+            return False
+        blkTS = self.startBlock(size, hdr[8:])
+        copied = 0
+        if self.copyFileRange:
+            self.outF.flush()
+            try:
+                while copied < size:
+                    copied += os.copy_file_range(f.fileno(), self.outF.fileno(), size - copied, offset + copied)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                # Not supported for these files, copy through user space from now on
+                self.copyFileRange = False
+        if copied < size:
+            f.seek(offset + copied)
+            self.outF.write(self.read_xored(f, size - copied))
+        self.finishBlock(size, blkTS)
+        return True
+
+    def run(self):
+        extents = self.scanBlockFiles()
+        self.blkCountIn = len(extents)
+        self.resumeOutput()
+        rescanned = False
+        while self.blkCountOut < len(self.blkindex):
+            self.hash_str = self.blkindex[self.blkCountOut]
+            extent = extents.get(bytes.fromhex(self.hash_str)[::-1])
+            if extent is None:
+                print("Block %s at height %i not found in block data" % (self.hash_str, self.blkCountOut))
+                break
+            if not self.copyBlock(*extent):
+                if rescanned:
+                    print("Block %s at height %i changed while copying" % (self.hash_str, self.blkCountOut))
+                    break
+                # E.g. the block files were rewritten by -reindex, without shrinking
+                print("Block %s not found at its indexed location, rescanning all block files" % self.hash_str)
+                for f in self.inFiles.values():
+                    f.close()
+                self.inFiles = {}
+                extents = self.scanBlockFiles(rescan=True)
+                self.blkCountIn = len(extents)
+                rescanned = True
+        if self.outF:
+            self.outF.close()
+        for f in self.inFiles.values():
+            f.close()
 
         print("Done (%i blocks written)" % (self.blkCountOut))
 
@@ -304,6 +610,8 @@ if __name__ == '__main__':
         settings['out_of_order_cache_sz'] = 100 * 1000 * 1000
     if 'debug_output' not in settings:
         settings['debug_output'] = 'false'
+    if 'scan_jobs' not in settings:
+        settings['scan_jobs'] = os.cpu_count() or 1
 
     settings['max_out_sz'] = int(settings['max_out_sz'])
     settings['split_timestamp'] = int(settings['split_timestamp'])
@@ -311,6 +619,7 @@ if __name__ == '__main__':
     settings['netmagic'] = bytes.fromhex(settings['netmagic'])
     settings['out_of_order_cache_sz'] = int(settings['out_of_order_cache_sz'])
     settings['debug_output'] = settings['debug_output'].lower()
+    settings['scan_jobs'] = int(settings['scan_jobs'])
 
     if 'output_file' not in settings and 'output' not in settings:
         print("Missing output file / directory")
@@ -322,5 +631,7 @@ if __name__ == '__main__':
     # Block hash map won't be byte-reversed. Neither should the genesis hash.
     if not settings['genesis'] in blkmap:
         print("Genesis block not found in hashlist")
+    elif 'extent_index' in settings:
+        ExtentIndexCopier(settings, blkindex, blkmap).run()
     else:
         BlockDataCopier(settings, blkindex, blkmap).run()
@@ -7,6 +7,8 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from http.client import HTTPConnection
 import json
 import re
@@ -14,9 +16,16 @@ import base64
 import sys
 import os
 import os.path
+import threading
+import time
 
 settings = {}
 
+# Bounds of the number of getblockhash calls per batch. Within them, the batch size is adapted so that
+# a batch takes about TARGET_CALL_TIME seconds.
+MIN_BLOCKS_PER_CALL = 100
+TARGET_CALL_TIME = 0.5
+
 class BitcoinRPC:
     def __init__(self, host, port, username, password):
         authpair = "%s:%s" % (username, password)
@@ -58,32 +67,104 @@ class BitcoinRPC:
     def response_is_error(resp_obj):
         return 'error' in resp_obj and resp_obj['error'] is not None
 
+def format_hash(settings, blkhash):
+    if settings['rev_hash_bytes'] == 'true':
+        return bytes.fromhex(blkhash)[::-1].hex()
+    return blkhash
+
+def resume_hashlist(settings, rpc):
+    '''Keep the hashes at the start of the hashlist file which are still in the active chain.
+
+    Returns the file, opened for appending, and the height of the next hash to write.
+    '''
+    path = settings['hashlist']
+    try:
+        with open(path, 'rb') as f:
+            lines = f.read().split(b'\n')[:-1]
+    except FileNotFoundError:
+        lines = []
+    lines = lines[:max(0, settings['max_height'] + 1 - settings['min_height'])]
+
+    def in_chain(count):
+        '''Whether the first count hashes of the file are in the active chain.'''
+        if count == 0:
+            return True
+        height = settings['min_height'] + count - 1
+        reply = rpc.execute(rpc.build_request(0, 'getblockhash', [height]))
+        if reply is None:
+            print('Cannot continue. Program will halt.')
+            sys.exit(1)
+        return not rpc.response_is_error(reply) and lines[count - 1].decode().rstrip() == format_hash(settings, reply['result'])
+
+    # Hashes are written in height order, so the hashes in the active chain are a prefix of the file: if
+    # a block is in it, so are its ancestors. Search for its length.
+    low, high = 0, len(lines)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if in_chain(mid):
+            low = mid
+        else:
+            high = mid - 1
+    if low < len(lines):
+        print('Removing %i hashes not in the active chain from %s' % (len(lines) - low, path), file=sys.stderr)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'ab') as f:
+        f.truncate(sum(len(line) + 1 for line in lines[:low]))
+    return open(path, 'a', encoding="ascii"), settings['min_height'] + low
+
 def get_block_hashes(settings, max_blocks_per_call=10000):
     rpc = BitcoinRPC(settings['host'], settings['port'],
              settings['rpcuser'], settings['rpcpassword'])
 
-    height = settings['min_height']
-    while height < settings['max_height']+1:
-        num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
-        batch = []
-        for x in range(num_blocks):
-            batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
+    if settings['resume'] == 'true':
+        out, height = resume_hashlist(settings, rpc)
+        with out:
+            return write_block_hashes(settings, rpc, out, height, max_blocks_per_call)
+    return write_block_hashes(settings, rpc, sys.stdout, settings['min_height'], max_blocks_per_call)
 
-        reply = rpc.execute(batch)
-        if reply is None:
-            print('Cannot continue. Program will halt.')
-            return None
+def write_block_hashes(settings, rpc, out, height, max_blocks_per_call):
+    # One connection per thread, kept alive across batches
+    local = threading.local()
 
-        for x,resp_obj in enumerate(reply):
-            if rpc.response_is_error(resp_obj):
-                print('JSON-RPC: error at height', height+x, ': ', resp_obj['error'], file=sys.stderr)
-                sys.exit(1)
-            assert resp_obj['id'] == x  # assume replies are in-sequence
-            if settings['rev_hash_bytes'] == 'true':
-                resp_obj['result'] = bytes.fromhex(resp_obj['result'])[::-1].hex()
-            print(resp_obj['result'])
-
-        height += num_blocks
+    def fetch(start_height, num_blocks):
+        if not hasattr(local, 'rpc'):
+            local.rpc = BitcoinRPC(settings['host'], settings['port'],
+                         settings['rpcuser'], settings['rpcpassword'])
+        batch = []
+        for x in range(num_blocks):
+            batch.append(local.rpc.build_request(x, 'getblockhash', [start_height + x]))
+        start = time.monotonic()
+        reply = local.rpc.execute(batch)
+        return reply, time.monotonic() - start
+
+    # Keep a batch in flight on every connection, and write their replies in order
+    end = settings['max_height'] + 1
+    num_blocks = MIN_BLOCKS_PER_CALL
+    pending = deque()
+    with ThreadPoolExecutor(settings['rpc_connections']) as executor:
+        while pending or height < end:
+            while height < end and len(pending) < settings['rpc_connections']:
+                batch_size = min(end - height, num_blocks)
+                pending.append((height, executor.submit(fetch, height, batch_size)))
+                height += batch_size
+            batch_height, future = pending.popleft()
+            reply, elapsed = future.result()
+            if reply is None:
+                print('Cannot continue. Program will halt.')
+                return None
+
+            hashes = []
+            for x,resp_obj in enumerate(reply):
+                if rpc.response_is_error(resp_obj):
+                    print('JSON-RPC: error at height', batch_height+x, ': ', resp_obj['error'], file=sys.stderr)
+                    sys.exit(1)
+                assert resp_obj['id'] == x  # assume replies are in-sequence
+                hashes.append(format_hash(settings, resp_obj['result']))
+            out.write('\n'.join(hashes) + '\n')
+
+            # At most double the batch size at a time, as the first batches are small
+            num_blocks = max(MIN_BLOCKS_PER_CALL, min(max_blocks_per_call, 2 * num_blocks,
+                                                      int(len(reply) * TARGET_CALL_TIME / max(elapsed, 1e-3))))
 
 def get_rpc_cookie():
     # Open the cookie file
@@ -121,6 +202,12 @@ if __name__ == '__main__':
         settings['max_height'] = 313000
     if 'rev_hash_bytes' not in settings:
         settings['rev_hash_bytes'] = 'false'
+    if 'rpc_connections' not in settings:
+        settings['rpc_connections'] = 4
+    if 'resume' not in settings:
+        settings['resume'] = 'false'
+    if 'hashlist' not in settings:
+        settings['hashlist'] = 'hashlist.txt'
 
     use_userpass = True
     use_datadir = False
@@ -135,6 +222,8 @@ if __name__ == '__main__':
     settings['port'] = int(settings['port'])
     settings['min_height'] = int(settings['min_height'])
     settings['max_height'] = int(settings['max_height'])
+    settings['rpc_connections'] = int(settings['rpc_connections'])
+    settings['resume'] = settings['resume'].lower()
 
     # Force hash byte format setting to be lowercase to make comparisons easier.
     settings['rev_hash_bytes'] = settings['rev_hash_bytes'].lower()
@@ -2,16 +2,23 @@
 # Copyright (c) 2020-2022 The Bitcoin Core developers
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
-"""Parse message capture binary files.  To be used in conjunction with -capturemessages."""
+"""Parse message capture binary files.  To be used in conjunction with -capturemessages.
+
+Messages of all files are merged in chronological order and written as they are parsed, as one JSON
+array or, with --ndjson, as one JSON object per line. The files are split into chunks which are
+parsed by parallel workers. Memory use is bounded, whatever the number and size of the files."""
 
 import argparse
+import heapq
+import multiprocessing
 import os
 import shutil
 import sys
 from io import BytesIO
 import json
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../test/functional'))
 
@@ -21,6 +28,15 @@ from test_framework.p2p import MESSAGEMAP           # noqa: E402
 TIME_SIZE = 8
 LENGTH_SIZE = 4
 MSGTYPE_SIZE = 12
+HEADER_SIZE = TIME_SIZE + MSGTYPE_SIZE + LENGTH_SIZE
+
+# Capture files are parsed in chunks of about this many bytes. Each worker process parses one chunk at
+# a time, and up to two chunks per worker, at most one per file, are parsed ahead of the merge.
+CHUNK_SIZE = 1 << 18
+# The merge holds the current chunk of every file, so chunks are made smaller when there are many
+# files, to keep their total size around MERGE_SIZE (but no smaller than MIN_CHUNK_SIZE).
+MERGE_SIZE = 1 << 24
+MIN_CHUNK_SIZE = 1 << 14
 
 # The test framework classes stores hashes as large ints in many cases.
 # These are variables of type uint256 in core.
@@ -92,79 +108,146 @@ def to_jsonable(obj: Any) -> Any:
         return obj
 
 
-def process_file(path: str, messages: list[Any], recv: bool, progress_bar: Optional[ProgressBar]) -> None:
+def parse_message(path: str, time: int, msgtype: bytes, length: int, payload: bytes, recv: bool) -> dict[str, Any]:
+    # Start converting the message to a dictionary
+    msg_dict = {}   # type: dict[str, Any]
+    msg_dict["direction"] = "recv" if recv else "sent"
+    msg_dict["time"] = time
+    msg_dict["size"] = length   # "size" is less readable here, but more readable in the output
+
+    msg_ser = BytesIO(payload)
+
+    # Determine message type
+    if msgtype not in MESSAGEMAP:
+        # Unrecognized message type
+        try:
+            msgtype_tmp = msgtype.decode()
+            if not msgtype_tmp.isprintable():
+                raise UnicodeDecodeError
+            msg_dict["msgtype"] = msgtype_tmp
+        except UnicodeDecodeError:
+            msg_dict["msgtype"] = "UNREADABLE"
+        msg_dict["body"] = payload.hex()
+        msg_dict["error"] = "Unrecognized message type."
+        print(f"WARNING - Unrecognized message type {msgtype} in {path}", file=sys.stderr)
+        return msg_dict
+
+    # Deserialize the message
+    msg = MESSAGEMAP[msgtype]()
+    msg_dict["msgtype"] = msgtype.decode()
+
+    try:
+        msg.deserialize(msg_ser)
+    except KeyboardInterrupt:
+        raise
+    except Exception:
+        # Unable to deserialize message body
+        msg_dict["body"] = payload.hex()
+        msg_dict["error"] = "Unable to deserialize message."
+        print(f"WARNING - Unable to deserialize message in {path}", file=sys.stderr)
+        return msg_dict
+
+    # Convert body of message into a jsonable object
+    if payload:
+        msg_dict["body"] = to_jsonable(msg)
+    return msg_dict
+
+
+def scan_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[tuple[int, int]]:
+    """Yield the (start, end) offsets of chunks of whole messages of a capture file, reading only the headers."""
     with open(path, 'rb') as f_in:
-        if progress_bar:
-            bytes_read = 0
-
-        while True:
-            if progress_bar:
-                # Update progress bar
-                diff = f_in.tell() - bytes_read - 1
-                progress_bar.update(diff)
-                bytes_read = f_in.tell() - 1
-
-            # Read the Header
-            tmp_header_raw = f_in.read(TIME_SIZE + LENGTH_SIZE + MSGTYPE_SIZE)
-            if not tmp_header_raw:
-                break
-            tmp_header = BytesIO(tmp_header_raw)
-            time = int.from_bytes(tmp_header.read(TIME_SIZE), "little")      # type: int
-            msgtype = tmp_header.read(MSGTYPE_SIZE).split(b'\x00', 1)[0]     # type: bytes
-            length = int.from_bytes(tmp_header.read(LENGTH_SIZE), "little")  # type: int
-
-            # Start converting the message to a dictionary
-            msg_dict = {}
-            msg_dict["direction"] = "recv" if recv else "sent"
-            msg_dict["time"] = time
-            msg_dict["size"] = length   # "size" is less readable here, but more readable in the output
-
-            msg_ser = BytesIO(f_in.read(length))
-
-            # Determine message type
-            if msgtype not in MESSAGEMAP:
-                # Unrecognized message type
-                try:
-                    msgtype_tmp = msgtype.decode()
-                    if not msgtype_tmp.isprintable():
-                        raise UnicodeDecodeError
-                    msg_dict["msgtype"] = msgtype_tmp
-                except UnicodeDecodeError:
-                    msg_dict["msgtype"] = "UNREADABLE"
-                msg_dict["body"] = msg_ser.read().hex()
-                msg_dict["error"] = "Unrecognized message type."
-                messages.append(msg_dict)
-                print(f"WARNING - Unrecognized message type {msgtype} in {path}", file=sys.stderr)
-                continue
-
-            # Deserialize the message
-            msg = MESSAGEMAP[msgtype]()
-            msg_dict["msgtype"] = msgtype.decode()
-
-            try:
-                msg.deserialize(msg_ser)
-            except KeyboardInterrupt:
-                raise
-            except Exception:
-                # Unable to deserialize message body
-                msg_ser.seek(0, os.SEEK_SET)
-                msg_dict["body"] = msg_ser.read().hex()
-                msg_dict["error"] = "Unable to deserialize message."
-                messages.append(msg_dict)
-                print(f"WARNING - Unable to deserialize message in {path}", file=sys.stderr)
-                continue
-
-            # Convert body of message into a jsonable object
-            if length:
-                msg_dict["body"] = to_jsonable(msg)
-            messages.append(msg_dict)
+        file_size = os.fstat(f_in.fileno()).st_size
+        start = pos = 0
+        while pos < file_size:
+            f_in.seek(pos)
+            header = f_in.read(HEADER_SIZE)
+            pos = min(file_size, pos + HEADER_SIZE + int.from_bytes(header[TIME_SIZE + MSGTYPE_SIZE:], "little"))
+            if pos - start >= chunk_size:
+                yield start, pos
+                start = pos
+        if pos > start:
+            yield start, pos
+
+
+def parse_chunk(path: str, start: int, end: int, recv: bool, peer: Optional[str],
+                msgtypes: Optional[frozenset[bytes]]) -> list[tuple[int, str]]:
+    """Return the time and JSON encoding of the messages of a chunk of a capture file.
+
+    Messages with a type not in msgtypes are skipped without deserializing them. If peer is set, it is
+    added to the messages."""
+    with open(path, 'rb') as f_in:
+        f_in.seek(start)
+        chunk = f_in.read(end - start)
+    messages = []
+    pos = 0
+    while pos < len(chunk):
+        # Read the Header
+        time = int.from_bytes(chunk[pos:pos + TIME_SIZE], "little")
+        msgtype = chunk[pos + TIME_SIZE:pos + TIME_SIZE + MSGTYPE_SIZE].split(b'\x00', 1)[0]
+        length = int.from_bytes(chunk[pos + TIME_SIZE + MSGTYPE_SIZE:pos + HEADER_SIZE], "little")
+        pos += HEADER_SIZE + length
+        if msgtypes is not None and msgtype not in msgtypes:
+            continue
+        msg_dict = parse_message(path, time, msgtype, length, chunk[pos - length:pos], recv)
+        if peer is not None:
+            msg_dict["peer"] = peer
+        messages.append((time, json.dumps(msg_dict)))
+    return messages
+
+
+class ChunkScheduler:
+    """Parse chunks of capture files in a process pool, with a limit on the chunks in flight across all files."""
+
+    def __init__(self, pool: Any, max_in_flight: int):
+        self.pool = pool
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
 
+    def has_room(self) -> bool:
+        return self.in_flight < self.max_in_flight
+
+    def submit(self, *args: Any) -> Any:
+        """Start parsing a chunk, see parse_chunk for the arguments."""
+        self.in_flight += 1
+        return self.pool.apply_async(parse_chunk, args)
+
+    def get(self, result: Any) -> list[tuple[int, str]]:
+        """Wait for the messages of a chunk started by submit."""
+        messages = result.get()
+        self.in_flight -= 1
+        return messages
+
+
+def parse_capture(path: str, recv: bool, peer: Optional[str], msgtypes: Optional[frozenset[bytes]],
+                  scheduler: Optional[ChunkScheduler], chunk_size: int,
+                  progress_bar: Optional[ProgressBar]) -> Iterator[tuple[int, str]]:
+    """Yield the time and JSON encoding of the messages of a capture file.
+
+    If scheduler is set, chunks are parsed in its pool, and the next chunk is parsed ahead while the
+    messages of the current one are consumed, if the scheduler has room for it."""
+    chunks = scan_chunks(path, chunk_size)
+    chunk = next(chunks, None)
+    ahead = None
+    while chunk is not None:
+        start, end = chunk
+        if scheduler is None:
+            messages = parse_chunk(path, start, end, recv, peer, msgtypes)
+            chunk = next(chunks, None)
+        else:
+            result = ahead if ahead is not None else scheduler.submit(path, start, end, recv, peer, msgtypes)
+            ahead = None
+            chunk = next(chunks, None)
+            if chunk is not None and scheduler.has_room():
+                ahead = scheduler.submit(path, *chunk, recv, peer, msgtypes)
+            messages = scheduler.get(result)
         if progress_bar:
-            # Update the progress bar to the end of the current file
-            # in case we exited the loop early
-            f_in.seek(0, os.SEEK_END)   # Go to end of file
-            diff = f_in.tell() - bytes_read - 1
-            progress_bar.update(diff)
+            progress_bar.update(end - start)
+        yield from messages
+
+
+def peer_name(capture: Path) -> str:
+    """Return the peer of a capture file, the name of its directory (the peer's address, with ':' replaced by '_')."""
+    return capture.parent.name
 
 
 def main():
@@ -182,33 +265,65 @@ def main():
     parser.add_argument(
         "-n", "--no-progress-bar",
         action='store_true',
-        help="disable the progress bar.  Automatically set if the output is not a terminal")
+        help="disable the progress bar.  Automatically set if the output is not a terminal or no output file is given")
+    parser.add_argument(
+        "--ndjson",
+        action='store_true',
+        help="write one JSON object per line, with the peer of the message in its \"peer\" field")
+    parser.add_argument(
+        "--msgtype",
+        action='append',
+        help="only output messages of this type, and skip the others without deserializing them.  Can be repeated")
+    parser.add_argument(
+        "--peer",
+        action='append',
+        help="only read the capture files of this peer, given as the name of its directory or its address.  Can be repeated")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of parallel parsing processes (default: number of CPUs)")
     args = parser.parse_args()
     capturepaths = [Path.cwd() / Path(capturepath) for capturepath in args.capturepaths]
+    if args.peer:
+        peers = {peer.replace(':', '_') for peer in args.peer}
+        capturepaths = [capture for capture in capturepaths if peer_name(capture) in peers]
+    msgtypes = frozenset(msgtype.encode() for msgtype in args.msgtype) if args.msgtype else None
     output = Path.cwd() / Path(args.output) if args.output else False
-    use_progress_bar = (not args.no_progress_bar) and sys.stdout.isatty()
+    # Messages are printed as they are parsed, so only show the progress bar when writing them to a file
+    use_progress_bar = (not args.no_progress_bar) and sys.stdout.isatty() and bool(output)
 
-    messages = []   # type: list[Any]
     if use_progress_bar:
         total_size = sum(capture.stat().st_size for capture in capturepaths)
         progress_bar = ProgressBar(total_size)
     else:
         progress_bar = None
 
-    for capture in capturepaths:
-        process_file(str(capture), messages, "recv" in capture.stem, progress_bar)
+    pool = multiprocessing.Pool(args.jobs) if args.jobs > 1 else None
+    scheduler = ChunkScheduler(pool, 2 * args.jobs) if pool is not None else None
+    chunk_size = max(MIN_CHUNK_SIZE, min(CHUNK_SIZE, MERGE_SIZE // max(1, len(capturepaths))))
+    # Each capture file is in chronological order. Messages with the same time are kept in the order of the files.
+    messages = heapq.merge(*[parse_capture(str(capture), "recv" in capture.stem, peer_name(capture) if args.ndjson else None,
+                                           msgtypes, scheduler, chunk_size, progress_bar)
+                             for capture in capturepaths], key=itemgetter(0))
 
-    messages.sort(key=lambda msg: msg['time'])
+    f_out = open(str(output), 'w+', encoding="utf8") if output else sys.stdout
+    if args.ndjson:
+        for _, msg_json in messages:
+            f_out.write(msg_json + "\n")
+    else:
+        f_out.write("[")
+        for i, (_, msg_json) in enumerate(messages):
+            f_out.write(", " + msg_json if i else msg_json)
+        f_out.write("]\n" if not output else "]")
+    if output:
+        f_out.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     if use_progress_bar:
         progress_bar.set_progress(1)
 
-    jsonrep = json.dumps(messages)
-    if output:
-        with open(str(output), 'w+', encoding="utf8") as f_out:
-            f_out.write(jsonrep)
-    else:
-        print(jsonrep)
-
 if __name__ == "__main__":
     main()
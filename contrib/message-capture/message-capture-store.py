@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Index message capture binary files in a SQLite3 database, and query it.  To be used in conjunction with -capturemessages.
+
+Only the message headers are stored, with the offset of each message in its capture file. Bodies are
+read and decoded when queried, so the capture files must be kept. Ingesting again only reads the
+messages appended to the capture files since the last time, and the new capture files.
+
+The database has the tables
+    captures(id INTEGER PRIMARY KEY, path TEXT UNIQUE, peer TEXT, direction TEXT, ingested INT)
+    messages(capture INT, time INT, msgtype TEXT, size INT, offset INT)
+    message_stats(minute INT, capture INT, msgtype TEXT, messages INT, bytes INT)
+where time is in microseconds since the epoch, peer is the name of the directory of the capture file
+(the peer's address, with ':' replaced by '_'), ingested is the number of bytes of the file ingested,
+and message_stats has the number and total size of the messages per minute since the epoch."""
+
+import argparse
+from collections import Counter
+from datetime import datetime, timezone
+import importlib.util
+import json
+import mmap
+import os
+from pathlib import Path
+import sqlite3
+import sys
+from typing import Any, Optional
+
+# Load message-capture-parser.py, which can't be imported by name, to decode bodies like it does
+_spec = importlib.util.spec_from_file_location("message_capture_parser", os.path.join(os.path.dirname(os.path.abspath(__file__)), "message-capture-parser.py"))
+message_capture_parser = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(message_capture_parser)
+
+TIME_SIZE = message_capture_parser.TIME_SIZE
+MSGTYPE_SIZE = message_capture_parser.MSGTYPE_SIZE
+HEADER_SIZE = message_capture_parser.HEADER_SIZE
+MICROSECONDS_PER_MINUTE = 60 * 1000 * 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures(id INTEGER PRIMARY KEY, path TEXT UNIQUE, peer TEXT, direction TEXT, ingested INT);
+CREATE TABLE IF NOT EXISTS messages(capture INT, time INT, msgtype TEXT, size INT, offset INT);
+CREATE INDEX IF NOT EXISTS messages_time ON messages(time);
+CREATE INDEX IF NOT EXISTS messages_msgtype ON messages(msgtype, time);
+CREATE INDEX IF NOT EXISTS messages_capture ON messages(capture, msgtype, time);
+CREATE TABLE IF NOT EXISTS message_stats(minute INT, capture INT, msgtype TEXT, messages INT, bytes INT,
+                                         PRIMARY KEY (minute, capture, msgtype)) WITHOUT ROWID;
+"""
+
+
+def find_captures(paths: list[str]) -> list[Path]:
+    """Return the capture files given, and those in the peer directories of the capture directories given."""
+    captures = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            captures += sorted(path.glob("msgs_*.dat")) + sorted(path.glob("*/msgs_*.dat"))
+        else:
+            captures.append(path)
+    return captures
+
+
+def decode_msgtype(msgtype: bytes) -> str:
+    try:
+        msgtype_str = msgtype.decode()
+        return msgtype_str if msgtype_str.isprintable() else "UNREADABLE"
+    except UnicodeDecodeError:
+        return "UNREADABLE"
+
+
+class MessageCaptureStore:
+    """Indexed message headers of capture files, in a SQLite3 database."""
+
+    def __init__(self, filename: str):
+        self.con = sqlite3.connect(filename)
+        self.con.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.con.close()
+
+    def ingest(self, captures: list[Path]) -> int:
+        """Add the messages of the capture files not yet ingested. Returns the number of messages added."""
+        added = 0
+        with self.con:
+            for capture in captures:
+                path = str(capture.resolve())
+                row = self.con.execute("SELECT id, ingested FROM captures WHERE path = ?", (path,)).fetchone()
+                if row is None:
+                    capture_id = self.con.execute("INSERT INTO captures(path, peer, direction, ingested) VALUES(?, ?, ?, 0)",
+                                                  (path, capture.parent.name, "recv" if "recv" in capture.stem else "sent")).lastrowid
+                    ingested = 0
+                else:
+                    capture_id, ingested = row
+                added += self._ingest_file(capture_id, path, ingested)
+        return added
+
+    def _ingest_file(self, capture_id: int, path: str, ingested: int) -> int:
+        with open(path, 'rb') as f_in:
+            file_size = os.fstat(f_in.fileno()).st_size
+            if file_size < ingested:
+                print(f"WARNING - {path} is shorter than when it was ingested, skipping it", file=sys.stderr)
+                return 0
+            if file_size - ingested < HEADER_SIZE:
+                return 0
+            buf = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+        messages = []
+        stats = Counter()   # type: Counter[tuple[int, str, str]]
+        pos = ingested
+        # Stop before a message which is still being written
+        while pos + HEADER_SIZE <= file_size:
+            length = int.from_bytes(buf[pos + TIME_SIZE + MSGTYPE_SIZE:pos + HEADER_SIZE], "little")
+            if pos + HEADER_SIZE + length > file_size:
+                break
+            time = int.from_bytes(buf[pos:pos + TIME_SIZE], "little")
+            msgtype = decode_msgtype(buf[pos + TIME_SIZE:pos + TIME_SIZE + MSGTYPE_SIZE].split(b'\x00', 1)[0])
+            messages.append((capture_id, time, msgtype, length, pos))
+            minute = time // MICROSECONDS_PER_MINUTE
+            stats[(minute, msgtype, "messages")] += 1
+            stats[(minute, msgtype, "bytes")] += length
+            pos += HEADER_SIZE + length
+        buf.close()
+        self.con.executemany("INSERT INTO messages VALUES(?, ?, ?, ?, ?)", messages)
+        self.con.executemany("INSERT INTO message_stats VALUES(?, ?, ?, ?, ?) ON CONFLICT DO UPDATE "
+                             "SET messages = messages + excluded.messages, bytes = bytes + excluded.bytes",
+                             [(minute, capture_id, msgtype, stats[(minute, msgtype, "messages")], stats[(minute, msgtype, "bytes")])
+                              for minute, msgtype, field in stats if field == "messages"])
+        self.con.execute("UPDATE captures SET ingested = ? WHERE id = ?", (pos, capture_id))
+        return len(messages)
+
+    @staticmethod
+    def _filters(peers: Optional[list[str]], msgtypes: Optional[list[str]], direction: Optional[str],
+                 start: Optional[int], end: Optional[int], time_column: str) -> tuple[str, list[Any]]:
+        conditions, params = [], []   # type: list[str], list[Any]
+        if peers:
+            conditions.append(f"capture IN (SELECT id FROM captures WHERE peer IN ({','.join('?' * len(peers))}))")
+            params += [peer.replace(':', '_') for peer in peers]
+        if direction:
+            conditions.append("capture IN (SELECT id FROM captures WHERE direction = ?)")
+            params.append(direction)
+        if msgtypes:
+            conditions.append(f"msgtype IN ({','.join('?' * len(msgtypes))})")
+            params += msgtypes
+        if start is not None:
+            conditions.append(f"{time_column} >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append(f"{time_column} < ?")
+            params.append(end)
+        return " AND ".join(conditions) or "1", params
+
+    def messages(self, peers: Optional[list[str]] = None, msgtypes: Optional[list[str]] = None, direction: Optional[str] = None,
+                 start: Optional[int] = None, end: Optional[int] = None, limit: int = -1) -> list[tuple[Any, ...]]:
+        """Return (time, peer, direction, msgtype, size, path, offset) of the messages matching all the filters, by time.
+
+        Times are in microseconds since the epoch, and end is exclusive."""
+        where, params = self._filters(peers, msgtypes, direction, start, end, "time")
+        return self.con.execute("SELECT time, peer, direction, msgtype, size, path, offset "
+                                f"FROM (SELECT * FROM messages WHERE {where}) JOIN captures ON capture = captures.id "
+                                "ORDER BY time, capture, offset LIMIT ?", params + [limit]).fetchall()
+
+    def traffic(self, interval: int = 1, peers: Optional[list[str]] = None, msgtypes: Optional[list[str]] = None,
+                direction: Optional[str] = None, start: Optional[int] = None, end: Optional[int] = None) -> list[tuple[Any, ...]]:
+        """Return (time, msgtype, messages, bytes) per msgtype and interval of minutes, of the messages matching all the filters.
+
+        Times are in microseconds since the epoch, and start and end are rounded down to whole minutes."""
+        where, params = self._filters(peers, msgtypes, direction,
+                                      None if start is None else start // MICROSECONDS_PER_MINUTE,
+                                      None if end is None else end // MICROSECONDS_PER_MINUTE, "minute")
+        return self.con.execute(f"SELECT minute / {interval} * {interval * MICROSECONDS_PER_MINUTE}, msgtype, sum(messages), sum(bytes) "
+                                f"FROM message_stats WHERE {where} GROUP BY 1, 2 ORDER BY 1, 2", params).fetchall()
+
+
+def decode_message(message: tuple[Any, ...]) -> dict[str, Any]:
+    """Read the message returned by MessageCaptureStore.messages() from its capture file, and decode it as message-capture-parser.py does."""
+    time, peer, direction, _, size, path, offset = message
+    with open(path, 'rb') as f_in:
+        f_in.seek(offset)
+        data = f_in.read(HEADER_SIZE + size)
+    msg_dict = message_capture_parser.parse_message(path, time, data[TIME_SIZE:TIME_SIZE + MSGTYPE_SIZE].split(b'\x00', 1)[0],
+                                                    size, data[HEADER_SIZE:], direction == "recv")
+    msg_dict["peer"] = peer
+    return msg_dict
+
+
+def parse_time(value: str) -> int:
+    """Parse seconds since the epoch or an ISO 8601 date and time (UTC if no timezone is given) to microseconds since the epoch."""
+    try:
+        return int(float(value) * 1000000)
+    except ValueError:
+        time = datetime.fromisoformat(value)
+        if time.tzinfo is None:
+            time = time.replace(tzinfo=timezone.utc)
+        return int(time.timestamp() * 1000000)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        epilog="EXAMPLES \n\t{0} captures.sqlite ingest <data-dir>/message_capture\n"
+               "\t{0} captures.sqlite messages --peer 203.0.113.1:8333 --msgtype inv --start 2025-01-01T12:00 --end 2025-01-01T13:00\n"
+               "\t{0} captures.sqlite traffic --interval 60".format(sys.argv[0]),
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("database", help="SQLite3 database, created if it doesn't exist")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="add the new messages of capture files")
+    ingest.add_argument("capturepaths", nargs='+', help="capture files, or message_capture directories or peer directories containing them")
+    messages = commands.add_parser("messages", help="print messages, one JSON object per line in chronological order")
+    traffic = commands.add_parser("traffic", help="print the number and size of messages per msgtype and interval")
+    traffic.add_argument("--interval", type=int, default=1, help="interval in minutes (default: %(default)s)")
+    for command in [messages, traffic]:
+        command.add_argument("--peer", action='append', help="only messages of this peer, given as the name of its directory or its address.  Can be repeated")
+        command.add_argument("--msgtype", action='append', help="only messages of this type.  Can be repeated")
+        command.add_argument("--direction", choices=["recv", "sent"], help="only received or sent messages")
+        command.add_argument("--start", type=parse_time, help="only messages at or after this time, in seconds since the epoch or ISO 8601")
+        command.add_argument("--end", type=parse_time, help="only messages before this time, in seconds since the epoch or ISO 8601")
+    messages.add_argument("--limit", type=int, default=-1, help="print at most this many messages")
+    messages.add_argument("--headers-only", action='store_true', help="don't read and decode the message bodies")
+    args = parser.parse_args()
+
+    store = MessageCaptureStore(args.database)
+    if args.command == "ingest":
+        captures = find_captures(args.capturepaths)
+        print(f"Ingested {store.ingest(captures)} messages of {len(captures)} capture files")
+    elif args.command == "messages":
+        for message in store.messages(args.peer, args.msgtype, args.direction, args.start, args.end, args.limit):
+            if args.headers_only:
+                time, peer, direction, msgtype, size, _, _ = message
+                msg_dict = {"direction": direction, "time": time, "size": size, "msgtype": msgtype, "peer": peer}
+            else:
+                msg_dict = decode_message(message)
+            print(json.dumps(msg_dict))
+    elif args.command == "traffic":
+        print(f"{'time (UTC)':>20} {'msgtype':>12} {'messages':>10} {'bytes':>14}")
+        for time, msgtype, count, size in store.traffic(args.interval, args.peer, args.msgtype, args.direction, args.start, args.end):
+            time_str = datetime.fromtimestamp(time // 1000000, timezone.utc).strftime("%Y-%m-%d %H:%M")
+            print(f"{time_str:>20} {msgtype:>12} {count:>10} {size:>14}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -17,7 +17,7 @@ from typing import Union
 
 asmap_dir = Path(__file__).parent.parent / "asmap"
 sys.path.append(str(asmap_dir))
-from asmap import ASMap, net_to_prefix  # noqa: E402
+from asmap import ASMap, ip_to_int  # noqa: E402
 
 NSEEDS=512
 
@@ -165,12 +165,13 @@ def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: i
     net_count: dict[str, int] = collections.defaultdict(int)
     asn_count: dict[int, int] = collections.defaultdict(int)
 
-    for i, ip in enumerate(ips_ipv46):
+    # Look up the ASNs of all ips at once
+    asns = asmap.compile().lookup_many(ip_to_int(ipaddress.ip_address(ip['ip'])) for ip in ips_ipv46)
+    for ip, asn in zip(ips_ipv46, asns):
         if net_count[ip['net']] == max_per_net:
             # do not add this ip as we already too many
             # ips from this network
             continue
-        asn = asmap.lookup(net_to_prefix(ipaddress.ip_network(ip['ip'])))
         if not asn or asn_count[ip['net'], asn] == max_per_asn[ip['net']]:
             # do not add this ip as we already have too many
             # ips from this ASN on this network
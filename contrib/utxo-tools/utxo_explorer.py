@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Query a UTXO set database created by utxo_to_sqlite.py, and keep it up to date.
+
+First add the indexes the queries need (this takes about as long as the conversion):
+$ utxo_explorer.py utxos.sqlite index
+
+Then look up the coins of many scripts at once, get the value distribution by height or the
+largest coins:
+$ utxo_explorer.py utxos.sqlite lookup 0014... 5120... --file scripts.txt
+$ utxo_explorer.py utxos.sqlite histogram --height-step 10000
+$ utxo_explorer.py utxos.sqlite top 100
+
+To update the database to a newer UTXO set, dump it with `dumptxoutset` and apply the difference:
+$ utxo_explorer.py utxos.sqlite refresh utxos-new.dat
+
+The index command adds to the `utxos` table a `script_hash` column (the first 8 bytes of the SHA256
+of the scriptpubkey, as a signed integer) and indexes on it, on height and on value. It also adds the
+table `utxo_value_histogram`, with the number and total value of the coins per range of
+HISTOGRAM_HEIGHT_STEP blocks and number of decimal digits of their value in satoshis, and the table
+`utxo_outpoints` of the outpoints in the order of the UTXO set dump, with which a newer dump is
+compared to the database. The module can also be used as a library, see UTXOExplorer.
+"""
+import argparse
+from collections import Counter
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utxo_to_sqlite import (  # noqa: E402
+    HEADER_SIZE,
+    UTXO_DUMP_MAGIC,
+    UTXO_DUMP_VERSION,
+    decode_group,
+)
+
+# Height range of the buckets of utxo_value_histogram
+HISTOGRAM_HEIGHT_STEP = 1000
+# Number of decimal digits of a value in satoshis, its bucket in utxo_value_histogram (0 for a value of 0)
+VALUE_BUCKET_SQL = "CASE WHEN value = 0 THEN 0 ELSE length(value) END"
+
+
+def script_hash(scriptpubkey):
+    """Return the key of a scriptpubkey (hex or bytes) in the script hash index."""
+    if isinstance(scriptpubkey, str):
+        scriptpubkey = bytes.fromhex(scriptpubkey)
+    return int.from_bytes(hashlib.sha256(scriptpubkey).digest()[:8], 'big', signed=True)
+
+
+def value_bucket(value):
+    return len(str(value)) if value else 0
+
+
+def outpoint_key(txid, vout):
+    """Return the key of an outpoint in utxo_outpoints, which sorts like the outpoints in the UTXO set dump.
+
+    txid is in the byte order in which it is displayed.
+    """
+    return txid[::-1] + vout.to_bytes(4, 'big')
+
+
+class UTXOExplorer:
+    """Indexes and queries on the `utxos` table of a database created by utxo_to_sqlite.py.
+
+    Coins are returned as (txid, vout, value, coinbase, height, scriptpubkey) tuples, with the txid
+    and scriptpubkey as hex strings or bytes, depending on whether the database was created with --blob.
+    """
+
+    def __init__(self, filename):
+        self.con = sqlite3.connect(filename)
+        self.con.create_function("script_hash", 1, script_hash, deterministic=True)
+        columns = {name: decl_type for _, name, decl_type, _, _, _ in self.con.execute("PRAGMA table_info(utxos)")}
+        if not columns:
+            raise ValueError(f"{filename} has no utxos table")
+        self.blob = columns["txid"] == "BLOB"
+        self.indexed = "script_hash" in columns
+
+    def close(self):
+        self.con.close()
+
+    def _to_db(self, data):
+        """Convert bytes to the representation of txids and scripts in the database."""
+        return data if self.blob else data.hex()
+
+    def _from_db(self, data):
+        return data if self.blob else bytes.fromhex(data)
+
+    def build_indexes(self):
+        """Add the script hash column, the indexes and the tables needed by the other methods."""
+        assert not self.indexed, "the database is already indexed"
+        with self.con:
+            start = time.time()
+            self.con.execute("ALTER TABLE utxos ADD COLUMN script_hash INT")
+            self.con.execute("UPDATE utxos SET script_hash = script_hash(scriptpubkey)")
+            self.con.execute("CREATE INDEX utxos_script_hash ON utxos(script_hash)")
+            print(f"Indexed script hashes in {time.time() - start:.1f}s")
+            start = time.time()
+            self.con.execute("CREATE INDEX IF NOT EXISTS utxos_height ON utxos(height)")
+            self.con.execute("CREATE INDEX utxos_value ON utxos(value)")
+            print(f"Indexed heights and values in {time.time() - start:.1f}s")
+
+            start = time.time()
+            self.con.execute("CREATE TABLE utxo_value_histogram(height_bucket INT, value_bucket INT, coins INT, value INT, "
+                             "PRIMARY KEY (height_bucket, value_bucket))")
+            self.con.execute(f"INSERT INTO utxo_value_histogram SELECT height / {HISTOGRAM_HEIGHT_STEP}, {VALUE_BUCKET_SQL}, "
+                             "count(*), sum(value) FROM utxos GROUP BY 1, 2")
+            print(f"Built value histogram in {time.time() - start:.1f}s")
+
+            start = time.time()
+            # The rows were inserted in the order of the dump, so the keys are mostly appended in order
+            self.con.execute("CREATE TABLE utxo_outpoints(key BLOB PRIMARY KEY, utxo INT) WITHOUT ROWID")
+            cursor = self.con.execute("SELECT rowid, txid, vout FROM utxos ORDER BY rowid")
+            while rows := cursor.fetchmany(10000):
+                self.con.executemany("INSERT INTO utxo_outpoints VALUES(?, ?)",
+                                     [(outpoint_key(self._from_db(txid), vout), rowid) for rowid, txid, vout in rows])
+            print(f"Indexed outpoints in {time.time() - start:.1f}s")
+        self.indexed = True
+
+    def lookup_scripts(self, scriptpubkeys):
+        """Return a dict of each scriptpubkey (hex or bytes, as given) to the list of its coins, in one query."""
+        assert self.indexed, "the database is not indexed"
+        wanted = {}
+        for scriptpubkey in scriptpubkeys:
+            wanted[self._to_db(bytes.fromhex(scriptpubkey) if isinstance(scriptpubkey, str) else scriptpubkey)] = scriptpubkey
+        result = {scriptpubkey: [] for scriptpubkey in scriptpubkeys}
+        self.con.execute("CREATE TEMP TABLE IF NOT EXISTS lookup_script_hashes(script_hash INT PRIMARY KEY)")
+        self.con.execute("DELETE FROM lookup_script_hashes")
+        self.con.executemany("INSERT OR IGNORE INTO lookup_script_hashes VALUES(?)",
+                             [(script_hash(scriptpubkey),) for scriptpubkey in wanted])
+        for coin in self.con.execute("SELECT txid, vout, value, coinbase, height, scriptpubkey FROM utxos "
+                                     "WHERE script_hash IN (SELECT script_hash FROM lookup_script_hashes)"):
+            # Skip coins with other scripts that have the same script hash
+            if coin[5] in wanted:
+                result[wanted[coin[5]]].append(coin)
+        return result
+
+    def value_histogram(self, height_step=HISTOGRAM_HEIGHT_STEP):
+        """Return (first height, value bucket, number of coins, total value) of the coins per height range and value bucket.
+
+        height_step must be a multiple of HISTOGRAM_HEIGHT_STEP. Value bucket b holds the values of b decimal digits.
+        """
+        assert self.indexed, "the database is not indexed"
+        assert height_step % HISTOGRAM_HEIGHT_STEP == 0, f"height_step must be a multiple of {HISTOGRAM_HEIGHT_STEP}"
+        buckets_per_step = height_step // HISTOGRAM_HEIGHT_STEP
+        return self.con.execute(f"SELECT height_bucket / {buckets_per_step} * {height_step}, value_bucket, sum(coins), sum(value) "
+                                "FROM utxo_value_histogram GROUP BY 1, 2 ORDER BY 1, 2").fetchall()
+
+    def largest_coins(self, count):
+        """Return the count coins with the highest values."""
+        return self.con.execute("SELECT txid, vout, value, coinbase, height, scriptpubkey FROM utxos "
+                                "ORDER BY value DESC LIMIT ?", (count,)).fetchall()
+
+    def refresh(self, snapshot_filename):
+        """Update the database to the UTXO set dump in snapshot_filename, by removing and adding the coins that differ.
+
+        Returns the number of coins removed and added.
+        """
+        assert self.indexed, "the database is not indexed"
+        with open(snapshot_filename, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buf) < HEADER_SIZE or buf[0:5] != UTXO_DUMP_MAGIC or int.from_bytes(buf[5:7], 'little') != UTXO_DUMP_VERSION:
+            raise ValueError(f"{snapshot_filename} is not a UTXO dump of version {UTXO_DUMP_VERSION}")
+        num_utxos = int.from_bytes(buf[43:51], 'little')
+
+        # Merge the outpoints of the database and of the dump, which are both sorted
+        removed = []
+        added = []
+        old_outpoints = self.con.execute("SELECT key, utxo FROM utxo_outpoints ORDER BY key")
+        old = next(old_outpoints, None)
+        previous_key = b""
+        pos = HEADER_SIZE
+        coin_idx = 0
+        while coin_idx < num_utxos:
+            coins, pos = decode_group(buf, pos)
+            coin_idx += len(coins)
+            for coin in coins:
+                key = outpoint_key(coin[0], coin[1])
+                if key <= previous_key:
+                    raise ValueError(f"{snapshot_filename} is not sorted by outpoint")
+                previous_key = key
+                while old is not None and old[0] < key:
+                    removed.append(old)
+                    old = next(old_outpoints, None)
+                if old is not None and old[0] == key:
+                    old = next(old_outpoints, None)
+                else:
+                    added.append((key, coin))
+        while old is not None:
+            removed.append(old)
+            old = next(old_outpoints, None)
+
+        with self.con:
+            histogram = Counter()
+            self.con.execute("CREATE TEMP TABLE IF NOT EXISTS refresh_removed(utxo INT PRIMARY KEY)")
+            self.con.execute("DELETE FROM refresh_removed")
+            self.con.executemany("INSERT INTO refresh_removed VALUES(?)", [(utxo,) for _, utxo in removed])
+            for height_bucket, bucket, coins, value in self.con.execute(
+                    f"SELECT height / {HISTOGRAM_HEIGHT_STEP}, {VALUE_BUCKET_SQL}, count(*), sum(value) FROM utxos "
+                    "WHERE rowid IN (SELECT utxo FROM refresh_removed) GROUP BY 1, 2"):
+                histogram[(height_bucket, bucket, "coins")] -= coins
+                histogram[(height_bucket, bucket, "value")] -= value
+            self.con.execute("DELETE FROM utxos WHERE rowid IN (SELECT utxo FROM refresh_removed)")
+            self.con.executemany("DELETE FROM utxo_outpoints WHERE key = ?", [(key,) for key, _ in removed])
+
+            outpoints = []
+            for key, (txid, vout, value, coinbase, height, scriptpubkey) in added:
+                cursor = self.con.execute("INSERT INTO utxos(txid, vout, value, coinbase, height, scriptpubkey, script_hash) "
+                                          "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                                          (self._to_db(txid), vout, value, coinbase, height, self._to_db(scriptpubkey),
+                                           script_hash(scriptpubkey)))
+                outpoints.append((key, cursor.lastrowid))
+                histogram[(height // HISTOGRAM_HEIGHT_STEP, value_bucket(value), "coins")] += 1
+                histogram[(height // HISTOGRAM_HEIGHT_STEP, value_bucket(value), "value")] += value
+            self.con.executemany("INSERT INTO utxo_outpoints VALUES(?, ?)", outpoints)
+
+            self.con.executemany("INSERT INTO utxo_value_histogram VALUES(?, ?, ?, ?) ON CONFLICT DO UPDATE "
+                                 "SET coins = coins + excluded.coins, value = value + excluded.value",
+                                 [(height_bucket, bucket, histogram[(height_bucket, bucket, "coins")], histogram[(height_bucket, bucket, "value")])
+                                  for height_bucket, bucket in {key[:2] for key in histogram}])
+            self.con.execute("DELETE FROM utxo_value_histogram WHERE coins = 0")
+        return len(removed), len(added)
+
+
+def format_coin(coin):
+    txid, vout, value, coinbase, height, scriptpubkey = coin
+    return {
+        "txid": txid if isinstance(txid, str) else txid.hex(),
+        "vout": vout,
+        "value": value,
+        "coinbase": bool(coinbase),
+        "height": height,
+        "scriptpubkey": scriptpubkey if isinstance(scriptpubkey, str) else scriptpubkey.hex(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database', help='SQLite3 database created by utxo_to_sqlite.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('index', help='add the indexes and tables needed by the other commands')
+    lookup = commands.add_parser('lookup', help='print the coins of scripts, as JSON lines')
+    lookup.add_argument('scriptpubkeys', nargs='*', help='hex encoded scripts')
+    lookup.add_argument('--file', help='file with one hex encoded script per line')
+    histogram = commands.add_parser('histogram', help='print the number and value of the coins by height and value')
+    histogram.add_argument('--height-step', type=int, default=HISTOGRAM_HEIGHT_STEP,
+                           help=f'blocks per height range, a multiple of {HISTOGRAM_HEIGHT_STEP} (default: %(default)s)')
+    top = commands.add_parser('top', help='print the coins with the highest values, as JSON lines')
+    top.add_argument('count', type=int, nargs='?', default=10, help='number of coins (default: %(default)s)')
+    refresh = commands.add_parser('refresh', help='update the database to a newer UTXO set dump')
+    refresh.add_argument('snapshot', help='filename of compact-serialized UTXO set, as created by dumptxoutset')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"Error: provided database '{args.database}' doesn't exist.")
+        sys.exit(1)
+    explorer = UTXOExplorer(args.database)
+    if args.command != 'index' and not explorer.indexed:
+        print(f"Error: run '{sys.argv[0]} {args.database} index' first.")
+        sys.exit(1)
+
+    if args.command == 'index':
+        if explorer.indexed:
+            print(f"Error: database '{args.database}' is already indexed.")
+            sys.exit(1)
+        explorer.build_indexes()
+    elif args.command == 'lookup':
+        scriptpubkeys = list(args.scriptpubkeys)
+        if args.file:
+            with open(args.file, encoding="ascii") as f:
+                scriptpubkeys += [line.strip() for line in f if line.strip()]
+        for coins in explorer.lookup_scripts(scriptpubkeys).values():
+            for coin in coins:
+                print(json.dumps(format_coin(coin)))
+    elif args.command == 'histogram':
+        print(f"{'height':>8} {'value (sat)':>24} {'coins':>12} {'total (BTC)':>20}")
+        for height, bucket, coins, value in explorer.value_histogram(args.height_step):
+            value_range = "0" if bucket == 0 else f"{10 ** (bucket - 1)}-{10 ** bucket - 1}"
+            print(f"{height:>8} {value_range:>24} {coins:>12} {value / 1e8:>20.8f}")
+    elif args.command == 'top':
+        for coin in explorer.largest_coins(args.count):
+            print(json.dumps(format_coin(coin)))
+    elif args.command == 'refresh':
+        start = time.time()
+        removed, added = explorer.refresh(args.snapshot)
+        print(f"Removed {removed} and added {added} coins in {time.time() - start:.1f}s")
+    explorer.close()
+
+
+if __name__ == '__main__':
+    main()
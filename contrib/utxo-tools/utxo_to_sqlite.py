@@ -9,10 +9,32 @@ $ bitcoin-cli dumptxoutset ~/utxos.dat latest
 
 The created database contains a table `utxos` with the following schema:
 (txid TEXT, vout INT, value INT, coinbase INT, height INT, scriptpubkey TEXT)
+With --blob, txid and scriptpubkey are BLOBs of the bytes of which the TEXT columns would be
+the hex encoding. With --index, indexes on the scriptpubkey and/or height columns are created
+once all coins are inserted.
+
+Other output formats can be selected with --format:
+- csv: a CSV file with a header row and the same columns as the `utxos` table.
+- columnar: a directory with one binary file per column, in little-endian byte order:
+  txid.bin (32 bytes per coin), vout.u32, value.u64, coinbase.u8, height.u32, and the
+  concatenated scripts in scriptpubkey.bin, with the offset of every script and the end of
+  the last one in scriptpubkey_offsets.u64. metadata.json holds the number of coins and
+  the snapshot's network and block hash. The files can be loaded with e.g. numpy.fromfile().
+
+Coins are decoded by as many processes as there are CPUs (--jobs). The snapshot can only be split
+at the start of a transaction's coins, so the first conversion of a snapshot scans it for such
+positions, while decoding the parts found so far, and saves them to <infile>.chunks. Later
+conversions of the same snapshot start decoding all parts at once.
 """
 import argparse
+from array import array
+from collections import deque
+import json
+import mmap
+from multiprocessing import Pool
 import os
 import sqlite3
+import struct
 import sys
 import time
 
@@ -26,30 +48,48 @@ NET_MAGIC_BYTES = {
     b"\x1c\x16\x3f\x28": "Testnet4",
     b"\xfa\xbf\xb5\xda": "Regtest",
 }
+# Size of the metadata at the start of the snapshot
+HEADER_SIZE = 51
+# Number of coins written at once, and between progress reports
+WRITE_BATCH_SIZE = 16 * 1024
+PROGRESS_INTERVAL = 1024 * 1024
+INDEX_COLUMNS = ("scriptpubkey", "height")
+# Cache of decompress_amount(), as the same amounts occur many times
+DECOMPRESSED_AMOUNTS = {}
+# Number of bytes following each of the special script types, see decompress_script()
+COMPRESSED_SCRIPT_SIZES = (20, 20, 32, 32, 32, 32)
+# Number of coins decoded at once by a worker process, and the chunk index recording where the chunks start
+CHUNK_SIZE = 64 * 1024
+CHUNK_INDEX_SUFFIX = ".chunks"
+CHUNK_INDEX_MAGIC = b'utxochnk'
+CHUNK_INDEX_VERSION = 1
+# Magic, version, snapshot block hash, snapshot file size and number of chunks
+CHUNK_INDEX_HEADER = struct.Struct("<8sB32sQI")
+# Per chunk: start, end and number of coins
+CHUNK_INDEX_ENTRY = struct.Struct("<QQI")
 
 
-def read_varint(f):
-    """Equivalent of `ReadVarInt()` (see serialization module)."""
-    n = 0
+def read_varint(buf, pos):
+    """Equivalent of `ReadVarInt()` (see serialization module). Returns the value and the position after it."""
+    n = buf[pos]
+    if n < 0x80:
+        return n, pos + 1
+    n &= 0x7f
     while True:
-        dat = f.read(1)[0]
-        n = (n << 7) | (dat & 0x7f)
-        if (dat & 0x80) > 0:
-            n += 1
-        else:
-            return n
-
-
-def read_compactsize(f):
-    """Equivalent of `ReadCompactSize()` (see serialization module)."""
-    n = f.read(1)[0]
-    if n == 253:
-        n = int.from_bytes(f.read(2), "little")
-    elif n == 254:
-        n = int.from_bytes(f.read(4), "little")
-    elif n == 255:
-        n = int.from_bytes(f.read(8), "little")
-    return n
+        pos += 1
+        dat = buf[pos]
+        n = ((n + 1) << 7) | (dat & 0x7f)
+        if dat < 0x80:
+            return n, pos + 1
+
+
+def read_compactsize(buf, pos):
+    """Equivalent of `ReadCompactSize()` (see serialization module). Returns the value and the position after it."""
+    n = buf[pos]
+    if n < 253:
+        return n, pos + 1
+    size = {253: 2, 254: 4, 255: 8}[n]
+    return int.from_bytes(buf[pos + 1:pos + 1 + size], "little"), pos + 1 + size
 
 
 def decompress_amount(x):
@@ -72,22 +112,22 @@ def decompress_amount(x):
     return n
 
 
-def decompress_script(f):
-    """Equivalent of `DecompressScript()` (see compressor module)."""
-    size = read_varint(f)  # sizes 0-5 encode compressed script types
+def decompress_script(buf, pos):
+    """Equivalent of `DecompressScript()` (see compressor module). Returns the script and the position after it."""
+    size, pos = read_varint(buf, pos)  # sizes 0-5 encode compressed script types
     if size == 0:  # P2PKH
-        return bytes([0x76, 0xa9, 20]) + f.read(20) + bytes([0x88, 0xac])
+        return b"\x76\xa9\x14" + buf[pos:pos + 20] + b"\x88\xac", pos + 20
     elif size == 1:  # P2SH
-        return bytes([0xa9, 20]) + f.read(20) + bytes([0x87])
+        return b"\xa9\x14" + buf[pos:pos + 20] + b"\x87", pos + 20
     elif size in (2, 3):  # P2PK (compressed)
-        return bytes([33, size]) + f.read(32) + bytes([0xac])
+        return bytes([33, size]) + buf[pos:pos + 32] + b"\xac", pos + 32
     elif size in (4, 5):  # P2PK (uncompressed)
-        compressed_pubkey = bytes([size - 2]) + f.read(32)
-        return bytes([65]) + decompress_pubkey(compressed_pubkey) + bytes([0xac])
+        compressed_pubkey = bytes([size - 2]) + buf[pos:pos + 32]
+        return bytes([65]) + decompress_pubkey(compressed_pubkey) + b"\xac", pos + 32
     else:  # others (bare multisig, segwit etc.)
         size -= 6
         assert size <= 10000, f"too long script with size {size}"
-        return f.read(size)
+        return buf[pos:pos + size], pos + size
 
 
 def decompress_pubkey(compressed_pubkey):
@@ -107,11 +147,308 @@ def decompress_pubkey(compressed_pubkey):
     return bytes([4]) + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
 
 
+def decode_group(buf, pos):
+    """Decode the coins of one transaction at pos in the snapshot.
+
+    Returns a list of (txid, vout, value, coinbase, height, scriptpubkey), with the txid in the byte
+    order in which it is displayed, and the position after the coins.
+
+    This is the inner loop of the conversion, so the common cases of read_compactsize(), read_varint()
+    and decompress_script() are inlined, and decompressed amounts are cached.
+    """
+    amounts = DECOMPRESSED_AMOUNTS
+    txid = buf[pos:pos + 32][::-1]
+    num_coins, pos = read_compactsize(buf, pos + 32)
+    coins = []
+    for _ in range(num_coins):
+        # read key (COutPoint)
+        vout = buf[pos]
+        if vout < 253:
+            pos += 1
+        else:
+            vout, pos = read_compactsize(buf, pos)
+        # read value (Coin)
+        code, pos = read_varint(buf, pos)
+        compressed_amount, pos = read_varint(buf, pos)
+        amount = amounts.get(compressed_amount)
+        if amount is None:
+            amount = amounts[compressed_amount] = decompress_amount(compressed_amount)
+        script_type = buf[pos]
+        if script_type == 0:  # P2PKH
+            scriptpubkey = b"\x76\xa9\x14" + buf[pos + 1:pos + 21] + b"\x88\xac"
+            pos += 21
+        elif script_type == 1:  # P2SH
+            scriptpubkey = b"\xa9\x14" + buf[pos + 1:pos + 21] + b"\x87"
+            pos += 21
+        elif 6 <= script_type < 0x80:  # short uncompressed scripts (segwit etc.)
+            scriptpubkey = buf[pos + 1:pos + script_type - 5]
+            pos += script_type - 5
+        else:
+            scriptpubkey, pos = decompress_script(buf, pos)
+        coins.append((txid, vout, amount, code & 1, code >> 1, scriptpubkey))
+    return coins, pos
+
+
+class SQLiteWriter:
+    """Write coins to the `utxos` table of a new SQLite3 database."""
+
+    def __init__(self, filename, *, blob, indexes):
+        self.encoder = SQLiteWriter.encode_blob if blob else SQLiteWriter.encode_hex
+        self.indexes = indexes
+        self.con = sqlite3.connect(filename)
+        # The database is new, so there is nothing to protect by journaling and syncing
+        self.con.execute("PRAGMA journal_mode = OFF")
+        self.con.execute("PRAGMA synchronous = OFF")
+        text_type = "BLOB" if blob else "TEXT"
+        self.con.execute(f"CREATE TABLE utxos(txid {text_type}, vout INT, value INT, coinbase INT, height INT, scriptpubkey {text_type})")
+
+    @staticmethod
+    def encode_hex(coins):
+        return [(txid.hex(), vout, value, coinbase, height, scriptpubkey.hex())
+                for txid, vout, value, coinbase, height, scriptpubkey in coins]
+
+    @staticmethod
+    def encode_blob(coins):
+        return coins
+
+    def write(self, rows):
+        self.con.executemany("INSERT INTO utxos VALUES(?, ?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        self.con.commit()
+        for column in self.indexes:
+            print(f"Creating index on {column}...")
+            self.con.execute(f"CREATE INDEX utxos_{column} ON utxos({column})")
+        self.con.commit()
+        self.con.close()
+
+
+class CSVWriter:
+    """Write coins to a CSV file, with hex encoded txid and scriptpubkey columns.
+
+    None of the values need quoting, so the lines are formatted directly instead of with the csv module.
+    """
+
+    def __init__(self, filename):
+        self.encoder = CSVWriter.encode
+        self.file = open(filename, "w", encoding="ascii")
+        self.file.write("txid,vout,value,coinbase,height,scriptpubkey\n")
+
+    @staticmethod
+    def encode(coins):
+        return "".join(f"{txid.hex()},{vout},{value},{coinbase},{height},{scriptpubkey.hex()}\n"
+                       for txid, vout, value, coinbase, height, scriptpubkey in coins)
+
+    def write(self, lines):
+        self.file.write(lines)
+
+    def close(self):
+        self.file.close()
+
+
+def column_bytes(typecode, values):
+    """Return the values as an array of typecode in little-endian byte order."""
+    column = array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+class ColumnarWriter:
+    """Write coins to a directory with one binary file per column (see the module docstring)."""
+
+    COLUMNS = ("txid.bin", "vout.u32", "value.u64", "coinbase.u8", "height.u32", "scriptpubkey.bin", "scriptpubkey_offsets.u64")
+
+    def __init__(self, dirname, metadata):
+        self.encoder = ColumnarWriter.encode
+        self.dirname = dirname
+        self.metadata = metadata
+        os.mkdir(dirname)
+        self.files = [open(os.path.join(dirname, name), "wb") for name in self.COLUMNS]
+        self.count = 0
+        self.script_offset = 0
+
+    @staticmethod
+    def encode(coins):
+        """Return the bytes of every column, with the script offsets relative to the first script."""
+        txids, vouts, values, coinbases, heights, scriptpubkeys = zip(*coins)
+        offsets = []
+        offset = 0
+        for scriptpubkey in scriptpubkeys:
+            offsets.append(offset)
+            offset += len(scriptpubkey)
+        return (b"".join(txids), column_bytes("I", vouts), column_bytes("Q", values), bytes(coinbases),
+                column_bytes("I", heights), b"".join(scriptpubkeys), offsets)
+
+    def write(self, columns):
+        *columns, offsets = columns
+        for f, column in zip(self.files, columns):
+            f.write(column)
+        self.files[-1].write(column_bytes("Q", [self.script_offset + offset for offset in offsets]))
+        self.count += len(offsets)
+        self.script_offset += len(columns[-1])
+
+    def close(self):
+        # Terminate the script offsets with the end of the last script
+        self.files[-1].write(column_bytes("Q", [self.script_offset]))
+        for f in self.files:
+            f.close()
+        with open(os.path.join(self.dirname, "metadata.json"), "w", encoding="utf8") as f:
+            json.dump({**self.metadata, "coins": self.count}, f, indent=2)
+
+
+def scan_chunks(buf, pos, num_utxos):
+    """Split the coins at pos in the snapshot into chunks of about CHUNK_SIZE coins, at txid group boundaries.
+
+    Only the sizes of the coins are decoded. Yields the start, end and number of coins of every chunk.
+    """
+    coin_idx = 0
+    chunk_start = pos
+    chunk_coins = 0
+    while coin_idx < num_utxos:
+        num_coins, pos = read_compactsize(buf, pos + 32)
+        for _ in range(num_coins):
+            # skip vout, height and coinbase flag, and amount
+            _, pos = read_compactsize(buf, pos)
+            while buf[pos] & 0x80:
+                pos += 1
+            pos += 1
+            while buf[pos] & 0x80:
+                pos += 1
+            pos += 1
+            script_type, pos = read_varint(buf, pos)
+            pos += COMPRESSED_SCRIPT_SIZES[script_type] if script_type < 6 else script_type - 6
+        coin_idx += num_coins
+        chunk_coins += num_coins
+        if chunk_coins >= CHUNK_SIZE or coin_idx >= num_utxos:
+            yield chunk_start, pos, chunk_coins
+            chunk_start = pos
+            chunk_coins = 0
+
+
+def read_chunk_index(filename, block_hash, file_size):
+    """Return the chunks of the snapshot from its chunk index, or None if there is no valid one."""
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < CHUNK_INDEX_HEADER.size:
+        return None
+    magic, version, index_block_hash, index_file_size, count = CHUNK_INDEX_HEADER.unpack_from(data)
+    if (magic, version, index_block_hash, index_file_size) != (CHUNK_INDEX_MAGIC, CHUNK_INDEX_VERSION, block_hash, file_size):
+        return None
+    if len(data) != CHUNK_INDEX_HEADER.size + count * CHUNK_INDEX_ENTRY.size:
+        return None
+    return list(CHUNK_INDEX_ENTRY.iter_unpack(data[CHUNK_INDEX_HEADER.size:]))
+
+
+def write_chunk_index(filename, block_hash, file_size, chunks):
+    try:
+        with open(filename, "wb") as f:
+            f.write(CHUNK_INDEX_HEADER.pack(CHUNK_INDEX_MAGIC, CHUNK_INDEX_VERSION, block_hash, file_size, len(chunks)))
+            f.write(b"".join(CHUNK_INDEX_ENTRY.pack(*chunk) for chunk in chunks))
+    except OSError as e:
+        print(f"Warning: could not write chunk index {filename}: {e}")
+
+
+# The snapshot and the output encoder of a decoding worker process, see init_decode_worker()
+worker_buf = None
+worker_encoder = None
+
+
+def init_decode_worker(infile, encoder):
+    global worker_buf, worker_encoder
+    with open(infile, "rb") as f:
+        worker_buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    worker_encoder = encoder
+
+
+def decode_chunk(start, end, _num_coins):
+    """Decode and encode the coins of a chunk in a worker process. Returns their number, highest height and encoding."""
+    coins = []
+    pos = start
+    while pos < end:
+        group, pos = decode_group(worker_buf, pos)
+        coins += group
+    return len(coins), max(coin[4] for coin in coins), worker_encoder(coins)
+
+
+def decode_serial(buf, num_utxos, verbose, encoder):
+    """Decode the snapshot in the current process.
+
+    Yields batches of about WRITE_BATCH_SIZE coins as their number, highest height, the position after
+    them and their encoding for the output.
+    """
+    write_batch = []
+    pos = HEADER_SIZE
+    coin_idx = 0
+    max_height = 0
+
+    while coin_idx < num_utxos:
+        coins, pos = decode_group(buf, pos)
+        for txid, vout, amount, is_coinbase, height, scriptpubkey in coins:
+            coin_idx += 1
+            if height > max_height:
+                max_height = height
+            if verbose:
+                print(f"Coin {coin_idx}/{num_utxos}:")
+                print(f"    prevout = {txid.hex()}:{vout}")
+                print(f"    amount = {amount}, height = {height}, coinbase = {is_coinbase}")
+                print(f"    scriptPubKey = {scriptpubkey.hex()}\n")
+        write_batch += coins
+
+        if len(write_batch) >= WRITE_BATCH_SIZE or coin_idx >= num_utxos:
+            yield len(write_batch), max_height, pos, encoder(write_batch)
+            write_batch = []
+
+
+def decode_parallel(infile, buf, block_hash, num_utxos, jobs, encoder):
+    """Decode the snapshot in chunks in jobs worker processes, yielding the chunks in order like decode_serial().
+
+    The chunks are read from the chunk index of the snapshot, or found by scan_chunks() and saved to
+    it, while the workers are decoding the chunks found so far.
+    """
+    index_filename = infile + CHUNK_INDEX_SUFFIX
+    chunks = read_chunk_index(index_filename, block_hash, len(buf))
+    scanned = None
+    if chunks is None:
+        print(f"Scanning for chunks of {CHUNK_SIZE} coins, saved to {index_filename}")
+        chunks = scan_chunks(buf, HEADER_SIZE, num_utxos)
+        scanned = []
+
+    with Pool(jobs, initializer=init_decode_worker, initargs=(infile, encoder)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            if scanned is not None:
+                scanned.append(chunk)
+            pending.append((chunk[1], pool.apply_async(decode_chunk, chunk)))
+            # Limit the memory used by chunks waiting to be written
+            while len(pending) >= 2 * jobs or (pending and pending[0][1].ready()):
+                end, result = pending.popleft()
+                num_coins, max_height, data = result.get()
+                yield num_coins, max_height, end, data
+        while pending:
+            end, result = pending.popleft()
+            num_coins, max_height, data = result.get()
+            yield num_coins, max_height, end, data
+
+    if scanned is not None:
+        write_chunk_index(index_filename, block_hash, len(buf), scanned)
+
+
 def main():
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('infile', help='filename of compact-serialized UTXO set (input)')
-    parser.add_argument('outfile', help='filename of created SQLite3 database (output)')
+    parser.add_argument('outfile', help='filename of created SQLite3 database, CSV file or columnar directory (output)')
     parser.add_argument('-v', '--verbose', action='store_true', help='show details about each UTXO')
+    parser.add_argument('--format', choices=("sqlite", "csv", "columnar"), default="sqlite", help='output format (default: sqlite)')
+    parser.add_argument('--blob', action='store_true', help='store txid and scriptpubkey as BLOBs instead of hex TEXT (sqlite only)')
+    parser.add_argument('--index', action='append', choices=INDEX_COLUMNS, default=[],
+                        help='create an index on the column after inserting all coins (sqlite only, can be given more than once)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of processes decoding coins (default: number of CPUs). With more than one, '
+                             f'the positions at which the snapshot can be split are saved to <infile>{CHUNK_INDEX_SUFFIX} for reuse')
     args = parser.parse_args()
 
     if not os.path.exists(args.infile):
@@ -122,17 +459,21 @@ def main():
         print(f"Error: provided output file '{args.outfile}' already exists.")
         sys.exit(1)
 
-    # create database table
-    con = sqlite3.connect(args.outfile)
-    con.execute("CREATE TABLE utxos(txid TEXT, vout INT, value INT, coinbase INT, height INT, scriptpubkey TEXT)")
+    if args.format != "sqlite" and (args.blob or args.index):
+        print("Error: --blob and --index are only supported with --format=sqlite.")
+        sys.exit(1)
 
     # read metadata (magic bytes, version, network magic, block hash, UTXO count)
     f = open(args.infile, 'rb')
-    magic_bytes = f.read(5)
-    version = int.from_bytes(f.read(2), 'little')
-    network_magic = f.read(4)
-    block_hash = f.read(32)
-    num_utxos = int.from_bytes(f.read(8), 'little')
+    if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+        print(f"Error: provided input file '{args.infile}' is not an UTXO dump.")
+        sys.exit(1)
+    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic_bytes = buf[0:5]
+    version = int.from_bytes(buf[5:7], 'little')
+    network_magic = buf[7:11]
+    block_hash = buf[11:43]
+    num_utxos = int.from_bytes(buf[43:51], 'little')
     if magic_bytes != UTXO_DUMP_MAGIC:
         print(f"Error: provided input file '{args.infile}' is not an UTXO dump.")
         sys.exit(1)
@@ -144,49 +485,36 @@ def main():
     print(f"UTXO Snapshot for {network_string} at block hash "
           f"{block_hash[::-1].hex()[:32]}..., contains {num_utxos} coins")
 
+    if args.format == "sqlite":
+        writer = SQLiteWriter(args.outfile, blob=args.blob, indexes=args.index)
+    elif args.format == "csv":
+        writer = CSVWriter(args.outfile)
+    else:
+        writer = ColumnarWriter(args.outfile, {"network": network_string, "block_hash": block_hash[::-1].hex()})
+
     start_time = time.time()
-    write_batch = []
-    coins_per_hash_left = 0
-    prevout_hash = None
+    if args.jobs > 1 and not args.verbose:
+        batches = decode_parallel(args.infile, buf, block_hash, num_utxos, args.jobs, writer.encoder)
+    else:
+        batches = decode_serial(buf, num_utxos, args.verbose, writer.encoder)
+    coin_idx = 0
     max_height = 0
+    pos = HEADER_SIZE
 
-    for coin_idx in range(1, num_utxos+1):
-        # read key (COutPoint)
-        if coins_per_hash_left == 0:  # read next prevout hash
-            prevout_hash = f.read(32)[::-1].hex()
-            coins_per_hash_left = read_compactsize(f)
-        prevout_index = read_compactsize(f)
-        # read value (Coin)
-        code = read_varint(f)
-        height = code >> 1
-        is_coinbase = code & 1
-        amount = decompress_amount(read_varint(f))
-        scriptpubkey = decompress_script(f).hex()
-        write_batch.append((prevout_hash, prevout_index, amount, is_coinbase, height, scriptpubkey))
-        if height > max_height:
-            max_height = height
-        coins_per_hash_left -= 1
-
-        if args.verbose:
-            print(f"Coin {coin_idx}/{num_utxos}:")
-            print(f"    prevout = {prevout_hash}:{prevout_index}")
-            print(f"    amount = {amount}, height = {height}, coinbase = {is_coinbase}")
-            print(f"    scriptPubKey = {scriptpubkey}\n")
-
-        if coin_idx % (16*1024) == 0 or coin_idx == num_utxos:
-            # write utxo batch to database
-            con.executemany("INSERT INTO utxos VALUES(?, ?, ?, ?, ?, ?)", write_batch)
-            con.commit()
-            write_batch.clear()
-
-        if coin_idx % (1024*1024) == 0:
+    for num_coins, batch_max_height, pos, data in batches:
+        writer.write(data)
+        max_height = max(max_height, batch_max_height)
+        if (coin_idx + num_coins) // PROGRESS_INTERVAL > coin_idx // PROGRESS_INTERVAL:
             elapsed = time.time() - start_time
-            print(f"{coin_idx} coins converted [{coin_idx/num_utxos*100:.2f}%], " +
-                  f"{elapsed:.3f}s passed since start")
-    con.close()
+            print(f"{coin_idx + num_coins} coins converted [{(coin_idx + num_coins)/num_utxos*100:.2f}%], " +
+                  f"{elapsed:.3f}s passed since start, {(coin_idx + num_coins) / elapsed:.0f} coins/s")
+        coin_idx += num_coins
+    writer.close()
 
-    print(f"TOTAL: {num_utxos} coins written to {args.outfile}, snapshot height is {max_height}.")
-    if f.read(1) != b'':  # EOF should be reached by now
+    elapsed = time.time() - start_time
+    print(f"TOTAL: {num_utxos} coins written to {args.outfile}, snapshot height is {max_height}, "
+          f"{elapsed:.3f}s ({num_utxos / max(elapsed, 1e-9):.0f} coins/s, {pos / max(elapsed, 1e-9) / 1e6:.1f} MB/s).")
+    if coin_idx != num_utxos or pos != len(buf):  # EOF should be reached by now
         print(f"WARNING: input file {args.infile} has not reached EOF yet!")
         sys.exit(1)
 
@@ -6,7 +6,8 @@
 
 Creating a cache of the blockchain speeds up test execution when running
 multiple functional tests. This helper script is executed by test_runner when multiple
-tests are being run in parallel.
+tests are being run in parallel, once for each cache profile (see
+test_framework/cache_profiles.py) the tests use.
 """
 
 from test_framework.test_framework import BitcoinTestFramework
@@ -14,9 +15,13 @@ from test_framework.test_framework import BitcoinTestFramework
 class CreateCache(BitcoinTestFramework):
     # Test network and test nodes are not required:
 
+    def add_options(self, parser):
+        parser.add_argument("--cacheprofile", default="default", help="cache profile to create (default: %(default)s)")
+
     def set_test_params(self):
         self.num_nodes = 0
         self.uses_wallet = True
+        self.cache_profile = self.options.cacheprofile
 
     def setup_network(self):
         pass
@@ -17,16 +17,22 @@ from test_framework.test_framework import TEST_EXIT_PASSED, TEST_EXIT_FAILED
 TEST_FRAMEWORK_MODULES = [
     "address",
     "crypto.bip324_cipher",
+    "blockfilter",
     "blocktools",
+    "chain_cache",
     "compressor",
     "crypto.chacha20",
     "crypto.ellswift",
+    "fswatch",
     "key",
     "messages",
     "crypto.muhash",
     "crypto.poly1305",
     "crypto.ripemd160",
     "crypto.secp256k1",
+    "crypto.siphash",
+    "pyprofile",
+    "rpc_profile",
     "script",
     "script_util",
     "segwit_addr",
@@ -54,8 +54,7 @@ class FeatureIndexPruneTest(BitcoinTestFramework):
         self.wait_until(lambda: self.nodes[2].getindexinfo() == expected)
 
     def restart_without_indices(self):
-        for i in range(3):
-            self.restart_node(i, extra_args=["-fastprune", "-prune=1"])
+        self.restart_nodes(range(3), extra_args=[["-fastprune", "-prune=1"]] * 3)
 
     def run_test(self):
         filter_nodes = [self.nodes[0], self.nodes[2]]
@@ -137,9 +136,7 @@ class FeatureIndexPruneTest(BitcoinTestFramework):
             self.nodes[i].assert_start_raises_init_error(extra_args=self.extra_args[i], expected_msg=msg+end_msg)
 
         self.log.info("make sure the nodes start again with the indices and an additional -reindex arg")
-        for i in range(3):
-            restart_args = self.extra_args[i] + ["-reindex"]
-            self.restart_node(i, extra_args=restart_args)
+        self.restart_nodes(range(3), extra_args=[self.extra_args[i] + ["-reindex"] for i in range(3)])
 
         self.linear_sync(self.nodes[3])
         self.sync_index(height=2500)
@@ -66,6 +66,12 @@ class UTXOSetHashTest(BitcoinTestFramework):
 
         assert_equal(finalized[::-1].hex(), node_muhash)
 
+        self.log.info("Test MuHash of a dumptxoutset snapshot")
+        snapshot = node.dumptxoutset("utxos.dat", "latest")
+        snapshot_muhash, block_hash = MuHash3072.from_utxo_snapshot(snapshot['path'], jobs=2)
+        assert_equal(block_hash, snapshot['base_hash'])
+        assert_equal(snapshot_muhash.digest()[::-1].hex(), node_muhash)
+
         self.log.info("Test deterministic UTXO set hash results")
         assert_equal(node.gettxoutsetinfo()['hash_serialized_3'], "e0b4c80f2880985fdf1adc331ed0735ac207588f986c91c7c05e8cf5fe6780f0")
         assert_equal(node.gettxoutsetinfo("muhash")['muhash'], "8739b878f23030ef39a5547edc7b57f88d50fdaaf47314ff0524608deb13067e")
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+# Copyright (c) 2024-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmarks for performance sensitive parts of the functional test framework.
+
+These measure the Python side of the test harness only and don't need a bitcoind binary.
+Run all benchmarks, or a selection by name:
+
+    framework_bench.py [benchmark ...]"""
+
+import argparse
+import contextlib
+import copy
+import importlib.util
+import io
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from test_framework.crypto.bip324_cipher import (
+    aead_chacha20_poly1305_decrypt,
+    aead_chacha20_poly1305_encrypt,
+    fast_aead_chacha20_poly1305_decrypt_into,
+    fast_aead_chacha20_poly1305_encrypt,
+)
+from test_framework.blockfilter import (
+    BasicBlockFilter,
+    bip158_basic_filter,
+)
+from test_framework.chain_cache import clone_tree
+from test_framework.crypto.muhash import MuHash3072
+from test_framework.crypto.ripemd160 import (
+    HAVE_HASHLIB_RIPEMD160,
+    ripemd160_many_python,
+    ripemd160_python,
+)
+from test_framework.crypto.siphash import (
+    numpy,
+    siphash,
+    siphash_many_numpy,
+    siphash_many_python,
+)
+from test_framework.compressor import (
+    compress_amount,
+    compress_script,
+)
+from test_framework.messages import (
+    CInv,
+    MSG_TX,
+    msg_inv,
+    msg_ping,
+    msg_pong,
+    ser_compact_size,
+    ser_varint,
+    sha256,
+)
+from test_framework.script import (
+    hash160,
+    hash160_many,
+)
+from test_framework.script_util import (
+    key_to_p2pkh_script,
+    key_to_p2wpkh_script,
+    output_key_to_p2tr_script,
+    script_to_p2sh_script,
+)
+
+AEAD_PACKET_SIZES = [1 << 10, 1 << 14, 1 << 16, 1 << 20, 1 << 22]  # 1 KiB - 4 MiB
+# The reference implementation is too slow to run on the largest packets.
+AEAD_REFERENCE_MAX_SIZE = 1 << 16
+
+
+def timeit(fn, *, min_time=0.2):
+    """Return the average time in seconds of calling fn, running it at least once and for at least min_time."""
+    count, start = 0, time.perf_counter()
+    while True:
+        fn()
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / count
+
+
+def format_size(size):
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024 or unit == "MiB":
+            return f"{size:g} {unit}"
+        size /= 1024
+
+
+def bench_aead():
+    """ChaCha20Poly1305 AEAD throughput, fast vs. reference implementation."""
+    rng = random.Random(0)
+    key, nonce, aad = rng.randbytes(32), rng.randbytes(12), rng.randbytes(16)
+    print(f"{'packet':>10} {'encrypt MB/s':>14} {'decrypt MB/s':>14} {'ref encrypt MB/s':>18} {'ref decrypt MB/s':>18}")
+    for size in AEAD_PACKET_SIZES:
+        plaintext = rng.randbytes(size)
+        ciphertext = fast_aead_chacha20_poly1305_encrypt(key, nonce, aad, plaintext)
+        recvbuf = bytearray(size)
+        row = [
+            timeit(lambda: fast_aead_chacha20_poly1305_encrypt(key, nonce, aad, plaintext)),
+            timeit(lambda: fast_aead_chacha20_poly1305_decrypt_into(key, nonce, aad, memoryview(ciphertext), recvbuf)),
+        ]
+        if size <= AEAD_REFERENCE_MAX_SIZE:
+            row += [
+                timeit(lambda: aead_chacha20_poly1305_encrypt(key, nonce, aad, plaintext)),
+                timeit(lambda: aead_chacha20_poly1305_decrypt(key, nonce, aad, ciphertext)),
+            ]
+        print(f"{format_size(size):>10}" + "".join(f"{size / t / 1e6:{w}.2f}" for t, w in zip(row, [15, 15, 19, 19])))
+
+
+def bench_muhash():
+    """MuHash3072 insertion rate, insert_many vs. insert."""
+    rng = random.Random(0)
+    # Roughly the size of a serialized coin
+    items = [rng.randbytes(60) for _ in range(20000)]
+    print(f"{'elements':>10} {'insert_many/s':>14} {'insert/s':>10}")
+    for count in [100, 1000, 20000]:
+        t_many = timeit(lambda: MuHash3072().insert_many(items[:count]))
+        row = f"{count:>10} {count / t_many:14.0f}"
+        if count <= 1000:
+            muhash = MuHash3072()
+            row += f" {count / timeit(lambda: [muhash.insert(data) for data in items[:count]]):10.0f}"
+        print(row)
+
+
+def bench_blockfilter():
+    """SipHash and BIP158 basic filter build/match rate for block sized element sets."""
+    rng = random.Random(0)
+    block_hash = rng.randbytes(32).hex()
+    spks = [bytes([0x00, 20]) + rng.randbytes(20) for _ in range(5000)]
+    rows = [("siphash", lambda: [siphash(1, 2, spk) for spk in spks]),
+            ("siphash_many (python)", lambda: siphash_many_python(1, 2, spks))]
+    if numpy is not None:
+        rows.append(("siphash_many (numpy)", lambda: siphash_many_numpy(1, 2, spks)))
+    filter_bytes = bip158_basic_filter(block_hash, spks)
+    block_filter = BasicBlockFilter(block_hash, filter_bytes)
+    rows += [("build filter", lambda: bip158_basic_filter(block_hash, spks)),
+             ("decode filter", lambda: BasicBlockFilter(block_hash, filter_bytes)),
+             ("match", lambda: block_filter.matching(spks))]
+    print(f"{'operation':>22} {'elements/s':>12}")
+    for name, fn in rows:
+        print(f"{name:>22} {len(spks) / timeit(fn):12.0f}")
+
+
+def bench_hash160():
+    """HASH160 rate for public key sized inputs, batched and memoized vs. one at a time."""
+    rng = random.Random(0)
+    pubkeys = [rng.randbytes(33) for _ in range(2000)]
+    rows = [("ripemd160_python", lambda: [ripemd160_python(sha256(pubkey)) for pubkey in pubkeys]),
+            ("ripemd160_many_python", lambda: ripemd160_many_python([sha256(pubkey) for pubkey in pubkeys]))]
+    if HAVE_HASHLIB_RIPEMD160:
+        rows.append(("hash160_many (hashlib)", lambda: hash160_many(pubkeys)))
+    hash160(pubkeys[0])
+    rows.append(("hash160 (memoized)", lambda: [hash160(pubkeys[0]) for _ in pubkeys]))
+    print(f"{'operation':>22} {'hashes/s':>12}")
+    for name, fn in rows:
+        print(f"{name:>22} {len(pubkeys) / timeit(fn):12.0f}")
+
+
+def bench_chain_cache():
+    """Setup time of a node datadir from a synthetic chain cache entry, clone_tree vs. copytree."""
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory(prefix="framework_bench") as tmpdir:
+        src = os.path.join(tmpdir, "node0", "regtest")
+        os.makedirs(os.path.join(src, "blocks", "index"))
+        os.makedirs(os.path.join(src, "chainstate"))
+        # Roughly the size of the 199 block cache
+        for i in range(4):
+            with open(os.path.join(src, "blocks", f"blk0000{i}.dat"), 'wb') as f:
+                f.write(rng.randbytes(1 << 20))
+        for i in range(20):
+            with open(os.path.join(src, "chainstate", f"{i:06}.ldb"), 'wb') as f:
+                f.write(rng.randbytes(1 << 16))
+        count = 0
+
+        def clone(clone_fn):
+            nonlocal count
+            count += 1
+            return clone_fn(os.path.join(tmpdir, "node0"), os.path.join(tmpdir, f"clone{count}"))
+
+        method = clone(clone_tree)
+        print(f"{'operation':>22} {'ms/datadir':>12}")
+        print(f"{'clone_tree (' + method + ')':>22} {timeit(lambda: clone(clone_tree)) * 1000:12.2f}")
+        print(f"{'copytree':>22} {timeit(lambda: clone(shutil.copytree)) * 1000:12.2f}")
+
+
+def contrib_path(*path):
+    """Return the path of a file in contrib/ of the source tree."""
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "..", "contrib", *path)
+
+
+def load_contrib_module(name, *path):
+    """Load a script in contrib/ as a module, as its directory isn't a package and some names aren't valid identifiers."""
+    spec = importlib.util.spec_from_file_location(name, contrib_path(*path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_linearize():
+    """De-obfuscation throughput of linearize-data.py reading a synthetic blk file, bulk vs. per-byte XOR."""
+    linearize_data = load_contrib_module("linearize_data", "linearize", "linearize-data.py")
+    rng = random.Random(0)
+    magic = bytes.fromhex("fabfb5da")
+    with tempfile.TemporaryDirectory(prefix="framework_bench") as tmpdir:
+        path = os.path.join(tmpdir, "blk00000.dat")
+        with open(path, 'wb') as f:
+            # Blocks of a few hundred kB, like on mainnet
+            while f.tell() < 16 << 20:
+                size = rng.randrange(80, 1 << 20)
+                f.write(magic + size.to_bytes(4, 'little') + rng.randbytes(size))
+        file_size = os.path.getsize(path)
+
+        def read_blocks(read_xored, xor_key, limit=file_size):
+            """Read blocks like BlockDataCopier.run() until limit, returning the number of bytes read."""
+            with linearize_data.open_block_file(path) as f:
+                while f.tell() < limit:
+                    inhdr = read_xored(f, 8, xor_key)
+                    size = int.from_bytes(inhdr[4:], 'little')
+                    read_xored(f, 80, xor_key)
+                    read_xored(f, size - 80, xor_key)
+                return f.tell()
+
+        def read_xored_per_byte(f, size, xor_key):
+            """The per-byte loop linearize-data.py used before."""
+            offset = f.tell()
+            data = bytearray(f.read(size))
+            for i in range(len(data)):
+                data[i] ^= xor_key[(i + offset) % len(xor_key)]
+            return bytes(data)
+
+        print(f"{'key':>8} {'bulk MB/s':>10} {'per-byte MB/s':>14}")
+        for name, xor_key in [("zero", bytes(8)), ("random", rng.randbytes(8))]:
+            t_bulk = timeit(lambda: read_blocks(linearize_data.read_xored, xor_key))
+            # The per-byte loop is too slow for the whole file
+            per_byte_size = read_blocks(read_xored_per_byte, xor_key, 1)
+            t_per_byte = timeit(lambda: read_blocks(read_xored_per_byte, xor_key, 1))
+            print(f"{name:>8} {file_size / t_bulk / 1e6:10.1f} {per_byte_size / t_per_byte / 1e6:14.1f}")
+
+
+def synthetic_utxo_groups(rng, num_coins, num_scripts=1000):
+    """Return the coins of a synthetic UTXO snapshot, as (serialized txid, number of coins, serialized coins) per transaction.
+
+    Transactions are in the order of a snapshot, and their coins have the common script types."""
+    coin_templates = []
+    for _ in range(num_scripts):
+        script = rng.choice([key_to_p2pkh_script(rng.randbytes(33)), script_to_p2sh_script(rng.randbytes(20)),
+                             key_to_p2wpkh_script(rng.randbytes(33)), output_key_to_p2tr_script(rng.randbytes(32))])
+        coin_templates.append(ser_varint(rng.randrange(900000) * 2) + ser_varint(compress_amount(rng.randrange(10**10))) +
+                              compress_script(script))
+    groups = []
+    while num_coins:
+        group_size = min(num_coins, rng.choice([1, 1, 1, 2, 3, 10]))
+        # Snapshots are sorted by serialized txid
+        txid = len(groups).to_bytes(4, 'big') + rng.randbytes(28)
+        groups.append((txid, group_size, b"".join(ser_compact_size(vout) + rng.choice(coin_templates) for vout in range(group_size))))
+        num_coins -= group_size
+    return groups
+
+
+def write_utxo_snapshot(filename, groups):
+    with open(filename, 'wb') as f:
+        num_coins = sum(group_size for _, group_size, _ in groups)
+        f.write(b"utxo\xff" + (2).to_bytes(2, 'little') + bytes.fromhex("fabfb5da") + bytes(32) + num_coins.to_bytes(8, 'little'))
+        for txid, group_size, coins in groups:
+            f.write(txid + ser_compact_size(group_size) + coins)
+
+
+def bench_utxo_to_sqlite():
+    """utxo_to_sqlite.py conversion rate of a synthetic UTXO snapshot by number of decoding processes."""
+    num_coins = 1 << 20
+    with tempfile.TemporaryDirectory(prefix="framework_bench") as tmpdir:
+        infile = os.path.join(tmpdir, "utxos.dat")
+        write_utxo_snapshot(infile, synthetic_utxo_groups(random.Random(0), num_coins))
+        script = contrib_path("utxo-tools", "utxo_to_sqlite.py")
+        count = 0
+
+        def convert(output_format, jobs):
+            nonlocal count
+            count += 1
+            start = time.perf_counter()
+            subprocess.run([sys.executable, script, f"--jobs={jobs}", f"--format={output_format}", infile,
+                            os.path.join(tmpdir, f"out{count}")], check=True, stdout=subprocess.DEVNULL)
+            return time.perf_counter() - start
+
+        # Save the chunk index, which later conversions reuse
+        t_scan = convert("columnar", 2)
+        print(f"{'format':>10} {'jobs':>5} {'coins/s':>10} {'speedup':>8}")
+        print(f"{'columnar':>10} {'2':>5} {num_coins / t_scan:10.0f} {'':>8} (first run, scanning for chunks)")
+        for output_format in ["columnar", "sqlite"]:
+            t_serial = None
+            for jobs in [1, 2, 4, 8, 16, 32]:
+                if jobs > max(os.cpu_count() or 1, 2):
+                    break
+                t = convert(output_format, jobs)
+                t_serial = t_serial or t
+                print(f"{output_format:>10} {jobs:>5} {num_coins / t:10.0f} {t_serial / t:8.2f}")
+
+
+def bench_utxo_explorer():
+    """utxo_explorer.py query latency on a synthetic UTXO set, full table scan vs. index, and refresh vs. rebuild time."""
+    utxo_explorer = load_contrib_module("utxo_explorer", "utxo-tools", "utxo_explorer.py")
+    rng = random.Random(0)
+    num_coins = 1 << 18
+    groups = synthetic_utxo_groups(rng, num_coins, num_scripts=num_coins // 4)
+    with tempfile.TemporaryDirectory(prefix="framework_bench") as tmpdir:
+        def build(name, groups):
+            start = time.perf_counter()
+            snapshot, database = os.path.join(tmpdir, f"{name}.dat"), os.path.join(tmpdir, f"{name}.sqlite")
+            write_utxo_snapshot(snapshot, groups)
+            subprocess.run([sys.executable, contrib_path("utxo-tools", "utxo_to_sqlite.py"), "--jobs=1", snapshot, database],
+                           check=True, stdout=subprocess.DEVNULL)
+            explorer = utxo_explorer.UTXOExplorer(database)
+            with contextlib.redirect_stdout(io.StringIO()):
+                explorer.build_indexes()
+            return explorer, snapshot, time.perf_counter() - start
+
+        explorer, _, _ = build("old", groups)
+        con = explorer.con
+        scripts = [spk for (spk,) in con.execute("SELECT DISTINCT scriptpubkey FROM utxos LIMIT 1000")]
+        queries = [
+            ("lookup 1 script", lambda: con.execute("SELECT * FROM utxos NOT INDEXED WHERE scriptpubkey = ?", (scripts[0],)).fetchall(),
+             lambda: explorer.lookup_scripts(scripts[:1])),
+            (f"lookup {len(scripts)} scripts", None, lambda: explorer.lookup_scripts(scripts)),
+            ("value histogram", lambda: con.execute(f"SELECT height / {utxo_explorer.HISTOGRAM_HEIGHT_STEP}, "
+                                                    f"{utxo_explorer.VALUE_BUCKET_SQL}, count(*), sum(value) FROM utxos GROUP BY 1, 2").fetchall(),
+             lambda: explorer.value_histogram()),
+            ("top 100", lambda: con.execute("SELECT * FROM utxos NOT INDEXED ORDER BY value DESC LIMIT 100").fetchall(),
+             lambda: explorer.largest_coins(100)),
+        ]
+        print(f"{'query':>20} {'scan (ms)':>10} {'index (ms)':>11}")
+        for name, scan, indexed in queries:
+            t_scan = f"{timeit(scan) * 1e3:10.2f}" if scan else f"{'':>10}"
+            print(f"{name:>20} {t_scan} {timeit(indexed) * 1e3:11.2f}")
+
+        # Spend 1% of the transactions and add as many new ones
+        new_groups = synthetic_utxo_groups(rng, num_coins // 100)
+        new_groups = [group for group in groups if rng.random() >= 0.01] + [(bytes([0xff]) + txid[1:], size, coins) for txid, size, coins in new_groups]
+        _, snapshot, t_rebuild = build("new", new_groups)
+        start = time.perf_counter()
+        removed, added = explorer.refresh(snapshot)
+        t_refresh = time.perf_counter() - start
+        print(f"refresh removing {removed} and adding {added} coins: {t_refresh:.2f}s, convert and index: {t_rebuild:.2f}s")
+
+
+def bench_message_capture_store():
+    """message-capture-store.py ingestion rate and query latency on synthetic captures, vs. message-capture-parser.py."""
+    store_module = load_contrib_module("message_capture_store", "message-capture", "message-capture-store.py")
+    rng = random.Random(0)
+    num_peers, messages_per_file = 20, 10000
+    templates = [(b"inv", msg_inv([CInv(MSG_TX, rng.getrandbits(256)) for _ in range(rng.randrange(1, 35))]).serialize())
+                 for _ in range(100)]
+    templates += [(b"ping", msg_ping(rng.getrandbits(64)).serialize()), (b"pong", msg_pong(rng.getrandbits(64)).serialize())]
+    start_time = 1700000000 * 1000000
+    with tempfile.TemporaryDirectory(prefix="framework_bench") as tmpdir:
+        capture_dir = os.path.join(tmpdir, "message_capture")
+        for peer in range(num_peers):
+            os.makedirs(os.path.join(capture_dir, f"198.51.100.{peer}_8333"))
+            for name in ["msgs_recv.dat", "msgs_sent.dat"]:
+                with open(os.path.join(capture_dir, f"198.51.100.{peer}_8333", name), 'wb') as f:
+                    time_us = start_time
+                    for _ in range(messages_per_file):
+                        # About an hour of messages
+                        time_us += rng.randrange(720000)
+                        msgtype, payload = rng.choice(templates)
+                        f.write(time_us.to_bytes(8, 'little') + msgtype.ljust(12, b"\0") + len(payload).to_bytes(4, 'little') + payload)
+        num_messages = num_peers * 2 * messages_per_file
+
+        store = store_module.MessageCaptureStore(os.path.join(tmpdir, "captures.sqlite"))
+        start = time.perf_counter()
+        store.ingest(store_module.find_captures([capture_dir]))
+        print(f"ingest: {num_messages / (time.perf_counter() - start):.0f} messages/s")
+        peer, window = "198.51.100.7_8333", (start_time + 600 * 1000000, start_time + 900 * 1000000)
+        print(f"{'query':>36} {'store (ms)':>11} {'parser (ms)':>12}")
+        t_store = timeit(lambda: store.messages([peer], ["inv"], start=window[0], end=window[1]))
+        start = time.perf_counter()
+        subprocess.run([sys.executable, contrib_path("message-capture", "message-capture-parser.py"), "--jobs=1", "--ndjson",
+                        "--msgtype=inv", f"--peer={peer}", *map(str, store_module.find_captures([capture_dir]))],
+                       check=True, stdout=subprocess.DEVNULL)
+        t_parser = time.perf_counter() - start
+        print(f"{'inv of one peer in 5 minutes':>36} {t_store * 1e3:11.2f} {t_parser * 1e3:12.0f}")
+        print(f"{'bytes per msgtype per minute':>36} {timeit(lambda: store.traffic()) * 1e3:11.2f} {'':>12}")
+        store.close()
+
+
+def bench_asmap_lookup():
+    """contrib/asmap lookup rate of random addresses in a random 100k leaf map, trie vs. compiled interval table."""
+    asmap = load_contrib_module("asmap", "asmap", "asmap.py")
+    random.seed(0)
+    asmap_trie = asmap.ASMap.from_random(num_leaves=100000, max_asn=1 << 20)
+    start = time.perf_counter()
+    compiled = asmap_trie.compile()
+    print(f"compile: {time.perf_counter() - start:.2f}s, {len(compiled)} ranges")
+    addrs = [random.getrandbits(128) for _ in range(1 << 18)]
+    # Lookups in the trie take the address as a list of bits, as built by net_to_prefix
+    trie_addrs = addrs[:1 << 12]
+    t_trie = timeit(lambda: [asmap_trie.lookup([((addr >> (127 - i)) & 1) != 0 for i in range(128)])
+                             for addr in trie_addrs]) / len(trie_addrs)
+    t_compiled = timeit(lambda: compiled.lookup_many(addrs)) / len(addrs)
+    print(f"{'trie':>10} {1 / t_trie:12.0f} lookups/s")
+    print(f"{'compiled':>10} {1 / t_compiled:12.0f} lookups/s {t_trie / t_compiled:8.1f}x")
+
+
+def bench_asmap_binary():
+    """contrib/asmap binary encoding, decoding and diff time and peak memory for a random 1M leaf map."""
+    asmap = load_contrib_module("asmap", "asmap", "asmap.py")
+    random.seed(0)
+    asmap_trie = asmap.ASMap.from_random(num_leaves=1000000, max_asn=1 << 16, unassigned_prob=0.2)
+    updated = copy.copy(asmap_trie)
+    for _ in range(1000):
+        updated.update([random.getrandbits(1) != 0 for _ in range(random.randrange(10, 40))], random.randrange(1 << 16))
+
+    def measure(name, fn):
+        start = time.perf_counter()
+        ret = fn()
+        elapsed = time.perf_counter() - start
+        # Tracing allocations slows the code down, so measure peak memory use in a second run
+        del ret
+        tracemalloc.start()
+        ret = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:>8} {elapsed:8.2f}s {peak / (1 << 20):8.1f} MiB peak")
+        return ret
+
+    encoded = measure("encode", asmap_trie.to_binary)
+    decoded = measure("decode", lambda: asmap.ASMap.from_binary(encoded))
+    assert decoded == asmap_trie
+    diff = measure("diff", lambda: sum(1 for _ in asmap_trie.iter_diff(updated)))
+    print(f"{len(encoded)} bytes encoded, {diff} differences")
+
+
+BENCHMARKS = {
+    "aead": bench_aead,
+    "muhash": bench_muhash,
+    "blockfilter": bench_blockfilter,
+    "hash160": bench_hash160,
+    "chain_cache": bench_chain_cache,
+    "linearize": bench_linearize,
+    "utxo_to_sqlite": bench_utxo_to_sqlite,
+    "utxo_explorer": bench_utxo_explorer,
+    "message_capture_store": bench_message_capture_store,
+    "asmap_lookup": bench_asmap_lookup,
+    "asmap_binary": bench_asmap_binary,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"benchmarks to run (default: all). Choices: {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"{name}: {BENCHMARKS[name].__doc__}")
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,17 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Test per-peer message capture capability.
 
-Additionally, the output of contrib/message-capture/message-capture-parser.py should be verified manually.
+Also check that the output formats and filters of contrib/message-capture/message-capture-parser.py agree,
+and that message-capture-store.py stores the same messages.
+The output of the parser should additionally be verified manually.
 """
 
 import glob
 from io import BytesIO
+import json
 import os
+import subprocess
+import sys
 
 from test_framework.p2p import P2PDataStore, MESSAGEMAP
 from test_framework.test_framework import BitcoinTestFramework
@@ -67,6 +72,31 @@ class MessageCaptureTest(BitcoinTestFramework):
         sent_file = glob.glob(os.path.join(capturedir, "*/msgs_sent.dat"))[0]
         mini_parser(sent_file)
 
+        self.log.info("Check that the parser's JSON and NDJSON outputs and its filters agree")
+        parser_path = os.path.join(self.config["environment"]["SRCDIR"], "contrib", "message-capture", "message-capture-parser.py")
+
+        def parse(*args):
+            return subprocess.run([sys.executable, parser_path, *args, recv_file, sent_file],
+                                  check=True, stdout=subprocess.PIPE, text=True).stdout
+
+        messages = json.loads(parse("--jobs=1"))
+        assert_equal(len(messages), len(json.loads(parse("--jobs=2"))))
+        ndjson_messages = [json.loads(line) for line in parse("--ndjson").splitlines()]
+        peer = os.path.basename(os.path.dirname(recv_file))
+        assert all(message.pop("peer") == peer for message in ndjson_messages)
+        assert_equal(ndjson_messages, messages)
+        assert_equal([json.loads(line) for line in parse("--ndjson", "--msgtype=version", "--msgtype=verack", f"--peer={peer}").splitlines()],
+                     [dict(message, peer=peer) for message in messages if message["msgtype"] in ("version", "verack")])
+        assert_equal(parse("--ndjson", "--peer=192.0.2.1:8333"), "")
+
+        self.log.info("Check that the messages of the capture store match the parser's")
+        store_path = os.path.join(self.config["environment"]["SRCDIR"], "contrib", "message-capture", "message-capture-store.py")
+        database = os.path.join(self.options.tmpdir, "captures.sqlite")
+        for _ in range(2):
+            subprocess.run([sys.executable, store_path, database, "ingest", str(capturedir)], check=True)
+        stored = subprocess.run([sys.executable, store_path, database, "messages"], check=True, stdout=subprocess.PIPE, text=True).stdout
+        assert_equal([json.loads(line) for line in stored.splitlines()], [dict(message, peer=peer) for message in messages])
+
 
 if __name__ == '__main__':
     MessageCaptureTest(__file__).main()
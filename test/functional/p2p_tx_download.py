@@ -54,6 +54,8 @@ MAX_PEER_TX_ANNOUNCEMENTS = 5000
 # Python test constants
 NUM_INBOUND = 10
 MAX_GETDATA_INBOUND_WAIT = GETDATA_TX_INTERVAL + NONPREF_PEER_TX_DELAY + TXID_RELAY_DELAY
+# Pre-mined chain with the UTXOs for fill_mempool(), see test_framework/cache_profiles.py
+CACHE_PROFILE = "fill_mempool"
 
 class ConnectionType(Enum):
     """ Different connection types
@@ -69,6 +71,7 @@ class TxDownloadTest(BitcoinTestFramework):
     def set_test_params(self):
         self.num_nodes = 2
         self.extra_args= [['-maxmempool=5', '-persistmempool=0']] * self.num_nodes
+        self.cache_profile = CACHE_PROFILE
 
     def test_tx_requests(self):
         self.log.info("Test that we request transactions from all our peers, eventually")
@@ -9,10 +9,20 @@ from test_framework.blocktools import (
     create_block,
     create_coinbase,
 )
+from test_framework.messages import (
+    CInv,
+    MAX_BLOCK_WEIGHT,
+    MSG_BLOCK,
+    msg_getdata,
+)
 from test_framework.p2p import (
     P2PDataStore,
     P2PInterface,
 )
+from test_framework.script import (
+    CScript,
+    OP_RETURN,
+)
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import (
     assert_equal,
@@ -51,6 +61,33 @@ class P2PEncrypted(BitcoinTestFramework):
         block.solve()
         return block
 
+    def test_large_block(self):
+        node0, node1 = self.nodes[0], self.nodes[1]
+        tip = node0.getbestblockhash()
+        # Pad the coinbase with an OP_RETURN output, so the serialized block is close to the weight limit
+        padding = CScript([OP_RETURN, b'\x00' * (MAX_BLOCK_WEIGHT // 4 - 10000)])
+        block = create_block(int(tip, 16), create_coinbase(node0.getblockcount() + 1, extra_output_script=padding),
+                             node0.getblock(tip)['time'] + 1)
+        block.solve()
+        assert_greater_than(len(block.serialize()), MAX_BLOCK_WEIGHT // 4 - 10000)
+
+        # P2PConnection --> node0: the block is encrypted by the test framework
+        sender = node0.add_p2p_connection(P2PDataStore(), supports_v2_p2p=True)
+        assert sender.supports_v2_p2p
+        sender.send_blocks_and_test([block], node0, success=True)
+
+        # node0 --> node1 --> P2PConnection: the block is decrypted by the test framework
+        self.connect_nodes(0, 1, peer_advertises_v2=True)
+        self.sync_blocks()
+        assert_equal(node1.getbestblockhash(), block.hash_hex)
+        receiver = node1.add_p2p_connection(P2PInterface(), supports_v2_p2p=True)
+        assert receiver.supports_v2_p2p
+        receiver.send_without_ping(msg_getdata([CInv(MSG_BLOCK, block.hash_int)]))
+        receiver.wait_for_block(block.hash_int)
+        assert_equal(receiver.last_message['block'].block.serialize(), block.serialize())
+
+        self.disconnect_nodes(0, 1)
+
     def run_test(self):
         node0, node1 = self.nodes[0], self.nodes[1]
         self.log.info("Check inbound connection to v2 TestNode from v2 P2PConnection is v2")
@@ -122,6 +159,9 @@ class P2PEncrypted(BitcoinTestFramework):
         self.log.info("Check the connections opened as expected")
         check_node_connections(node=node0, num_in=4, num_out=3)
 
+        self.log.info("Check that a large block syncs over v2 in both directions")
+        self.test_large_block()
+
         self.log.info("Check inbound connection to v1 TestNode from v2 P2PConnection is v1")
         self.restart_node(0, ["-v2transport=0"])
         peer1 = node0.add_p2p_connection(P2PInterface(), wait_for_verack=True, supports_v2_p2p=True)
@@ -4,6 +4,12 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Test the getblockfilter RPC."""
 
+from test_framework.blockfilter import (
+    BasicBlockFilter,
+    bip158_basic_filter,
+    bip158_filter_header,
+    bip158_relevant_scriptpubkeys,
+)
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import (
     assert_equal, assert_is_hex_string, assert_raises_rpc_error,
@@ -46,6 +52,17 @@ class GetBlockFilterTest(BitcoinTestFramework):
                 result = self.nodes[0].getblockfilter(block_hash, filter_type)
                 assert_is_hex_string(result['filter'])
 
+        # Test that filters and filter headers built locally match the node's
+        prev_header = "00" * 32
+        for block_hash in chain1_hashes:
+            result = self.nodes[0].getblockfilter(block_hash, "basic")
+            spks = bip158_relevant_scriptpubkeys(self.nodes[0], block_hash)
+            filter_bytes = bip158_basic_filter(block_hash, spks)
+            assert_equal(filter_bytes.hex(), result['filter'])
+            prev_header = bip158_filter_header(filter_bytes, prev_header)
+            assert_equal(prev_header, result['header'])
+            assert BasicBlockFilter(block_hash, filter_bytes).match_any(list(spks))
+
         # Test getblockfilter with unknown block
         bad_block_hash = "0123456789abcdef" * 4
         assert_raises_rpc_error(-5, "Block not found", self.nodes[0].getblockfilter, bad_block_hash, "basic")
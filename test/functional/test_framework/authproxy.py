@@ -86,6 +86,9 @@ class AuthServiceProxy():
         # library on some operating systems (e.g. OpenBSD, FreeBSD)
         self.timeout = min(timeout, 2147483)
         self._set_conn(connection)
+        # Sizes of the last request and response, in bytes
+        self.last_request_size = 0
+        self.last_response_size = 0
 
     def __getattr__(self, name):
         if name.startswith('__') and name.endswith('__'):
@@ -107,6 +110,8 @@ class AuthServiceProxy():
                    'Content-type': 'application/json'}
         if not self.reuse_http_connections:
             self._set_conn()
+        self.last_request_size = len(postdata)
+        self.last_response_size = 0
         self.__conn.request(method, path, postdata, headers)
         return self._get_response()
 
@@ -199,6 +204,7 @@ class AuthServiceProxy():
                 http_response.status)
 
         data = http_response.read()
+        self.last_response_size = len(data)
         try:
             responsedata = data.decode('utf8')
         except UnicodeDecodeError as e:
@@ -3,8 +3,25 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Helper routines relevant for compact block filters (BIP158).
+
+This includes a complete implementation of the basic filter type: building a
+filter from a block's scriptPubKeys, its Golomb-Rice coded serialization,
+filter headers, and matching scripts against a filter.
 """
-from .crypto.siphash import siphash
+from io import BytesIO
+import unittest
+
+from .crypto.siphash import siphash, siphash_many
+from .messages import (
+    deser_compact_size,
+    hash256,
+    ser_compact_size,
+)
+from .script import OP_RETURN
+
+# Parameters of the basic filter type
+BASIC_FILTER_P = 19
+BASIC_FILTER_M = 784931
 
 
 def bip158_basic_element_hash(script_pub_key, N, block_hash):
@@ -21,11 +38,94 @@ def bip158_basic_element_hash(script_pub_key, N, block_hash):
     little-endian representation) of the block for which the filter is constructed. This
     ensures the key is deterministic while still varying from block to block.'
     """
-    M = 784931
+    k0, k1 = bip158_siphash_key(block_hash)
+    return (siphash(k0, k1, script_pub_key) * (N * BASIC_FILTER_M)) >> 64
+
+
+def bip158_siphash_key(block_hash):
+    """Return the SipHash key (k0, k1) for the filter of the block with the given hash (hex string)."""
     block_hash_bytes = bytes.fromhex(block_hash)[::-1]
-    k0 = int.from_bytes(block_hash_bytes[0:8], 'little')
-    k1 = int.from_bytes(block_hash_bytes[8:16], 'little')
-    return (siphash(k0, k1, script_pub_key) * (N * M)) >> 64
+    return int.from_bytes(block_hash_bytes[0:8], 'little'), int.from_bytes(block_hash_bytes[8:16], 'little')
+
+
+def bip158_basic_element_hashes(script_pub_keys, N, block_hash):
+    """Batch version of bip158_basic_element_hash, for a list of scriptPubKeys."""
+    k0, k1 = bip158_siphash_key(block_hash)
+    F = N * BASIC_FILTER_M
+    return [(h * F) >> 64 for h in siphash_many(k0, k1, script_pub_keys)]
+
+
+def golomb_rice_encode(values, P):
+    """Encode a sorted list of integers as the Golomb-Rice coded differences between consecutive values.
+
+    Bits are written most significant first, and the result is padded with zero bits to a whole byte.
+    """
+    bits = []
+    last = 0
+    for value in values:
+        delta = value - last
+        last = value
+        bits.append('1' * (delta >> P) + '0' + format(delta & ((1 << P) - 1), f'0{P}b'))
+    bitstream = ''.join(bits)
+    bitstream += '0' * (-len(bitstream) % 8)
+    return int(bitstream, 2).to_bytes(len(bitstream) // 8, 'big') if bitstream else b''
+
+
+def golomb_rice_decode(data, N, P):
+    """Decode N Golomb-Rice coded values from data (the inverse of golomb_rice_encode)."""
+    bitstream = format(int.from_bytes(data, 'big'), f'0{8 * len(data)}b') if data else ''
+    values = []
+    last = 0
+    pos = 0
+    for _ in range(N):
+        end = bitstream.find('0', pos)
+        if end == -1 or end + 1 + P > len(bitstream):
+            raise ValueError("truncated Golomb-Rice bitstream")
+        last += ((end - pos) << P) + int(bitstream[end + 1:end + 1 + P], 2)
+        values.append(last)
+        pos = end + 1 + P
+    return values
+
+
+def bip158_basic_filter(block_hash, script_pub_keys):
+    """Build the serialized basic filter for the block with the given hash, given its relevant scriptPubKeys.
+
+    The scriptPubKeys can be obtained with bip158_relevant_scriptpubkeys. Duplicate and empty scripts are
+    ignored, like in BasicFilterElements (see blockfilter.cpp).
+    """
+    elements = list(set(spk for spk in script_pub_keys if spk))
+    hashes = sorted(bip158_basic_element_hashes(elements, len(elements), block_hash))
+    return ser_compact_size(len(elements)) + golomb_rice_encode(hashes, BASIC_FILTER_P)
+
+
+def bip158_filter_header(filter_bytes, prev_header):
+    """Compute the filter header (hex string) of a serialized filter, given the previous filter header."""
+    return hash256(hash256(filter_bytes) + bytes.fromhex(prev_header)[::-1])[::-1].hex()
+
+
+class BasicBlockFilter:
+    """A decoded basic block filter, which can be queried for scriptPubKeys."""
+
+    def __init__(self, block_hash, filter_bytes):
+        self.block_hash = block_hash
+        f = BytesIO(filter_bytes)
+        self.N = deser_compact_size(f)
+        self.hashes = set(golomb_rice_decode(f.read(), self.N, BASIC_FILTER_P))
+
+    def match(self, script_pub_key):
+        """Return whether the scriptPubKey may be in the filter (false positive rate 1/M)."""
+        return self.match_any([script_pub_key])
+
+    def match_any(self, script_pub_keys):
+        """Return whether any of the scriptPubKeys may be in the filter."""
+        return len(self.matching(script_pub_keys)) > 0
+
+    def matching(self, script_pub_keys):
+        """Return the subset of the scriptPubKeys that may be in the filter."""
+        if self.N == 0:
+            return []
+        hashes = bip158_basic_element_hashes(script_pub_keys, self.N, self.block_hash)
+        return [spk for spk, h in zip(script_pub_keys, hashes) if h in self.hashes]
 
 
 def bip158_relevant_scriptpubkeys(node, block_hash):
@@ -44,6 +144,43 @@ def bip158_relevant_scriptpubkeys(node, block_hash):
                 spks.add(bytes.fromhex(i['prevout']['scriptPubKey']['hex']))
         # gather output scripts
         for o in tx['vout']:
-            if o['scriptPubKey']['type'] != 'nulldata':
-                spks.add(bytes.fromhex(o['scriptPubKey']['hex']))
+            spk = bytes.fromhex(o['scriptPubKey']['hex'])
+            if spk[:1] != bytes([OP_RETURN]):
+                spks.add(spk)
     return spks
+
+
+class TestFrameworkBlockFilter(unittest.TestCase):
+    def test_bip158_vector(self):
+        """Testnet genesis block test vector from BIP158."""
+        block_hash = "000000000933ea01ad0ee984209779baaec3ced90fa3f408719526f8d77f4943"
+        coinbase_spk = bytes.fromhex("4104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef"
+                                     "38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac")
+        filter_bytes = bip158_basic_filter(block_hash, [coinbase_spk, b''])
+        self.assertEqual(filter_bytes.hex(), "019dfca8")
+        self.assertEqual(bip158_filter_header(filter_bytes, "00" * 32), "21584579b7eb08997773e5aeff3a7f932700042d0ed2a6129012b7d7ae81b750")
+        block_filter = BasicBlockFilter(block_hash, filter_bytes)
+        self.assertTrue(block_filter.match(coinbase_spk))
+        self.assertFalse(block_filter.match(coinbase_spk[:-1]))
+
+    def test_filter_roundtrip(self):
+        block_hash = "11" * 32
+        spks = [bytes([0x00, 20]) + i.to_bytes(20, 'little') for i in range(2000)]
+        block_filter = BasicBlockFilter(block_hash, bip158_basic_filter(block_hash, spks + spks[:10]))
+        self.assertEqual(block_filter.N, len(spks))
+        self.assertEqual(block_filter.hashes, set(bip158_basic_element_hashes(spks, len(spks), block_hash)))
+        self.assertEqual(block_filter.matching(spks[::7]), spks[::7])
+        self.assertEqual([bip158_basic_element_hash(spk, len(spks), block_hash) for spk in spks[:10]],
+                         bip158_basic_element_hashes(spks[:10], len(spks), block_hash))
+        # The false positive rate is 1/M, so unrelated scripts are not expected to match
+        unrelated = [bytes([0x51, 0x20]) + i.to_bytes(32, 'little') for i in range(20)]
+        self.assertFalse(block_filter.match_any(unrelated))
+        empty_filter = BasicBlockFilter(block_hash, bip158_basic_filter(block_hash, []))
+        self.assertFalse(empty_filter.match_any(spks))
+
+    def test_golomb_rice(self):
+        values = [0, 0, 1, 2**19 - 1, 2**19, 2**21 + 5, 2**30]
+        self.assertEqual(golomb_rice_decode(golomb_rice_encode(values, 19), len(values), 19), values)
+        self.assertEqual(golomb_rice_encode([], 19), b'')
+        with self.assertRaises(ValueError):
+            golomb_rice_decode(golomb_rice_encode(values, 19)[:-3], len(values), 19)
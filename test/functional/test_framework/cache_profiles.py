@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Registry of the pre-mined chains that tests can start from.
+
+Every profile extends the 199-block chain created by BitcoinTestFramework._create_chain_cache(). A test
+selects a profile by setting self.cache_profile in set_test_params() to its module-level CACHE_PROFILE
+constant. Profiles are built on demand, or up front by test_runner for all tests it runs (found by their
+CACHE_PROFILE), and stored in the chain cache (see chain_cache.py), so each profile is built only once
+per bitcoind binary.
+"""
+
+from .blocktools import COINBASE_MATURITY
+from .mempool_util import (
+    FILL_MEMPOOL_NUM_UTXOS,
+    FILL_MEMPOOL_WALLET_TAG,
+)
+from .wallet import MiniWallet
+
+
+class CacheProfile:
+    """A pre-mined chain. build(test_framework, node) extends the 199-block chain of node, or is None."""
+
+    def __init__(self, name, description, build, version):
+        self.name = name
+        self.description = description
+        self.build = build
+        # Bump when build() changes, so that cached chains built by the old version aren't used.
+        self.version = version
+
+
+CACHE_PROFILES = {}
+
+
+def register_cache_profile(name, description, *, version=1):
+    """Decorator to register a function as the build function of a cache profile."""
+    def register(build):
+        assert name not in CACHE_PROFILES, f"duplicate cache profile {name}"
+        CACHE_PROFILES[name] = CacheProfile(name, description, build, version)
+        return build
+    return register
+
+
+CACHE_PROFILES["default"] = CacheProfile("default", "199 blocks, with mature coinbase outputs to the MiniWallet", None, 1)
+
+
+@register_cache_profile("fill_mempool", "the default chain and the mature UTXOs used by mempool_util.fill_mempool()")
+def build_fill_mempool(test_framework, node):
+    test_framework.generate(MiniWallet(node, tag_name=FILL_MEMPOOL_WALLET_TAG), FILL_MEMPOOL_NUM_UTXOS, sync_fun=test_framework.no_op)
+    test_framework.generate(node, COINBASE_MATURITY - 1, sync_fun=test_framework.no_op)
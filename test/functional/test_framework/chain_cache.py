@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Content-addressed cache of pre-mined chains.
+
+Cache entries are stored under a key derived from the contents of the bitcoind binary and the
+parameters of the cached chain. They therefore stay valid across test runs until the binary changes,
+and can be shared between runners. Entries are created in a temporary directory and renamed into
+place, so concurrent test runs never see partial entries.
+
+Node datadirs are cloned from an entry with reflinks (FICLONE) where the filesystem supports them,
+and copied otherwise. Files are never shared with the entry, because tests may modify any file of
+their nodes' datadirs in place (e.g. feature_init.py perturbs LevelDB tables).
+"""
+
+import errno
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Bump when the contents of the cached chains change, to invalidate existing cache entries.
+CHAIN_CACHE_VERSION = 2
+# Cache entries not used for this long are removed by prune_cache_dir (in seconds).
+CHAIN_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+CHAINS_DIR = "chains"
+BINARY_HASHES_DIR = "binaries"
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_atomic(path, data):
+    """Write a text file by renaming a temporary file, so that readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".tmp")
+    with os.fdopen(fd, 'w', encoding='utf8') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def binary_hash(path, cachedir):
+    """Return the SHA256 of a binary.
+
+    Hashing a large binary in every test is slow, so the result is memoized in cachedir, by the path,
+    size and modification time of the binary.
+    """
+    path = os.path.realpath(shutil.which(path) or path)
+    stat = os.stat(path)
+    memo_key = hashlib.sha256(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+    memo_path = pathlib.Path(cachedir) / BINARY_HASHES_DIR / memo_key
+    try:
+        return memo_path.read_text(encoding='utf8')
+    except FileNotFoundError:
+        pass
+    digest = file_sha256(path)
+    memo_path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(memo_path, digest)
+    return digest
+
+
+def chain_cache_key(node_argv, cachedir, **params):
+    """Return the key of the chain cache entry created by the node command node_argv, with the given parameters."""
+    data = json.dumps({
+        "version": CHAIN_CACHE_VERSION,
+        "binary": binary_hash(node_argv[0], cachedir),
+        "argv": node_argv[1:],
+        **params,
+    }, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+
+class ChainCache:
+    """The chain cache entries in a cache directory."""
+
+    def __init__(self, cachedir):
+        self.dir = pathlib.Path(cachedir) / CHAINS_DIR
+
+    def lookup(self, key):
+        """Return the directory of the entry with the given key, or None if there is none."""
+        path = self.dir / key
+        if not path.is_dir():
+            return None
+        try:
+            # Record the use, see prune_cache_dir
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def create(self, key, build):
+        """Create the entry with the given key, by calling build with the (empty) directory to fill.
+
+        If another process created the entry in the meantime, its entry is kept. Returns the directory of the entry.
+        """
+        path = self.dir / key
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = pathlib.Path(tempfile.mkdtemp(dir=self.dir, prefix=key + ".tmp"))
+        try:
+            build(tmp_path)
+            try:
+                os.rename(tmp_path, path)
+            except OSError as e:
+                if not path.is_dir() or e.errno not in (errno.EEXIST, errno.ENOTEMPTY, errno.EACCES):
+                    raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        return path
+
+
+def prune_cache_dir(cachedir, max_age=CHAIN_CACHE_MAX_AGE):
+    """Remove everything from cachedir except for chain cache entries (and memoized binary hashes) used within max_age seconds.
+
+    Chain cache entries are keyed by the binary which created them, so they never need to be flushed
+    because of a rebuild.
+    """
+    cachedir = pathlib.Path(cachedir)
+    if not cachedir.is_dir():
+        return
+    expiry = time.time() - max_age
+    for entry in cachedir.iterdir():
+        if entry.name in (CHAINS_DIR, BINARY_HASHES_DIR) and entry.is_dir():
+            for item in entry.iterdir():
+                if item.stat().st_mtime < expiry:
+                    shutil.rmtree(item) if item.is_dir() else item.unlink()
+        elif entry.is_dir():
+            shutil.rmtree(entry)
+        else:
+            entry.unlink()
+
+
+def reflink(src, dst):
+    """Clone the file src to dst sharing the data blocks (copy-on-write). Raises OSError if unsupported."""
+    if fcntl is None or sys.platform != "linux":
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported", src)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def clone_file(src, dst, method):
+    """Clone the file src to dst with the given method, falling back to the next method if it is unsupported.
+
+    Returns the method to use for further files: "reflink" or "copy".
+    """
+    if method == "reflink":
+        try:
+            reflink(src, dst)
+            return method
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+            method = "copy"
+    shutil.copy2(src, dst)
+    return method
+
+
+def clone_tree(src, dst, method="reflink"):
+    """Clone the directory tree src to the new directory dst, as cheaply as supported.
+
+    Returns the method which was used for the last file (see clone_file).
+    """
+    for root, _, files in os.walk(src):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target_root)
+        for name in files:
+            method = clone_file(os.path.join(root, name), os.path.join(target_root, name), method)
+    return method
+
+
+class TestFrameworkChainCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = pathlib.Path(tempfile.mkdtemp(prefix="chain_cache_test"))
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def make_tree(self, path):
+        (path / "regtest" / "chainstate").mkdir(parents=True)
+        (path / "regtest" / "blocks").mkdir()
+        (path / "regtest" / "chainstate" / "000003.ldb").write_bytes(b"table")
+        (path / "regtest" / "chainstate" / "MANIFEST-000002").write_bytes(b"manifest")
+        (path / "regtest" / "blocks" / "blk00000.dat").write_bytes(b"blocks")
+
+    def test_clone_tree(self):
+        src = self.tmpdir / "src"
+        self.make_tree(src)
+        for method in ["reflink", "copy"]:
+            dst = self.tmpdir / method
+            self.assertIn(clone_tree(src, dst, method), ["reflink", "copy"])
+            for path in src.rglob("*"):
+                if path.is_file():
+                    self.assertEqual((dst / path.relative_to(src)).read_bytes(), path.read_bytes())
+            # Modifying any file of the clone in place must not modify the source.
+            for name, contents in [("blocks/blk00000.dat", b"blocks"), ("chainstate/000003.ldb", b"table")]:
+                with open(dst / "regtest" / name, 'r+b') as f:
+                    f.write(b"X")
+                self.assertEqual((src / "regtest" / name).read_bytes(), contents)
+
+    def test_chain_cache(self):
+        cache = ChainCache(self.tmpdir)
+        self.assertIsNone(cache.lookup("key"))
+        path = cache.create("key", self.make_tree)
+        self.assertEqual(cache.lookup("key"), path)
+        self.assertTrue((path / "regtest" / "blocks" / "blk00000.dat").is_file())
+        # A concurrently created entry is kept.
+        self.assertEqual(cache.create("key", lambda tmp_path: (tmp_path / "other").mkdir()), path)
+        self.assertFalse((path / "other").exists())
+        self.assertEqual([entry.name for entry in cache.dir.iterdir()], ["key"])
+
+        (self.tmpdir / "node0").mkdir()
+        prune_cache_dir(self.tmpdir)
+        self.assertEqual(sorted(entry.name for entry in self.tmpdir.iterdir()), [CHAINS_DIR])
+        prune_cache_dir(self.tmpdir, max_age=-1)
+        self.assertIsNone(cache.lookup("key"))
+
+    def test_chain_cache_key(self):
+        binary = self.tmpdir / "bitcoind"
+        binary.write_bytes(b"binary")
+        key = chain_cache_key([str(binary)], self.tmpdir, chain="regtest")
+        self.assertEqual(key, chain_cache_key([str(binary)], self.tmpdir, chain="regtest"))
+        self.assertNotEqual(key, chain_cache_key([str(binary)], self.tmpdir, chain="signet"))
+        self.assertNotEqual(key, chain_cache_key([str(binary), "-m", "node"], self.tmpdir, chain="regtest"))
+        binary.write_bytes(b"other binary")
+        os.utime(binary, ns=(0, 0))
+        self.assertNotEqual(key, chain_cache_key([str(binary)], self.tmpdir, chain="regtest"))
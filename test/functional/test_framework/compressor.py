@@ -4,8 +4,18 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Routines for compressing transaction output amounts and scripts."""
 import unittest
+from io import BytesIO
 
-from .messages import COIN
+from .crypto.secp256k1 import GE
+from .messages import (
+    COIN,
+    deser_varint,
+    ser_varint,
+)
+
+# Number of special (compressed) script types, see compressor.h
+NUM_SPECIAL_SCRIPTS = 6
+MAX_SCRIPT_SIZE = 10000
 
 
 def compress_amount(n):
@@ -43,6 +53,38 @@ def decompress_amount(x):
     return n
 
 
+def compress_script(script):
+    """Equivalent of `ScriptCompression::Ser()`: serialize a script in compressed form."""
+    if len(script) == 25 and script[:3] == bytes([0x76, 0xa9, 20]) and script[23:] == bytes([0x88, 0xac]):  # P2PKH
+        return b'\x00' + script[3:23]
+    if len(script) == 23 and script[:2] == bytes([0xa9, 20]) and script[22] == 0x87:  # P2SH
+        return b'\x01' + script[2:22]
+    if len(script) == 35 and script[0] == 33 and script[1] in (2, 3) and script[34] == 0xac:  # P2PK (compressed)
+        return script[1:34]
+    if len(script) == 67 and script[0] == 65 and script[1] == 4 and script[66] == 0xac:  # P2PK (uncompressed)
+        if GE.from_bytes(script[1:66]) is not None:
+            return bytes([0x04 | (script[65] & 1)]) + script[2:34]
+    return ser_varint(len(script) + NUM_SPECIAL_SCRIPTS) + script
+
+
+def decompress_script(f):
+    """Equivalent of `ScriptCompression::Unser()`: read a compressed script from stream f."""
+    size = deser_varint(f)  # sizes 0-5 encode compressed script types
+    if size == 0:  # P2PKH
+        return bytes([0x76, 0xa9, 20]) + f.read(20) + bytes([0x88, 0xac])
+    elif size == 1:  # P2SH
+        return bytes([0xa9, 20]) + f.read(20) + bytes([0x87])
+    elif size in (2, 3):  # P2PK (compressed)
+        return bytes([33, size]) + f.read(32) + bytes([0xac])
+    elif size in (4, 5):  # P2PK (uncompressed)
+        pubkey = GE.from_bytes(bytes([size - 2]) + f.read(32))
+        assert pubkey is not None, "invalid compressed pubkey"
+        return bytes([65]) + pubkey.to_bytes_uncompressed() + bytes([0xac])
+    size -= NUM_SPECIAL_SCRIPTS
+    assert size <= MAX_SCRIPT_SIZE, f"too long script with size {size}"
+    return f.read(size)
+
+
 class TestFrameworkCompressor(unittest.TestCase):
     def test_amount_compress_decompress(self):
         def check_amount(amount, expected_compressed):
@@ -56,3 +98,18 @@ class TestFrameworkCompressor(unittest.TestCase):
         check_amount(COIN, 0x9)
         check_amount(50*COIN, 0x32)
         check_amount(21000000*COIN, 0x1406f40)
+
+    def test_script_compress_decompress(self):
+        pubkey = GE.from_bytes(bytes.fromhex("0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798"))
+        uncompressed_p2pk = bytes([65]) + pubkey.to_bytes_uncompressed() + bytes([0xac])
+        for script, compressed_len in [
+            (bytes([0x76, 0xa9, 20]) + bytes(range(20)) + bytes([0x88, 0xac]), 21),  # P2PKH
+            (bytes([0xa9, 20]) + bytes(range(20)) + bytes([0x87]), 21),  # P2SH
+            (bytes([33]) + pubkey.to_bytes_compressed() + bytes([0xac]), 33),  # P2PK (compressed)
+            (uncompressed_p2pk, 33),  # P2PK (uncompressed)
+            (bytes([0x00, 20]) + bytes(range(20)), 23),  # P2WPKH, not compressed
+            (b'', 1),
+        ]:
+            compressed = compress_script(script)
+            self.assertEqual(len(compressed), compressed_len)
+            self.assertEqual(decompress_script(BytesIO(compressed)), script)
@@ -9,8 +9,13 @@ testing.
 """
 
 import os
+import time
 
 from .authproxy import AuthServiceProxy
+from .rpc_profile import (
+    RPCProfile,
+    get_call_site,
+)
 from typing import Optional
 
 REFERENCE_FILENAME = 'rpc_interface.txt'
@@ -21,25 +26,28 @@ class AuthServiceProxyWrapper():
     An object that wraps AuthServiceProxy to record specific RPC calls.
 
     """
-    def __init__(self, auth_service_proxy_instance: AuthServiceProxy, rpc_url: str, coverage_logfile: Optional[str]=None):
+    def __init__(self, auth_service_proxy_instance: AuthServiceProxy, rpc_url: str, coverage_logfile: Optional[str]=None, rpc_profile: Optional[RPCProfile]=None):
         """
         Kwargs:
             auth_service_proxy_instance: the instance being wrapped.
             rpc_url: url of the RPC instance being wrapped
             coverage_logfile: if specified, write each service_name
                 out to a file when called.
+            rpc_profile: if specified, record the latency, size and
+                call site of each call in it.
 
         """
         self.auth_service_proxy_instance = auth_service_proxy_instance
         self.rpc_url = rpc_url
         self.coverage_logfile = coverage_logfile
+        self.rpc_profile = rpc_profile
 
     def __getattr__(self, name):
         return_val = getattr(self.auth_service_proxy_instance, name)
         if not isinstance(return_val, type(self.auth_service_proxy_instance)):
             # If proxy getattr returned an unwrapped value, do the same here.
             return return_val
-        return AuthServiceProxyWrapper(return_val, self.rpc_url, self.coverage_logfile)
+        return AuthServiceProxyWrapper(return_val, self.rpc_url, self.coverage_logfile, self.rpc_profile)
 
     def __call__(self, *args, **kwargs):
         """
@@ -47,7 +55,20 @@ class AuthServiceProxyWrapper():
         called to a file.
 
         """
-        return_val = self.auth_service_proxy_instance.__call__(*args, **kwargs)
+        if self.rpc_profile is None:
+            return_val = self.auth_service_proxy_instance.__call__(*args, **kwargs)
+        else:
+            start = time.perf_counter()
+            try:
+                return_val = self.auth_service_proxy_instance.__call__(*args, **kwargs)
+            finally:
+                self.rpc_profile.record(
+                    self.auth_service_proxy_instance._service_name,
+                    elapsed=time.perf_counter() - start,
+                    request_bytes=self.auth_service_proxy_instance.last_request_size,
+                    response_bytes=self.auth_service_proxy_instance.last_response_size,
+                    call_site=get_call_site(),
+                )
         self._log_call()
         return return_val
 
@@ -61,7 +82,8 @@ class AuthServiceProxyWrapper():
     def __truediv__(self, relative_uri):
         return AuthServiceProxyWrapper(self.auth_service_proxy_instance / relative_uri,
                                        self.rpc_url,
-                                       self.coverage_logfile)
+                                       self.coverage_logfile,
+                                       self.rpc_profile)
 
     def get_request(self, *args, **kwargs):
         self._log_call()
@@ -7,14 +7,18 @@
 
 It is designed for ease of understanding, not performance.
 
+The fast_* functions and FastFSChaCha20Poly1305 are equivalent versions built on the batched
+ChaCha20 keystream and FastPoly1305. They are used by the v2 P2P transport.
+
 WARNING: This code is slow and trivially vulnerable to side channel attacks. Do not use for
 anything but tests.
 """
 
+import random
 import unittest
 
-from .chacha20 import chacha20_block, REKEY_INTERVAL
-from .poly1305 import Poly1305
+from .chacha20 import chacha20_block, chacha20_keystream, REKEY_INTERVAL
+from .poly1305 import FastPoly1305, Poly1305
 
 
 def pad16(x):
@@ -62,23 +66,89 @@ def aead_chacha20_poly1305_decrypt(key, nonce, aad, ciphertext):
     return bytes(ret)
 
 
+def _fast_crypt(key, nonce, data):
+    """XOR data with the ChaCha20 keystream starting at block counter 1.
+
+    Returns the result and the Poly1305 key, which is taken from block 0 of the same keystream batch.
+    """
+    keystream = chacha20_keystream(key, nonce, 0, 1 + (len(data) + 63) // 64)
+    ret = (int.from_bytes(data, 'little') ^ int.from_bytes(keystream[64:64 + len(data)], 'little')).to_bytes(len(data), 'little')
+    return ret, keystream[:32]
+
+
+def _fast_tag(poly1305_key, aad, ciphertext):
+    """Compute the ChaCha20Poly1305 tag of aad and ciphertext."""
+    mac_data = b''.join([aad, pad16(aad), ciphertext, pad16(ciphertext),
+                         len(aad).to_bytes(8, 'little'), len(ciphertext).to_bytes(8, 'little')])
+    return FastPoly1305(poly1305_key).tag(mac_data)
+
+
+def fast_aead_chacha20_poly1305_encrypt(key, nonce, aad, plaintext):
+    """Encrypt a plaintext using ChaCha20Poly1305.
+
+    Same result as aead_chacha20_poly1305_encrypt, using the batched keystream and FastPoly1305.
+    """
+    if plaintext is None:
+        return None
+    ciphertext, poly1305_key = _fast_crypt(key, nonce, plaintext)
+    return ciphertext + _fast_tag(poly1305_key, aad, ciphertext)
+
+
+def fast_aead_chacha20_poly1305_decrypt_into(key, nonce, aad, ciphertext, out):
+    """Decrypt a ChaCha20Poly1305 ciphertext into the writable buffer out.
+
+    ciphertext may be a memoryview into a receive buffer, which avoids copying it. Returns the length of
+    the plaintext written to the start of out, or None if authentication fails.
+    """
+    if ciphertext is None or len(ciphertext) < 16:
+        return None
+    msg_len = len(ciphertext) - 16
+    plaintext, poly1305_key = _fast_crypt(key, nonce, ciphertext[:msg_len])
+    if ciphertext[msg_len:] != _fast_tag(poly1305_key, aad, ciphertext[:msg_len]):
+        return None
+    out[:msg_len] = plaintext
+    return msg_len
+
+
+def fast_aead_chacha20_poly1305_decrypt(key, nonce, aad, ciphertext):
+    """Decrypt a ChaCha20Poly1305 ciphertext.
+
+    Same result as aead_chacha20_poly1305_decrypt, using the batched keystream and FastPoly1305.
+    """
+    if ciphertext is None or len(ciphertext) < 16:
+        return None
+    ret = bytearray(len(ciphertext) - 16)
+    if fast_aead_chacha20_poly1305_decrypt_into(key, nonce, aad, ciphertext, ret) is None:
+        return None
+    return bytes(ret)
+
+
 class FSChaCha20Poly1305:
     """Rekeying wrapper AEAD around ChaCha20Poly1305."""
+    aead_encrypt = staticmethod(aead_chacha20_poly1305_encrypt)
+    aead_decrypt = staticmethod(aead_chacha20_poly1305_decrypt)
+
     def __init__(self, initial_key):
         self._key = initial_key
         self._packet_counter = 0
 
-    def _crypt(self, aad, text, is_decrypt):
-        nonce = ((self._packet_counter % REKEY_INTERVAL).to_bytes(4, 'little') +
-                 (self._packet_counter // REKEY_INTERVAL).to_bytes(8, 'little'))
-        if is_decrypt:
-            ret = aead_chacha20_poly1305_decrypt(self._key, nonce, aad, text)
-        else:
-            ret = aead_chacha20_poly1305_encrypt(self._key, nonce, aad, text)
+    def _nonce(self):
+        return ((self._packet_counter % REKEY_INTERVAL).to_bytes(4, 'little') +
+                (self._packet_counter // REKEY_INTERVAL).to_bytes(8, 'little'))
+
+    def _advance(self, nonce):
         if (self._packet_counter + 1) % REKEY_INTERVAL == 0:
             rekey_nonce = b"\xFF\xFF\xFF\xFF" + nonce[4:]
-            self._key = aead_chacha20_poly1305_encrypt(self._key, rekey_nonce, b"", b"\x00" * 32)[:32]
+            self._key = self.aead_encrypt(self._key, rekey_nonce, b"", b"\x00" * 32)[:32]
         self._packet_counter += 1
+
+    def _crypt(self, aad, text, is_decrypt):
+        nonce = self._nonce()
+        if is_decrypt:
+            ret = self.aead_decrypt(self._key, nonce, aad, text)
+        else:
+            ret = self.aead_encrypt(self._key, nonce, aad, text)
+        self._advance(nonce)
         return ret
 
     def decrypt(self, aad, ciphertext):
@@ -88,6 +158,19 @@ class FSChaCha20Poly1305:
         return self._crypt(aad, plaintext, False)
 
 
+class FastFSChaCha20Poly1305(FSChaCha20Poly1305):
+    """FSChaCha20Poly1305 using the fast AEAD functions, interchangeable with the reference version."""
+    aead_encrypt = staticmethod(fast_aead_chacha20_poly1305_encrypt)
+    aead_decrypt = staticmethod(fast_aead_chacha20_poly1305_decrypt)
+
+    def decrypt_into(self, aad, ciphertext, out):
+        """Decrypt ciphertext into the writable buffer out. Returns the plaintext length, or None on failure."""
+        nonce = self._nonce()
+        ret = fast_aead_chacha20_poly1305_decrypt_into(self._key, nonce, aad, ciphertext, out)
+        self._advance(nonce)
+        return ret
+
+
 # Test vectors from RFC8439 consisting of plaintext, aad, 32 byte key, 12 byte nonce and ciphertext
 AEAD_TESTS = [
     # RFC 8439 Example from section 2.8.2
@@ -176,10 +259,29 @@ class TestFrameworkAEAD(unittest.TestCase):
             key = bytes.fromhex(hex_key)
             nonce = hex_nonce[0].to_bytes(4, 'little') + hex_nonce[1].to_bytes(8, 'little')
 
+            for encrypt, decrypt in [(aead_chacha20_poly1305_encrypt, aead_chacha20_poly1305_decrypt),
+                                     (fast_aead_chacha20_poly1305_encrypt, fast_aead_chacha20_poly1305_decrypt)]:
+                ciphertext = encrypt(key, nonce, aad, plain)
+                self.assertEqual(hex_cipher, ciphertext.hex())
+                plaintext = decrypt(key, nonce, aad, ciphertext)
+                self.assertEqual(plain, plaintext)
+
+    def test_fast_aead(self):
+        """Fast ChaCha20Poly1305 AEAD is interchangeable with the reference version."""
+        rng = random.Random(324)
+        for length in [0, 1, 63, 64, 65, 1000, 70000]:
+            key, nonce, aad, plain = rng.randbytes(32), rng.randbytes(12), rng.randbytes(length % 37), rng.randbytes(length)
             ciphertext = aead_chacha20_poly1305_encrypt(key, nonce, aad, plain)
-            self.assertEqual(hex_cipher, ciphertext.hex())
-            plaintext = aead_chacha20_poly1305_decrypt(key, nonce, aad, ciphertext)
-            self.assertEqual(plain, plaintext)
+            self.assertEqual(ciphertext, fast_aead_chacha20_poly1305_encrypt(key, nonce, aad, plain))
+            self.assertEqual(plain, fast_aead_chacha20_poly1305_decrypt(key, nonce, aad, ciphertext))
+            buf = bytearray(length + 10)
+            self.assertEqual(length, fast_aead_chacha20_poly1305_decrypt_into(key, nonce, aad, memoryview(ciphertext), buf))
+            self.assertEqual(plain, buf[:length])
+            # Any modification of the ciphertext or aad must fail authentication.
+            tampered = bytearray(ciphertext)
+            tampered[rng.randrange(len(tampered))] ^= 1
+            self.assertIsNone(fast_aead_chacha20_poly1305_decrypt(key, nonce, aad, bytes(tampered)))
+            self.assertIsNone(fast_aead_chacha20_poly1305_decrypt(key, nonce, aad + b"\x00", ciphertext))
 
     def test_fschacha20poly1305aead(self):
         "FSChaCha20Poly1305 AEAD test vectors."
@@ -189,15 +291,23 @@ class TestFrameworkAEAD(unittest.TestCase):
             aad = bytes.fromhex(hex_aad)
             key = bytes.fromhex(hex_key)
 
-            enc_aead = FSChaCha20Poly1305(key)
-            dec_aead = FSChaCha20Poly1305(key)
+            for aead_class in [FSChaCha20Poly1305, FastFSChaCha20Poly1305]:
+                enc_aead = aead_class(key)
+                dec_aead = aead_class(key)
 
-            for _ in range(msg_idx):
-                enc_aead.encrypt(b"", None)
-            ciphertext = enc_aead.encrypt(aad, plain)
-            self.assertEqual(hex_cipher, ciphertext.hex())
+                for _ in range(msg_idx):
+                    enc_aead.encrypt(b"", None)
+                ciphertext = enc_aead.encrypt(aad, plain)
+                self.assertEqual(hex_cipher, ciphertext.hex())
+
+                for _ in range(msg_idx):
+                    dec_aead.decrypt(b"", None)
+                plaintext = dec_aead.decrypt(aad, ciphertext)
+                self.assertEqual(plain, plaintext)
 
+            dec_aead = FastFSChaCha20Poly1305(key)
             for _ in range(msg_idx):
                 dec_aead.decrypt(b"", None)
-            plaintext = dec_aead.decrypt(aad, ciphertext)
-            self.assertEqual(plain, plaintext)
+            buf = bytearray(len(plain))
+            self.assertEqual(len(plain), dec_aead.decrypt_into(aad, memoryview(ciphertext), buf))
+            self.assertEqual(plain, buf)
@@ -3,10 +3,23 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Native Python MuHash3072 implementation."""
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import hashlib
+import itertools
+import os
+import random
+import tempfile
 import unittest
 
-from .chacha20 import chacha20_block
+from .chacha20 import chacha20_block, chacha20_blocks
+from ..compressor import compress_amount, compress_script, decompress_amount, decompress_script
+from ..messages import deser_compact_size, deser_varint, ser_compact_size, ser_string, ser_varint
+
+UTXO_DUMP_MAGIC = b'utxo\xff'
+UTXO_DUMP_VERSION = 2
+# Number of elements hashed per task when hashing in a process pool
+POOL_CHUNK_SIZE = 4096
 
 def data_to_num3072(data):
     """Hash a 32-byte array data to a 3072-bit number using 6 Chacha20 operations."""
@@ -15,6 +28,82 @@ def data_to_num3072(data):
         bytes384 += chacha20_block(data, bytes(12), counter)
     return int.from_bytes(bytes384, 'little')
 
+def data_to_num3072_many(datas):
+    """Compute data_to_num3072 for every 32-byte array in datas, using batched Chacha20."""
+    bytes384s = chacha20_blocks([(data, bytes(12), counter) for data in datas for counter in range(6)])
+    return [int.from_bytes(bytes384s[i:i + 384], 'little') for i in range(0, len(bytes384s), 384)]
+
+def num3072_reduce(x):
+    """Reduce x modulo MuHash3072.MODULUS, using that 2**3072 = 1103717 (mod MODULUS)."""
+    while x >> 3072:
+        x = (x & (2**3072 - 1)) + (x >> 3072) * 1103717
+    return x - MuHash3072.MODULUS if x >= MuHash3072.MODULUS else x
+
+def num3072_product(nums):
+    """Multiply a list of 3072-bit numbers modulo MuHash3072.MODULUS, using a product tree."""
+    if not nums:
+        return 1
+    while len(nums) > 1:
+        products = [num3072_reduce(nums[i] * nums[i + 1]) for i in range(0, len(nums) - 1, 2)]
+        if len(nums) % 2:
+            products.append(nums[-1])
+        nums = products
+    return nums[0]
+
+def hash_product(items):
+    """Return the product of the 3072-bit hashes of the byte arrays in items."""
+    return num3072_product(data_to_num3072_many([hashlib.sha256(data).digest() for data in items]))
+
+def hash_product_parallel(items, jobs):
+    """Return the product of the 3072-bit hashes of the byte arrays in the iterable items.
+
+    The hashing is spread over a pool of jobs processes, in chunks of POOL_CHUNK_SIZE items. Items are
+    consumed lazily, keeping at most two chunks per process in flight.
+    """
+    chunks = iter(lambda: list(itertools.islice(items, POOL_CHUNK_SIZE)), [])
+    if jobs <= 1:
+        return num3072_product([hash_product(chunk) for chunk in chunks])
+    products = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(hash_product, chunk))
+            if len(pending) >= 2 * jobs:
+                products.append(pending.popleft().result())
+        products += [future.result() for future in pending]
+    return num3072_product(products)
+
+def utxo_snapshot_coins(f):
+    """Read a UTXO snapshot created by the `dumptxoutset` RPC from stream f.
+
+    Returns the base block hash and a generator of the serialized coins, in the format that
+    gettxoutsetinfo's MuHash is computed over (outpoint, height and coinbase flag, output).
+    """
+    magic = f.read(5)
+    assert magic == UTXO_DUMP_MAGIC, "not a UTXO snapshot"
+    version = int.from_bytes(f.read(2), 'little')
+    assert version == UTXO_DUMP_VERSION, f"unsupported UTXO snapshot version {version}"
+    f.read(4)  # network magic
+    block_hash = f.read(32)[::-1].hex()
+    num_coins = int.from_bytes(f.read(8), 'little')
+
+    def coins():
+        coins_left = num_coins
+        while coins_left > 0:
+            txid = f.read(32)
+            coins_per_txid = deser_compact_size(f)
+            assert 0 < coins_per_txid <= coins_left
+            for _ in range(coins_per_txid):
+                vout = deser_compact_size(f)
+                code = deser_varint(f)
+                amount = decompress_amount(deser_varint(f))
+                script = decompress_script(f)
+                yield (txid + vout.to_bytes(4, 'little') + code.to_bytes(4, 'little') +
+                       amount.to_bytes(8, 'little') + ser_string(script))
+            coins_left -= coins_per_txid
+
+    return block_hash, coins()
+
 class MuHash3072:
     """Class representing the MuHash3072 computation of a set.
 
@@ -38,12 +127,45 @@ class MuHash3072:
         data_hash = hashlib.sha256(data).digest()
         self.denominator = (self.denominator * data_to_num3072(data_hash)) % self.MODULUS
 
+    def insert_many(self, items, *, jobs=1):
+        """Insert all byte arrays of the iterable items in the set, hashing them in jobs processes."""
+        self.numerator = num3072_reduce(self.numerator * hash_product_parallel(iter(items), jobs))
+
+    def remove_many(self, items, *, jobs=1):
+        """Remove all byte arrays of the iterable items from the set, hashing them in jobs processes."""
+        self.denominator = num3072_reduce(self.denominator * hash_product_parallel(iter(items), jobs))
+
+    def __imul__(self, other):
+        """Combine with another MuHash3072 (the union of the two sets)."""
+        self.numerator = num3072_reduce(self.numerator * other.numerator)
+        self.denominator = num3072_reduce(self.denominator * other.denominator)
+        return self
+
+    def __itruediv__(self, other):
+        """Remove the set of another MuHash3072 from this one."""
+        self.numerator = num3072_reduce(self.numerator * other.denominator)
+        self.denominator = num3072_reduce(self.denominator * other.numerator)
+        return self
+
     def digest(self):
         """Extract the final hash. Does not modify this object."""
         val = (self.numerator * pow(self.denominator, -1, self.MODULUS)) % self.MODULUS
         bytes384 = val.to_bytes(384, 'little')
         return hashlib.sha256(bytes384).digest()
 
+    @classmethod
+    def from_utxo_snapshot(cls, path, *, jobs=1):
+        """Compute the MuHash of the UTXO set in a `dumptxoutset` file, streaming the coins from disk.
+
+        Returns the MuHash3072 object and the snapshot's base block hash. The digest is expected to match
+        `gettxoutsetinfo muhash` at that block.
+        """
+        muhash = cls()
+        with open(path, 'rb') as f:
+            block_hash, coins = utxo_snapshot_coins(f)
+            muhash.insert_many(coins, jobs=jobs)
+        return muhash, block_hash
+
 class TestFrameworkMuhash(unittest.TestCase):
     def test_muhash(self):
         muhash = MuHash3072()
@@ -53,3 +175,56 @@ class TestFrameworkMuhash(unittest.TestCase):
         finalized = muhash.digest()
         # This mirrors the result in the C++ MuHash3072 unit test
         self.assertEqual(finalized[::-1].hex(), "10d312b100cbd32ada024a6646e40d3482fcff103668d2625f10002a607d5863")
+
+    def test_muhash_batch(self):
+        rng = random.Random(3072)
+        items = [rng.randbytes(rng.randrange(100)) for _ in range(50)]
+        reference = MuHash3072()
+        for data in items[:40]:
+            reference.insert(data)
+        for data in items[40:]:
+            reference.remove(data)
+
+        muhash = MuHash3072()
+        muhash.insert_many(items[:40])
+        muhash.remove_many(items[40:])
+        self.assertEqual(reference.digest(), muhash.digest())
+
+        combined = MuHash3072()
+        combined.insert_many(items[:20])
+        other = MuHash3072()
+        other.insert_many(items[20:40], jobs=2)
+        other.remove_many(items[40:])
+        combined *= other
+        self.assertEqual(reference.digest(), combined.digest())
+        combined /= other
+        only_first = MuHash3072()
+        only_first.insert_many(items[:20])
+        self.assertEqual(only_first.digest(), combined.digest())
+
+        empty = MuHash3072()
+        empty.insert_many([])
+        self.assertEqual(MuHash3072().digest(), empty.digest())
+
+    def test_utxo_snapshot(self):
+        rng = random.Random(1103717)
+        snapshot = UTXO_DUMP_MAGIC + UTXO_DUMP_VERSION.to_bytes(2, 'little') + bytes.fromhex("fabfb5da") + bytes(32)
+        snapshot += (6).to_bytes(8, 'little')
+        reference = MuHash3072()
+        for coins_per_txid in [1, 2, 3]:
+            txid = rng.randbytes(32)
+            snapshot += txid + ser_compact_size(coins_per_txid)
+            for vout in range(coins_per_txid):
+                height, coinbase, amount = rng.randrange(1000), rng.randrange(2), rng.randrange(21000000 * 10**8)
+                script = bytes([0x00, 20]) + rng.randbytes(20)
+                snapshot += ser_compact_size(vout) + ser_varint(height * 2 + coinbase)
+                snapshot += ser_varint(compress_amount(amount)) + compress_script(script)
+                reference.insert(txid + vout.to_bytes(4, 'little') + (height * 2 + coinbase).to_bytes(4, 'little') +
+                                 amount.to_bytes(8, 'little') + ser_string(script))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "utxos.dat")
+            with open(path, 'wb') as f:
+                f.write(snapshot)
+            muhash, block_hash = MuHash3072.from_utxo_snapshot(path)
+        self.assertEqual("00" * 32, block_hash)
+        self.assertEqual(reference.digest(), muhash.digest())
@@ -1,10 +1,21 @@
 # Copyright (c) 2021 Pieter Wuille
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
-"""Test-only pure Python RIPEMD160 implementation."""
+"""Test-only RIPEMD160 implementation.
 
+hashlib's RIPEMD160 is used when the Python build provides it (OpenSSL 3 builds usually do not). Otherwise
+the pure Python implementation is used, which can hash many messages in parallel (ripemd160_many)."""
+
+import hashlib
+import random
 import unittest
 
+try:
+    hashlib.new('ripemd160')
+    HAVE_HASHLIB_RIPEMD160 = True
+except ValueError:
+    HAVE_HASHLIB_RIPEMD160 = False
+
 # Message schedule indexes for the left path.
 ML = [
     0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
@@ -92,8 +103,8 @@ def compress(h0, h1, h2, h3, h4, block):
     return h1 + cl + dr, h2 + dl + er, h3 + el + ar, h4 + al + br, h0 + bl + cr
 
 
-def ripemd160(data):
-    """Compute the RIPEMD-160 hash of data."""
+def ripemd160_python(data):
+    """Compute the RIPEMD-160 hash of data, one block at a time."""
     # Initialize state.
     state = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0)
     # Process full 64-byte blocks in the input.
@@ -109,11 +120,94 @@ def ripemd160(data):
     return b"".join((h & 0xffffffff).to_bytes(4, 'little') for h in state)
 
 
+def _lane_functions(mask):
+    """The f1..f5 functions, for lane-packed 32-bit words (see compress_lanes)."""
+    return [
+        lambda x, y, z: x ^ y ^ z,
+        lambda x, y, z: (x & y) | ((x ^ mask) & z),
+        lambda x, y, z: (x | (y ^ mask)) ^ z,
+        lambda x, y, z: (x & z) | (y & (z ^ mask)),
+        lambda x, y, z: x ^ (y | (z ^ mask)),
+    ]
+
+
+def compress_lanes(state, x, nlanes):
+    """Compress nlanes lane-packed states (h0, h1, h2, h3, h4) with nlanes lane-packed blocks x[0..15].
+
+    Like in chacha20._chacha20_parallel_blocks, the words of message i are stored in bits 64*i..64*i+31 of
+    one Python integer, so that every operation acts on all messages at once.
+    """
+    lanes = int.from_bytes((b'\x01' + bytes(7)) * nlanes, 'little')
+    mask = 0xffffffff * lanes
+    functions = _lane_functions(mask)
+    h0, h1, h2, h3, h4 = state
+    al, bl, cl, dl, el = h0, h1, h2, h3, h4
+    ar, br, cr, dr, er = h0, h1, h2, h3, h4
+    for rnd in range(5):
+        fl, fr = functions[rnd], functions[4 - rnd]
+        kl, kr = KL[rnd] * lanes, KR[rnd] * lanes
+        for j in range(16 * rnd, 16 * rnd + 16):
+            t, s = (al + fl(bl, cl, dl) + x[ML[j]] + kl) & mask, RL[j]
+            al = (((t << s) | (t >> (32 - s))) + el) & mask
+            al, bl, cl, dl, el = el, al, bl, ((cl << 10) | (cl >> 22)) & mask, dl
+            t, s = (ar + fr(br, cr, dr) + x[MR[j]] + kr) & mask, RR[j]
+            ar = (((t << s) | (t >> (32 - s))) + er) & mask
+            ar, br, cr, dr, er = er, ar, br, ((cr << 10) | (cr >> 22)) & mask, dr
+    return tuple(v & mask for v in (h1 + cl + dr, h2 + dl + er, h3 + el + ar, h4 + al + br, h0 + bl + cr))
+
+
+def ripemd160_many_python(datas):
+    """Compute the RIPEMD-160 hashes of a list of byte arrays, hashing messages with the same number of
+    blocks in parallel."""
+    groups = {}
+    for i, data in enumerate(datas):
+        pad = b"\x80" + b"\x00" * ((119 - len(data)) & 63)
+        padded = bytes(data) + pad + (8 * len(data)).to_bytes(8, 'little')
+        groups.setdefault(len(padded) >> 6, []).append((i, padded))
+    result = [b""] * len(datas)
+    for nblocks, group in groups.items():
+        n = len(group)
+        lanes = int.from_bytes((b'\x01' + bytes(7)) * n, 'little')
+        state = tuple(h * lanes for h in (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0))
+        lane_bytes = bytearray(8 * n)
+        for b in range(nblocks):
+            blocks = b"".join(padded[64*b:64*(b+1)] for _, padded in group)
+            x = []
+            for w in range(16):
+                # Spread byte k of word w of every block over the lanes.
+                for k in range(4):
+                    lane_bytes[k::8] = blocks[4*w + k::64]
+                x.append(int.from_bytes(lane_bytes, 'little'))
+            state = compress_lanes(state, x, n)
+        digests = bytearray(20 * n)
+        for w, h in enumerate(state):
+            h_bytes = h.to_bytes(8 * n, 'little')
+            for k in range(4):
+                digests[4*w + k::20] = h_bytes[k::8]
+        for j, (i, _) in enumerate(group):
+            result[i] = bytes(digests[20*j:20*(j+1)])
+    return result
+
+
+def ripemd160(data):
+    """Compute the RIPEMD-160 hash of data."""
+    if HAVE_HASHLIB_RIPEMD160:
+        return hashlib.new('ripemd160', data).digest()
+    return ripemd160_many_python([data])[0]
+
+
+def ripemd160_many(datas):
+    """Compute the RIPEMD-160 hashes of a list of byte arrays."""
+    if HAVE_HASHLIB_RIPEMD160:
+        return [hashlib.new('ripemd160', data).digest() for data in datas]
+    return ripemd160_many_python(datas)
+
+
 class TestFrameworkKey(unittest.TestCase):
     def test_ripemd160(self):
         """RIPEMD-160 test vectors."""
         # See https://homes.esat.kuleuven.be/~bosselae/ripemd160.html
-        for msg, hexout in [
+        vectors = [
             (b"", "9c1185a5c5e9fc54612808977ee8f548b2258d31"),
             (b"a", "0bdc9d2d256b3ee9daae347be6f4dc835a467ffe"),
             (b"abc", "8eb208f7e05d987a9b044a8e98c6b087f15a0bfc"),
@@ -126,5 +220,17 @@ class TestFrameworkKey(unittest.TestCase):
                 "b0e20b6e3116640286ed3a87a5713079b21f5189"),
             (b"1234567890" * 8, "9b752e45573d4b39f4dbd3323cab82bf63326bfb"),
             (b"a" * 1000000, "52783243c1697bdbe16d37f97f68f08325dc1528")
-        ]:
+        ]
+        for msg, hexout in vectors:
             self.assertEqual(ripemd160(msg).hex(), hexout)
+            self.assertEqual(ripemd160_python(msg).hex(), hexout)
+        # The parallel implementations are checked without the (slow) last vector.
+        msgs, hexouts = zip(*vectors[:-1])
+        self.assertEqual([h.hex() for h in ripemd160_many_python(list(msgs))], list(hexouts))
+        self.assertEqual([h.hex() for h in ripemd160_many(list(msgs))], list(hexouts))
+
+    def test_ripemd160_many(self):
+        rng = random.Random(160)
+        msgs = [rng.randbytes(rng.randrange(200)) for _ in range(100)]
+        self.assertEqual(ripemd160_many_python(msgs), [ripemd160_python(msg) for msg in msgs])
+        self.assertEqual(ripemd160_many_python([]), [])
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Wait for files in a directory to change.
+
+Uses inotify where available (Linux), so that waiters wake up as soon as a file is written, and falls
+back to polling the directory listing elsewhere.
+"""
+
+import ctypes
+import os
+import pathlib
+import select
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# From sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+# Interval at which the directory is checked for changes when inotify is not available (in seconds)
+POLL_INTERVAL = 0.05
+
+
+def load_inotify():
+    """Return libc if it has inotify, else None."""
+    if sys.platform != "linux":
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return None
+    return libc if hasattr(libc, "inotify_init1") else None
+
+
+LIBC_INOTIFY = load_inotify()
+
+
+class DirectoryWatcher:
+    """Wait for files in a directory (not in its subdirectories) to be created or modified."""
+
+    def __init__(self, path, *, use_inotify=True):
+        self.path = path
+        self.fd = None
+        if use_inotify and LIBC_INOTIFY is not None:
+            fd = LIBC_INOTIFY.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                if LIBC_INOTIFY.inotify_add_watch(fd, os.fsencode(path), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) >= 0:
+                    self.fd = fd
+                else:
+                    os.close(fd)
+        if self.fd is None:
+            self.snapshot = self._snapshot()
+
+    def _snapshot(self):
+        snapshot = {}
+        with os.scandir(self.path) as it:
+            for entry in it:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self, timeout):
+        """Wait until a file has been created or modified since the last call, or for at most timeout seconds.
+
+        Returns whether there was a change.
+        """
+        return bool(wait_any([self], timeout))
+
+    def _drain(self):
+        """Consume the pending inotify events, they are only used as a wakeup."""
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _poll(self):
+        """Return whether the directory changed since the last call, for watchers without inotify."""
+        snapshot = self._snapshot()
+        changed = snapshot != self.snapshot
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def wait_any(watchers, timeout):
+    """Wait until a file in the directory of any of the watchers has been created or modified, or for at most timeout seconds.
+
+    Returns the watchers which saw changes.
+    """
+    time_end = time.monotonic() + timeout
+    inotify_watchers = {watcher.fd: watcher for watcher in watchers if watcher.fd is not None}
+    polled_watchers = [watcher for watcher in watchers if watcher.fd is None]
+    while True:
+        remaining = max(time_end - time.monotonic(), 0)
+        if polled_watchers:
+            remaining = min(remaining, POLL_INTERVAL)
+        if inotify_watchers:
+            readable = select.select(list(inotify_watchers), [], [], remaining)[0]
+        else:
+            readable = []
+            time.sleep(remaining)
+        changed = [inotify_watchers[fd] for fd in readable]
+        for watcher in changed:
+            watcher._drain()
+        changed += [watcher for watcher in polled_watchers if watcher._poll()]
+        if changed or time.monotonic() >= time_end:
+            return changed
+
+
+class TestFrameworkFswatch(unittest.TestCase):
+    def test_directory_watcher(self):
+        tmpdir = pathlib.Path(tempfile.mkdtemp(prefix="fswatch_test"))
+        self.addCleanup(shutil.rmtree, tmpdir)
+        (tmpdir / "debug.log").write_text("start\n")
+        for use_inotify in [True, False]:
+            with DirectoryWatcher(tmpdir, use_inotify=use_inotify) as watcher:
+                self.assertFalse(watcher.wait(0.1))
+                # A write from another thread wakes up the waiter, well before the timeout.
+                start = time.monotonic()
+                writer = threading.Timer(0.05, lambda: (tmpdir / "debug.log").write_text("start\ndone\n"))
+                writer.start()
+                self.assertTrue(watcher.wait(10))
+                self.assertLess(time.monotonic() - start, 5)
+                writer.join()
+                (tmpdir / ".cookie").write_text("cookie")
+                self.assertTrue(watcher.wait(10))
+
+    def test_wait_any(self):
+        tmpdirs = [pathlib.Path(tempfile.mkdtemp(prefix="fswatch_test")) for _ in range(3)]
+        for tmpdir in tmpdirs:
+            self.addCleanup(shutil.rmtree, tmpdir)
+        watchers = [DirectoryWatcher(tmpdir, use_inotify=i != 1) for i, tmpdir in enumerate(tmpdirs)]
+        for watcher in watchers:
+            self.addCleanup(watcher.close)
+        self.assertEqual(wait_any(watchers, 0.1), [])
+        for i in [0, 1]:
+            (tmpdirs[i] / "debug.log").write_text("done\n")
+            self.assertEqual(wait_any(watchers, 10), [watchers[i]])
@@ -34,6 +34,11 @@ DEFAULT_MIN_RELAY_TX_FEE = 100
 # Default for -incrementalrelayfee in sat/kvB
 DEFAULT_INCREMENTAL_RELAY_FEE = 100
 
+# Tag of the MiniWallet funding the transactions of fill_mempool()
+FILL_MEMPOOL_WALLET_TAG = "fill_mempool_ephemeral_wallet"
+# Number of transactions (and so UTXOs) used by fill_mempool(): 1 to be evicted and 75 with increasing fee rates
+FILL_MEMPOOL_NUM_UTXOS = 76
+
 TRUC_MAX_VSIZE = 10000
 TRUC_CHILD_MAX_VSIZE = 1000
 
@@ -66,15 +71,18 @@ def fill_mempool(test_framework, node, *, tx_sync_fun=None):
     minrelayfee = node.getnetworkinfo()['relayfee']
 
     tx_batch_size = 1
-    num_of_batches = 75
+    num_of_batches = FILL_MEMPOOL_NUM_UTXOS - 1
     # Generate UTXOs to flood the mempool
     # 1 to create a tx initially that will be evicted from the mempool later
     # 75 transactions each with a fee rate higher than the previous one
-    ephemeral_miniwallet = MiniWallet(node, tag_name="fill_mempool_ephemeral_wallet")
-    test_framework.generate(ephemeral_miniwallet, 1 + num_of_batches * tx_batch_size)
-
-    # Mine enough blocks so that the UTXOs are allowed to be spent
-    test_framework.generate(node, COINBASE_MATURITY - 1)
+    ephemeral_miniwallet = MiniWallet(node, tag_name=FILL_MEMPOOL_WALLET_TAG)
+    # Unless they have been mined already, by the fill_mempool cache profile (see cache_profiles.py)
+    premined_utxos = [utxo for utxo in ephemeral_miniwallet.get_utxos(mark_as_spent=False) if utxo['coinbase']]
+    if len(premined_utxos) < 1 + num_of_batches * tx_batch_size:
+        test_framework.generate(ephemeral_miniwallet, 1 + num_of_batches * tx_batch_size)
+
+        # Mine enough blocks so that the UTXOs are allowed to be spent
+        test_framework.generate(node, COINBASE_MATURITY - 1)
 
     # Get all UTXOs up front to ensure none of the transactions spend from each other, as that may
     # change their effective feerate and thus the order in which they are selected for eviction.
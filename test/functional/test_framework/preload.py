@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Run functional test scripts in forked children of a process which has already imported the test framework.
+
+Started by test_runner.py --preload, which saves every test script the interpreter startup and the
+imports of the framework (including the precomputation of FAST_G). Children are forked before any test
+code runs, so no state is shared between tests.
+
+Requests are read from stdin, one JSON object per line:
+
+    {"id": ..., "argv": [script, arg, ...], "stdout": path, "stderr": path}
+
+and for every test, a line {"id": ..., "pid": ...} is written to stdout when it started, and a line
+{"id": ..., "returncode": ..., "max_rss": ..., "fork_time": seconds} when it finished. The first line
+written is {"preload_time": seconds}. The process exits when stdin is closed, after the running tests
+have finished, or right away if started with abandon_on_close (used with --failfast, where test_runner
+kills the remaining tests).
+
+Only the interpreter and the imported modules are shared: every test still starts its own nodes, from a
+fresh copy of the chain cache.
+"""
+
+import atexit
+import importlib
+import json
+import os
+import platform
+import runpy
+import selectors
+import signal
+import sys
+import time
+import traceback
+
+PRELOAD_MODULES = [
+    "cache_profiles",
+    "descriptors",
+    "key",
+    "mempool_util",
+    "p2p",
+    "script_util",
+    "test_framework",
+    "wallet",
+    "wallet_util",
+]
+
+
+def write_message(message):
+    os.write(sys.stdout.fileno(), (json.dumps(message) + "\n").encode())
+
+
+def run_script(argv, stdout_path, stderr_path):
+    """Run the test script argv[0] with output redirected to the given files, in a forked child. Never returns."""
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    for target_fd, path in [(1, stdout_path), (2, stderr_path)]:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.dup2(fd, target_fd)
+        os.close(fd)
+    sys.argv = list(argv)
+    sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+    try:
+        runpy.run_path(argv[0], run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    try:
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(code)
+
+
+def import_framework():
+    for module in PRELOAD_MODULES:
+        importlib.import_module(f"test_framework.{module}")
+
+
+def main(abandon_on_close=False):
+    start = time.perf_counter()
+    import_framework()
+    write_message({"preload_time": time.perf_counter() - start})
+
+    # Wake up the selector when a child exits
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+    selector = selectors.DefaultSelector()
+    selector.register(sys.stdin.fileno(), selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+
+    children = {}
+    buffer = b""
+    stdin_open = True
+    while stdin_open or (children and not abandon_on_close):
+        for key, _ in selector.select():
+            if key.fd == wakeup_r:
+                while True:
+                    try:
+                        os.read(wakeup_r, 4096)
+                    except BlockingIOError:
+                        break
+                continue
+            data = os.read(key.fd, 65536)
+            if not data:
+                stdin_open = False
+                selector.unregister(key.fd)
+                continue
+            *lines, buffer = (buffer + data).split(b"\n")
+            for line in lines:
+                request = json.loads(line)
+                fork_start = time.perf_counter()
+                pid = os.fork()
+                if pid == 0:
+                    signal.set_wakeup_fd(-1)
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    selector.close()
+                    os.close(wakeup_r)
+                    os.close(wakeup_w)
+                    run_script(request["argv"], request["stdout"], request["stderr"])
+                children[pid] = request["id"], time.perf_counter() - fork_start
+                write_message({"id": request["id"], "pid": pid})
+        while children:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            # ru_maxrss is in bytes on macOS
+            max_rss = rusage.ru_maxrss // 1024 if platform.system() == 'Darwin' else rusage.ru_maxrss
+            request_id, fork_time = children.pop(pid)
+            write_message({"id": request_id, "returncode": os.waitstatus_to_exitcode(status), "max_rss": max_rss, "fork_time": fork_time})
+
+
+if __name__ == '__main__':
+    main()
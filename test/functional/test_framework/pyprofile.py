@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Profile the Python side of functional tests.
+
+With --pyprofile, the main thread of the test runs under cProfile and the profile is written to
+PYPROFILE_FILE in the test's tmpdir. With --pysample, the stacks of all threads (including the network
+thread) are sampled every PYSAMPLE_INTERVAL seconds and written to PYSAMPLE_FILE. Each sample is weighted
+by the CPU time its thread used since the previous sample, where the platform can tell, so that time spent
+waiting on the nodes doesn't count.
+
+Samples are attributed to the innermost function of the test harness (the test scripts and the test
+framework) on the stack, including the time spent in the standard library functions it calls, as well as
+to every function on the stack for the total time.
+
+test_runner.py merges the profiles of all tests and prints the harness functions taking the most time.
+"""
+
+from collections import Counter
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+PYPROFILE_FILE = "pyprofile.prof"
+PYSAMPLE_FILE = "pysample.json"
+PYSAMPLE_INTERVAL = 0.005
+# Number of functions listed in the reports
+REPORT_FUNCTIONS = 30
+
+HARNESS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def function_key(code):
+    """Return "file:line(function)" for a code object, with paths in the test harness relative to it."""
+    filename = code.co_filename
+    if filename.startswith(HARNESS_DIR + os.sep):
+        filename = os.path.relpath(filename, HARNESS_DIR)
+    return f"{filename}:{code.co_firstlineno}({code.co_name})"
+
+
+def is_harness_code(code):
+    return code.co_filename.startswith(HARNESS_DIR + os.sep)
+
+
+class SamplingProfiler(threading.Thread):
+    """Periodically sample the stacks of all other threads, weighted by their CPU time."""
+
+    def __init__(self, interval=PYSAMPLE_INTERVAL):
+        super().__init__(name="SamplingProfiler", daemon=True)
+        self.interval = interval
+        self.samples = 0
+        # Seconds attributed to the innermost harness function on the stack
+        self.own = Counter()
+        # Seconds attributed to every function on the stack
+        self.total = Counter()
+        self._stop_event = threading.Event()
+        self._cpu_times = {}
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def _weight(self, thread_id):
+        """Return the CPU time the thread used since the last sample, or the interval if unknown."""
+        if not hasattr(time, "pthread_getcpuclockid"):
+            return self.interval
+        try:
+            cpu_time = time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+        except OSError:
+            # The thread has exited
+            return 0
+        weight = cpu_time - self._cpu_times.get(thread_id, cpu_time)
+        self._cpu_times[thread_id] = cpu_time
+        return weight
+
+    def sample(self):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self.ident:
+                continue
+            weight = self._weight(thread_id)
+            if weight <= 0:
+                continue
+            self.samples += 1
+            own_key = None
+            seen = set()
+            leaf_key = function_key(frame.f_code)
+            while frame is not None:
+                key = function_key(frame.f_code)
+                if key not in seen:
+                    seen.add(key)
+                    self.total[key] += weight
+                if own_key is None and is_harness_code(frame.f_code):
+                    own_key = key
+                frame = frame.f_back
+            self.own[own_key or leaf_key] += weight
+
+    def to_json(self):
+        return {"samples": self.samples, "own": dict(self.own), "total": dict(self.total)}
+
+
+class PythonProfiler:
+    """Run cProfile on the calling thread and/or the SamplingProfiler from start() until write()."""
+
+    def __init__(self, *, pyprofile, pysample):
+        self.cprofile = cProfile.Profile() if pyprofile else None
+        self.sampler = SamplingProfiler() if pysample else None
+
+    def start(self):
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def write(self, dirname):
+        """Stop profiling and write the profiles into dirname."""
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(os.path.join(dirname, PYPROFILE_FILE))
+        if self.sampler is not None:
+            self.sampler.stop()
+            with open(os.path.join(dirname, PYSAMPLE_FILE), "w", encoding="utf8") as f:
+                json.dump(self.sampler.to_json(), f)
+
+
+def merge_pyprofiles(filenames, merged_filename):
+    """Merge the cProfile profiles, write them to merged_filename and return a report of the harness functions."""
+    stats = pstats.Stats(*filenames, stream=io.StringIO())
+    stats.dump_stats(merged_filename)
+    stats.stream = io.StringIO()
+    stats.sort_stats(pstats.SortKey.TIME).print_stats("^" + re.escape(HARNESS_DIR), REPORT_FUNCTIONS)
+    return stats.stream.getvalue()
+
+
+def merge_pysamples(filenames, merged_filename):
+    """Merge the sampling profiles, write them to merged_filename and return a report of the harness functions."""
+    merged = {"samples": 0, "own": Counter(), "total": Counter()}
+    for filename in filenames:
+        with open(filename, encoding="utf8") as f:
+            profile = json.load(f)
+        merged["samples"] += profile["samples"]
+        merged["own"].update(profile["own"])
+        merged["total"].update(profile["total"])
+    with open(merged_filename, "w", encoding="utf8") as f:
+        json.dump(merged, f)
+    own_time = sum(merged["own"].values())
+    lines = [f"{merged['samples']} samples, {own_time:.1f} s of CPU time",
+             "{:>9} {:>6} {:>9}  {}".format("own (s)", "%", "total (s)", "function")]
+    for key, seconds in merged["own"].most_common(REPORT_FUNCTIONS):
+        lines.append("{:>9.2f} {:>6.1f} {:>9.2f}  {}".format(seconds, 100 * seconds / own_time, merged["total"][key], key))
+    return "\n".join(lines)
+
+
+class TestFrameworkPyprofile(unittest.TestCase):
+    def test_sampling_profiler(self):
+        sampler = SamplingProfiler(interval=0.001)
+        sampler.start()
+
+        def busy_loop():
+            end = time.monotonic() + 0.2
+            while time.monotonic() < end:
+                pass
+        busy_loop()
+        sampler.stop()
+        self.assertGreater(sampler.samples, 0)
+        key = function_key(busy_loop.__code__)
+        self.assertEqual(key.split(":")[0], os.path.join("test_framework", "pyprofile.py"))
+        self.assertEqual(sampler.own.most_common(1)[0][0], key)
+        self.assertGreaterEqual(sampler.total[function_key(self.test_sampling_profiler.__code__)], sampler.own[key])
+
+    def test_merge(self):
+        tmpdir = tempfile.mkdtemp(prefix="pyprofile_test")
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filenames = []
+        for i in range(2):
+            filenames.append(os.path.join(tmpdir, f"{i}.json"))
+            with open(filenames[-1], "w", encoding="utf8") as f:
+                json.dump({"samples": 10, "own": {"a": 0.5, f"b{i}": 0.1}, "total": {"a": 0.6, f"b{i}": 0.1}}, f)
+        report = merge_pysamples(filenames, os.path.join(tmpdir, PYSAMPLE_FILE)).splitlines()
+        self.assertEqual(report[0], "20 samples, 1.2 s of CPU time")
+        self.assertEqual(report[2].split(), ["1.00", "83.3", "1.20", "a"])
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Record how often each RPC is called, how long the calls take and where they are made from.
+
+Enabled with --rpcprofiledir (test_runner.py --rpc-profile). Every test writes its profile into that
+directory when it shuts down, and test_runner.py merges the profiles of all tests into one report.
+
+Latencies are kept in a histogram with HISTOGRAM_BUCKETS_PER_OCTAVE logarithmic buckets per doubling,
+so that profiles can be merged without keeping every sample. Percentiles are therefore approximate,
+to within about 10%.
+"""
+
+from collections import Counter
+import json
+import math
+import os
+import sys
+import unittest
+
+PROFILE_FILE_PREFIX = "rpcprofile."
+HISTOGRAM_BUCKETS_PER_OCTAVE = 4
+# Number of call sites to list per RPC method in the report
+REPORT_CALL_SITES = 3
+
+FRAMEWORK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def latency_bucket(seconds):
+    """Return the histogram bucket of a latency, bucket b holding latencies in [2^(b/N), 2^((b+1)/N)) microseconds."""
+    return math.floor(math.log2(max(seconds * 1e6, 1)) * HISTOGRAM_BUCKETS_PER_OCTAVE)
+
+
+def bucket_latency(bucket):
+    """Return the geometric middle of a histogram bucket, in seconds."""
+    return 2 ** ((bucket + 0.5) / HISTOGRAM_BUCKETS_PER_OCTAVE) / 1e6
+
+
+def get_call_site():
+    """Return "file:line" of the innermost frame of the caller outside of the test framework."""
+    frame = sys._getframe(1)
+    while frame is not None and os.path.dirname(os.path.abspath(frame.f_code.co_filename)) == FRAMEWORK_DIR:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}"
+
+
+class MethodProfile:
+    """Statistics of the calls to one RPC method."""
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.histogram = Counter()
+        self.call_sites = Counter()
+
+    def percentile(self, p):
+        """Return the approximate latency below which p percent of the calls completed."""
+        rank = math.ceil(self.calls * p / 100)
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return bucket_latency(bucket)
+        return 0.0
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.total_time += other.total_time
+        self.request_bytes += other.request_bytes
+        self.response_bytes += other.response_bytes
+        self.histogram.update(other.histogram)
+        self.call_sites.update(other.call_sites)
+
+    def to_json(self):
+        return {
+            "calls": self.calls,
+            "total_time": self.total_time,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "request_bytes": self.request_bytes,
+            "response_bytes": self.response_bytes,
+            "histogram": {str(bucket): count for bucket, count in sorted(self.histogram.items())},
+            "call_sites": dict(self.call_sites.most_common()),
+        }
+
+    @classmethod
+    def from_json(cls, obj):
+        profile = cls()
+        profile.calls = obj["calls"]
+        profile.total_time = obj["total_time"]
+        profile.request_bytes = obj["request_bytes"]
+        profile.response_bytes = obj["response_bytes"]
+        profile.histogram = Counter({int(bucket): count for bucket, count in obj["histogram"].items()})
+        profile.call_sites = Counter(obj["call_sites"])
+        return profile
+
+
+class RPCProfile:
+    """Statistics of the RPC calls made by a test, or by all tests of a test_runner.py run."""
+
+    def __init__(self):
+        self.methods = {}
+
+    def record(self, method, *, elapsed, request_bytes, response_bytes, call_site):
+        profile = self.methods.get(method)
+        if profile is None:
+            profile = self.methods[method] = MethodProfile()
+        profile.calls += 1
+        profile.total_time += elapsed
+        profile.request_bytes += request_bytes
+        profile.response_bytes += response_bytes
+        profile.histogram[latency_bucket(elapsed)] += 1
+        profile.call_sites[call_site] += 1
+
+    def merge(self, other):
+        for method, other_profile in other.methods.items():
+            self.methods.setdefault(method, MethodProfile()).merge(other_profile)
+
+    def to_json(self):
+        return {method: profile.to_json() for method, profile in sorted(self.methods.items())}
+
+    @classmethod
+    def from_json(cls, obj):
+        rpc_profile = cls()
+        rpc_profile.methods = {method: MethodProfile.from_json(profile) for method, profile in obj.items()}
+        return rpc_profile
+
+    def write(self, dirname):
+        """Write the profile into dirname, in a file unique to the test process."""
+        with open(os.path.join(dirname, f"{PROFILE_FILE_PREFIX}pid{os.getpid()}.json"), "w", encoding="utf8") as f:
+            json.dump(self.to_json(), f)
+
+    @classmethod
+    def read_all(cls, dirname):
+        """Return the merged profiles of all tests which wrote into dirname."""
+        rpc_profile = cls()
+        for filename in sorted(os.listdir(dirname)):
+            if filename.startswith(PROFILE_FILE_PREFIX):
+                with open(os.path.join(dirname, filename), encoding="utf8") as f:
+                    rpc_profile.merge(cls.from_json(json.load(f)))
+        return rpc_profile
+
+    def report(self):
+        """Return a table of the methods, sorted by the total time spent in them, and their main call sites."""
+        total_time = sum(profile.total_time for profile in self.methods.values())
+        lines = ["{:<32} {:>8} {:>10} {:>6} {:>9} {:>9} {:>10} {:>10}".format(
+            "method", "calls", "total (s)", "%", "p50 (ms)", "p99 (ms)", "sent (kB)", "recv (kB)")]
+        methods = sorted(self.methods.items(), key=lambda item: item[1].total_time, reverse=True)
+        for method, profile in methods:
+            lines.append("{:<32} {:>8} {:>10.2f} {:>6.1f} {:>9.2f} {:>9.2f} {:>10.1f} {:>10.1f}".format(
+                method, profile.calls, profile.total_time, 100 * profile.total_time / total_time if total_time else 0,
+                profile.percentile(50) * 1000, profile.percentile(99) * 1000,
+                profile.request_bytes / 1000, profile.response_bytes / 1000))
+        lines.append("")
+        lines.append("Main call sites:")
+        for method, profile in methods:
+            sites = ", ".join(f"{site} ({count})" for site, count in profile.call_sites.most_common(REPORT_CALL_SITES))
+            lines.append(f"  {method}: {sites}")
+        return "\n".join(lines)
+
+
+class TestFrameworkRPCProfile(unittest.TestCase):
+    def test_percentiles(self):
+        rpc_profile = RPCProfile()
+        for i in range(1, 101):
+            rpc_profile.record("getblockcount", elapsed=i / 1000, request_bytes=10, response_bytes=5, call_site="example_test.py:1")
+        profile = rpc_profile.methods["getblockcount"]
+        self.assertEqual(profile.calls, 100)
+        self.assertAlmostEqual(profile.total_time, 5.05)
+        self.assertEqual(profile.request_bytes, 1000)
+        # The buckets are 2^(1/4) = 19% wide, so the estimates are within 10% of the true value.
+        self.assertAlmostEqual(profile.percentile(50), 0.050, delta=0.005)
+        self.assertAlmostEqual(profile.percentile(99), 0.099, delta=0.010)
+        self.assertEqual(profile.call_sites, Counter({"example_test.py:1": 100}))
+
+    def test_call_site(self):
+        # Frames in the test framework are skipped
+        self.assertEqual(eval(compile("get_call_site()", "/tmp/example_test.py", "eval")), "example_test.py:1")
+
+    def test_merge(self):
+        profiles = [RPCProfile() for _ in range(2)]
+        for i, rpc_profile in enumerate(profiles):
+            rpc_profile.record("getblock", elapsed=0.001 * (i + 1), request_bytes=100, response_bytes=1000, call_site=f"test_{i}.py:1")
+            rpc_profile.record(f"only_{i}", elapsed=0.5, request_bytes=1, response_bytes=1, call_site="x.py:1")
+        merged = RPCProfile.from_json(json.loads(json.dumps(profiles[0].to_json())))
+        merged.merge(RPCProfile.from_json(json.loads(json.dumps(profiles[1].to_json()))))
+        self.assertEqual(sorted(merged.methods), ["getblock", "only_0", "only_1"])
+        getblock = merged.methods["getblock"]
+        self.assertEqual(getblock.calls, 2)
+        self.assertEqual(getblock.response_bytes, 2000)
+        self.assertEqual(getblock.call_sites, Counter({"test_0.py:1": 1, "test_1.py:1": 1}))
+        self.assertEqual(merged.report().splitlines()[1].split()[0], "only_0")
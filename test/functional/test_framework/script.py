@@ -8,6 +8,7 @@ This file is modified from python-bitcoinlib.
 """
 
 from collections import namedtuple
+from functools import lru_cache
 import unittest
 
 from .key import TaggedHash, tweak_add_pubkey, compute_xonly_pubkey
@@ -20,7 +21,7 @@ from .messages import (
     sha256,
 )
 
-from .crypto.ripemd160 import ripemd160
+from .crypto.ripemd160 import ripemd160, ripemd160_many
 
 MAX_SCRIPT_ELEMENT_SIZE = 520
 MAX_SCRIPT_SIZE = 10000
@@ -30,9 +31,21 @@ ANNEX_TAG = 0x50
 
 LEAF_VERSION_TAPSCRIPT = 0xc0
 
-def hash160(s):
+# Number of hash160 results to memoize. Tests derive addresses and scripts from the same (deterministic)
+# keys over and over, e.g. TestNode.PRIV_KEYS and the MiniWallet keys.
+HASH160_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=HASH160_CACHE_SIZE)
+def _hash160(s):
     return ripemd160(sha256(s))
 
+def hash160(s):
+    return _hash160(bytes(s))
+
+def hash160_many(datas):
+    """Compute hash160 of every byte array in datas."""
+    return ripemd160_many([sha256(s) for s in datas])
+
 def bn2vch(v):
     """Convert number to bitcoin-specific little endian format."""
     # We need v.bit_length() bits, plus a sign bit for every nonzero number.
@@ -773,6 +786,13 @@ class TestFrameworkScript(unittest.TestCase):
         self.assertEqual(bn2vch(123456789), bytes([0x15, 0xCD, 0x5B, 0x07]))
         self.assertEqual(bn2vch(-54321), bytes([0x31, 0xD4, 0x80]))
 
+    def test_hash160(self):
+        pubkey = bytes.fromhex("0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798")
+        self.assertEqual(hash160(pubkey).hex(), "751e76e8199196d454941c45d1b3a323f1433bd6")
+        self.assertEqual(hash160(bytearray(pubkey)), hash160(pubkey))
+        datas = [pubkey, b"", CScript([OP_1]), bytes(100)]
+        self.assertEqual(hash160_many(datas), [ripemd160(sha256(data)) for data in datas])
+
     def test_cscriptnum_encoding(self):
         # round-trip negative and multi-byte CScriptNums
         values = [0, 1, -1, -2, 127, 128, -255, 256, (1 << 15) - 1, -(1 << 16), (1 << 24) - 1, (1 << 31), 1 - (1 << 32), 1 << 40, 1500, -1500]
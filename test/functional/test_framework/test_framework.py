@@ -8,6 +8,7 @@ import configparser
 from enum import Enum
 import argparse
 from datetime import datetime, timezone
+import json
 import logging
 import os
 import platform
@@ -15,6 +16,7 @@ import pdb
 import random
 import re
 import shutil
+import statistics
 import subprocess
 import sys
 import tempfile
@@ -22,13 +24,34 @@ import time
 
 from .address import create_deterministic_address_bcrt1_p2tr_op_true
 from .authproxy import JSONRPCException
+from .cache_profiles import CACHE_PROFILES
+from .chain_cache import (
+    ChainCache,
+    chain_cache_key,
+    clone_tree,
+)
 from . import coverage
+from .fswatch import (
+    DirectoryWatcher,
+    wait_any,
+)
 from .p2p import NetworkThread
-from .test_node import TestNode
+from .pyprofile import (
+    PYPROFILE_FILE,
+    PYSAMPLE_FILE,
+    PythonProfiler,
+)
+from .rpc_profile import RPCProfile
+from .test_node import (
+    BITCOIND_PROC_WAIT_TIMEOUT,
+    TestNode,
+    wait_for_rpc_connections,
+)
 from .util import (
     Binaries,
     MAX_NODES,
     PortSeed,
+    WAIT_STATS,
     assert_equal,
     check_json_precision,
     export_env_build_path,
@@ -52,6 +75,13 @@ TEST_EXIT_FAILED = 1
 TEST_EXIT_SKIPPED = 77
 
 TMPDIR_PREFIX = "bitcoin_func_test_"
+# File in a chain cache entry recording which cache profile it holds and how long it took to build
+CACHE_PROFILE_INFO_FILE = "profile.json"
+# Minimum time between two comparisons of the mempools in sync_mempools() (in seconds)
+SYNC_MEMPOOLS_MIN_INTERVAL = 0.05
+# Messages in debug.log which sync_mempools() compares the mempools again on: added to the mempool (by
+# -debug=validation and -debug=mempool respectively) and removed from it (-debug=validation)
+MEMPOOL_UPDATE_LOG_MSGS = (b"TransactionAddedToMempool", b"AcceptToMemoryPool", b"TransactionRemovedFromMempool")
 
 
 class SkipTest(Exception):
@@ -101,6 +131,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         """Sets test framework defaults. Do not override this method. Instead, override the set_test_params() method"""
         self.chain: str = 'regtest'
         self.setup_clean_chain: bool = False
+        # The pre-mined chain to start from, unless setup_clean_chain is set (see cache_profiles.py)
+        self.cache_profile: str = "default"
         self.noban_tx_relay: bool = False
         self.nodes: list[TestNode] = []
         self.extra_args = None
@@ -110,6 +142,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         self.supports_cli = True
         self.bind_to_localhost_only = True
         self.parse_args(test_file)
+        # The RPC calls made by the test, recorded if --rpcprofiledir is set
+        self.rpc_profile = RPCProfile() if self.options.rpcprofiledir else None
+        # Profiler of the Python side of the test, if --pyprofile or --pysample is set
+        self.python_profiler = None
         self.default_wallet_name = "default_wallet"
         self.wallet_data_filename = "wallet.dat"
         # Optional list of wallet names that can be set in set_test_params to
@@ -134,6 +170,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
 
         assert hasattr(self, "num_nodes"), "Test must set self.num_nodes in set_test_params()"
 
+        if self.options.pyprofile or self.options.pysample:
+            self.python_profiler = PythonProfiler(pyprofile=self.options.pyprofile, pysample=self.options.pysample)
+            self.python_profiler.start()
+
         try:
             self.setup()
             if self.options.test_methods:
@@ -180,6 +220,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                             help="Force test of previous releases (default: %(default)s)")
         parser.add_argument("--coveragedir", dest="coveragedir",
                             help="Write tested RPC commands into this directory")
+        parser.add_argument("--rpcprofiledir", dest="rpcprofiledir",
+                            help="Write the number, latency, size and call sites of the RPC calls into this directory")
         parser.add_argument("--configfile", dest="configfile",
                             default=os.path.abspath(os.path.dirname(test_file) + "/../config.ini"),
                             help="Location of the test framework config file (default: %(default)s)")
@@ -189,6 +231,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                             help="use bitcoin-cli instead of RPC for all commands")
         parser.add_argument("--perf", dest="perf", default=False, action="store_true",
                             help="profile running nodes with perf for the duration of the test")
+        parser.add_argument("--pyprofile", dest="pyprofile", default=False, action="store_true",
+                            help="profile the main thread of the test with cProfile, writing pyprofile.prof into the tmpdir")
+        parser.add_argument("--pysample", dest="pysample", default=False, action="store_true",
+                            help="profile all threads of the test with a sampling profiler, writing pysample.json into the tmpdir")
         parser.add_argument("--valgrind", dest="valgrind", default=False, action="store_true",
                             help="run nodes under the valgrind memory error detector: expect at least a ~10x slowdown. valgrind 3.14 or later required. Does not apply to previous release binaries.")
         parser.add_argument("--randomseed", type=int,
@@ -276,6 +322,12 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             print("Testcase failed. Attaching python debugger. Enter ? for help")
             pdb.set_trace()
 
+        startup_latencies = [latency for node in self.nodes for latency in node.startup_latencies]
+        if startup_latencies:
+            self.log.debug("Node startup latency: median {:.0f} ms over {} starts".format(statistics.median(startup_latencies) * 1000, len(startup_latencies)))
+        for line in WAIT_STATS.summary():
+            self.log.debug("Wait statistics: " + line)
+
         self.log.debug('Closing down network thread')
         self.network_thread.close()
         if self.success == TestStatus.FAILED:
@@ -284,6 +336,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             self.log.info("Stopping nodes")
             if self.nodes:
                 self.stop_nodes()
+        if self.rpc_profile is not None:
+            self.rpc_profile.write(self.options.rpcprofiledir)
+        if self.python_profiler is not None:
+            self.python_profiler.write(self.options.tmpdir)
 
         should_clean_up = (
             not self.options.nocleanup and
@@ -327,7 +383,15 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         for h in list(rpc_logger.handlers):
             h.flush()
             rpc_logger.removeHandler(h)
-        if cleanup_tree_on_exit:
+        if cleanup_tree_on_exit and self.python_profiler is not None:
+            # Keep the Python profiles, for test_runner.py to merge them
+            for entry in os.scandir(self.options.tmpdir):
+                if entry.name not in (PYPROFILE_FILE, PYSAMPLE_FILE):
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
+        elif cleanup_tree_on_exit:
             shutil.rmtree(self.options.tmpdir)
 
         self.nodes.clear()
@@ -383,7 +447,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             self.import_deterministic_coinbase_privkeys()
         if not self.setup_clean_chain:
             for n in self.nodes:
-                assert_equal(n.getblockchaininfo()["blocks"], 199)
+                assert_equal(n.getblockchaininfo()["blocks"], self.cache_height)
             # To ensure that all nodes are out of IBD, the most recent block
             # must have a timestamp not too old (see IsInitialBlockDownload()).
             self.log.debug('Generate a block with current time')
@@ -392,7 +456,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
             for n in self.nodes:
                 n.submitblock(block)
                 chain_info = n.getblockchaininfo()
-                assert_equal(chain_info["blocks"], 200)
+                assert_equal(chain_info["blocks"], self.cache_height + 1)
                 assert_equal(chain_info["initialblockdownload"], False)
 
     def import_deterministic_coinbase_privkeys(self):
@@ -485,6 +549,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 binaries=self.get_binaries(bin_dirs[i]),
                 version=versions[i],
                 coverage_dir=self.options.coveragedir,
+                rpc_profile=self.rpc_profile,
                 cwd=self.options.tmpdir,
                 extra_conf=extra_confs[i],
                 extra_args=args,
@@ -521,13 +586,16 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         if extra_args is None:
             extra_args = [None] * self.num_nodes
         assert_equal(len(extra_args), self.num_nodes)
-        for i, node in enumerate(self.nodes):
-            node.start(extra_args[i], *args, **kwargs)
-        for node in self.nodes:
-            node.wait_for_rpc_connection()
+        self._start_nodes(self.nodes, extra_args, *args, **kwargs)
+
+    def _start_nodes(self, nodes, extra_args, *args, **kwargs):
+        """Start the bitcoinds of nodes and wait for all of them to be ready concurrently"""
+        for node, node_extra_args in zip(nodes, extra_args):
+            node.start(node_extra_args, *args, **kwargs)
+        wait_for_rpc_connections(nodes)
 
         if self.options.coveragedir is not None:
-            for node in self.nodes:
+            for node in nodes:
                 coverage.write_all_rpc_commands(self.options.coveragedir, node._rpc)
 
     def stop_node(self, i, expected_stderr='', wait=0):
@@ -536,13 +604,16 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
 
     def stop_nodes(self, wait=0):
         """Stop multiple bitcoind test nodes"""
-        for node in self.nodes:
+        self._stop_nodes(self.nodes, wait=wait)
+
+    def _stop_nodes(self, nodes, *, wait=0):
+        for node in nodes:
             # Issue RPC to stop nodes
             node.stop_node(wait=wait, wait_until_stopped=False)
 
-        for node in self.nodes:
-            # Wait for nodes to stop
-            node.wait_until_stopped()
+        # Wait for all nodes to stop at once, checking them in order to keep the log stable
+        wait_until_helper_internal(lambda: all([node.is_node_stopped() for node in nodes]),
+                                   timeout=BITCOIND_PROC_WAIT_TIMEOUT, timeout_factor=self.options.timeout_factor)
 
     def restart_node(self, i, extra_args=None, clear_addrman=False, *, expected_stderr=''):
         """Stop and start a test node"""
@@ -555,6 +626,16 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         else:
             self.start_node(i, extra_args)
 
+    def restart_nodes(self, indices, extra_args=None):
+        """Stop and start multiple test nodes, concurrently
+
+        Unlike calling restart_node() for each of them, all nodes are stopped before any of them is started."""
+        if extra_args is None:
+            extra_args = [None] * len(indices)
+        nodes = [self.nodes[i] for i in indices]
+        self._stop_nodes(nodes)
+        self._start_nodes(nodes, extra_args)
+
     def wait_for_node_exit(self, i, timeout):
         self.nodes[i].process.wait(timeout)
 
@@ -698,17 +779,34 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         sync_blocks needs to be called with an rpc_connections set that has least
         one node already synced to the latest, stable tip, otherwise there's a
         chance it might return before all nodes are stably synced.
+
+        The nodes which aren't at the highest tip are long-polled with waitforblock,
+        for at most wait seconds per round.
         """
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
-        stop_time = time.time() + timeout
-        while time.time() <= stop_time:
+        time_start = time.time()
+        stop_time = time_start + timeout
+        polls = 0
+        while True:
+            polls += 1
             best_hash = [x.getbestblockhash() for x in rpc_connections]
             if best_hash.count(best_hash[0]) == len(rpc_connections):
+                WAIT_STATS.record("sync_blocks", polls=polls, duration=time.time() - time_start)
                 return
+            if time.time() > stop_time:
+                break
             # Check that each peer has at least one connection
             assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            heights = [x.getblockheader(h)["height"] for x, h in zip(rpc_connections, best_hash)]
+            target = best_hash[heights.index(max(heights))]
+            round_end = min(time.time() + wait, stop_time)
+            for x, h in zip(rpc_connections, best_hash):
+                # A timeout of 0 would wait forever
+                timeout_ms = int((round_end - time.time()) * 1000)
+                if h != target and timeout_ms > 0:
+                    x.waitforblock(target, timeout_ms)
+        WAIT_STATS.record("sync_blocks", polls=polls, duration=time.time() - time_start)
         raise AssertionError("Block sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(b) for b in best_hash),
@@ -718,20 +816,47 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         """
         Wait until everybody has the same transactions in their memory
         pools
+
+        The mempools are compared again whenever one of the nodes logged adding
+        a transaction to or removing one from its mempool (see
+        MEMPOOL_UPDATE_LOG_MSGS), or after wait seconds.
         """
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
-        stop_time = time.time() + timeout
-        while time.time() <= stop_time:
-            pool = [set(r.getrawmempool()) for r in rpc_connections]
-            if pool.count(pool[0]) == len(rpc_connections):
-                if flush_scheduler:
-                    for r in rpc_connections:
-                        r.syncwithvalidationinterfacequeue()
-                return
-            # Check that each peer has at least one connection
-            assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+        time_start = time.time()
+        stop_time = time_start + timeout
+        polls = 0
+        # Each node logs the RPCs made here, so only wake up on the new log lines about its mempool
+        watchers = {DirectoryWatcher(r.chain_path): r for r in rpc_connections}
+        log_offsets = {r: r.read_debug_log_since(0)[1] for r in rpc_connections}
+        try:
+            while True:
+                polls += 1
+                pool = [set(r.getrawmempool()) for r in rpc_connections]
+                if pool.count(pool[0]) == len(rpc_connections):
+                    if flush_scheduler:
+                        for r in rpc_connections:
+                            r.syncwithvalidationinterfacequeue()
+                    WAIT_STATS.record("sync_mempools", polls=polls, duration=time.time() - time_start)
+                    return
+                if time.time() > stop_time:
+                    break
+                # Check that each peer has at least one connection
+                assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
+                next_poll = time.time() + SYNC_MEMPOOLS_MIN_INTERVAL
+                round_end = min(time.time() + wait, stop_time)
+                updated = False
+                while not updated and time.time() < round_end:
+                    for watcher in wait_any(list(watchers), round_end - time.time()):
+                        node = watchers[watcher]
+                        log, log_offsets[node] = node.read_debug_log_since(log_offsets[node])
+                        updated |= any(msg in log for msg in MEMPOOL_UPDATE_LOG_MSGS)
+                # Limit the rate of RPCs while the nodes are busy relaying
+                time.sleep(max(0, min(next_poll, round_end) - time.time()))
+        finally:
+            for watcher in watchers:
+                watcher.close()
+        WAIT_STATS.record("sync_mempools", polls=polls, duration=time.time() - time_start)
         raise AssertionError("Mempool sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(m) for m in pool),
@@ -784,75 +909,103 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
     def _initialize_chain(self):
         """Initialize a pre-mined blockchain for use by the test.
 
-        Create a cache of a 199-block-long chain
-        Afterward, create num_nodes copies from the cache."""
+        Create a cache of the chain of self.cache_profile, unless the chain cache already has one for this
+        bitcoind binary. Afterward, create num_nodes clones of the cache (see chain_cache.py)."""
 
-        CACHE_NODE_ID = 0  # Use node 0 to create the cache for all other nodes
-        cache_node_dir = get_datadir_path(self.options.cachedir, CACHE_NODE_ID)
         assert self.num_nodes <= MAX_NODES
-
-        if not os.path.isdir(cache_node_dir):
-            self.log.debug("Creating cache directory {}".format(cache_node_dir))
-
-            initialize_datadir(self.options.cachedir, CACHE_NODE_ID, self.chain, self.disable_autoconnect)
-            self.nodes.append(
-                TestNode(
-                    CACHE_NODE_ID,
-                    cache_node_dir,
-                    chain=self.chain,
-                    extra_conf=["bind=127.0.0.1"],
-                    extra_args=[],
-                    rpchost=None,
-                    timewait=self.rpc_timeout,
-                    timeout_factor=self.options.timeout_factor,
-                    binaries=self.get_binaries(),
-                    coverage_dir=None,
-                    cwd=self.options.tmpdir,
-                    uses_wallet=self.uses_wallet,
-                ))
-            self.start_node(CACHE_NODE_ID)
-            cache_node = self.nodes[CACHE_NODE_ID]
-
-            # Wait for RPC connections to be ready
-            cache_node.wait_for_rpc_connection()
-
-            # Set a time in the past, so that blocks don't end up in the future
-            cache_node.setmocktime(cache_node.getblockheader(cache_node.getbestblockhash())['time'])
-
-            # Create a 199-block-long chain; each of the 3 first nodes
-            # gets 25 mature blocks and 25 immature.
-            # The 4th address gets 25 mature and only 24 immature blocks so that the very last
-            # block in the cache does not age too much (have an old tip age).
-            # This is needed so that we are out of IBD when the test starts,
-            # see the tip age check in IsInitialBlockDownload().
-            gen_addresses = [k.address for k in TestNode.PRIV_KEYS][:3] + [create_deterministic_address_bcrt1_p2tr_op_true()[0]]
-            assert_equal(len(gen_addresses), 4)
-            for i in range(8):
-                self.generatetoaddress(
-                    cache_node,
-                    nblocks=25 if i != 7 else 24,
-                    address=gen_addresses[i % len(gen_addresses)],
-                )
-
-            assert_equal(cache_node.getblockchaininfo()["blocks"], 199)
-
-            # Shut it down, and clean up cache directories:
-            self.stop_nodes()
-            self.nodes = []
-
-            def cache_path(*paths):
-                return os.path.join(cache_node_dir, self.chain, *paths)
-
-            os.rmdir(cache_path('wallets'))  # Remove empty wallets dir
-            for entry in os.listdir(cache_path()):
-                if entry not in ['chainstate', 'blocks', 'indexes']:  # Only indexes, chainstate and blocks folders
-                    os.remove(cache_path(entry))
-
+        assert self.cache_profile in CACHE_PROFILES, f"unknown cache profile {self.cache_profile}"
+        profile = CACHE_PROFILES[self.cache_profile]
+        key = chain_cache_key(self.get_binaries().node_argv(), self.options.cachedir, chain=self.chain,
+                              profile=profile.name, profile_version=profile.version)
+        chain_cache = ChainCache(self.options.cachedir)
+        entry = chain_cache.lookup(key)
+        if entry is None:
+            self.log.debug("Creating chain cache entry {} for cache profile {}".format(key, profile.name))
+            entry = chain_cache.create(key, self._create_chain_cache)
+        profile_info = json.loads((entry / CACHE_PROFILE_INFO_FILE).read_text(encoding="utf8"))
+        # Height of the cached chain, which setup_nodes() extends by one block
+        self.cache_height = profile_info["height"]
+        if profile.build is not None:
+            self.log.info("Using cache profile {} ({}), which saves {:.1f} s of setup".format(profile.name, profile.description, profile_info["build_time"]))
+
+        cache_node_dir = get_datadir_path(entry, 0)
+        method = "reflink"
         for i in range(self.num_nodes):
-            self.log.debug("Copy cache directory {} to node {}".format(cache_node_dir, i))
+            start = time.perf_counter()
             to_dir = get_datadir_path(self.options.tmpdir, i)
-            shutil.copytree(cache_node_dir, to_dir)
+            method = clone_tree(cache_node_dir, to_dir, method)
             initialize_datadir(self.options.tmpdir, i, self.chain, self.disable_autoconnect)  # Overwrite port/rpcport in bitcoin.conf
+            self.log.debug("Cloned cache directory {} to node {} ({}) in {:.0f} ms".format(cache_node_dir, i, method, (time.perf_counter() - start) * 1000))
+
+    def _create_chain_cache(self, cachedir):
+        """Create the chain of self.cache_profile in the datadir of node 0 in cachedir."""
+        start = time.perf_counter()
+        CACHE_NODE_ID = 0  # Use node 0 to create the cache for all other nodes
+        cache_node_dir = get_datadir_path(cachedir, CACHE_NODE_ID)
+
+        initialize_datadir(cachedir, CACHE_NODE_ID, self.chain, self.disable_autoconnect)
+        self.nodes.append(
+            TestNode(
+                CACHE_NODE_ID,
+                cache_node_dir,
+                chain=self.chain,
+                extra_conf=["bind=127.0.0.1"],
+                extra_args=[],
+                rpchost=None,
+                timewait=self.rpc_timeout,
+                timeout_factor=self.options.timeout_factor,
+                binaries=self.get_binaries(),
+                coverage_dir=None,
+                cwd=self.options.tmpdir,
+                uses_wallet=self.uses_wallet,
+            ))
+        self.start_node(CACHE_NODE_ID)
+        cache_node = self.nodes[CACHE_NODE_ID]
+
+        # Wait for RPC connections to be ready
+        cache_node.wait_for_rpc_connection()
+
+        # Set a time in the past, so that blocks don't end up in the future
+        cache_node.setmocktime(cache_node.getblockheader(cache_node.getbestblockhash())['time'])
+
+        # Create a 199-block-long chain; each of the 3 first nodes
+        # gets 25 mature blocks and 25 immature.
+        # The 4th address gets 25 mature and only 24 immature blocks so that the very last
+        # block in the cache does not age too much (have an old tip age).
+        # This is needed so that we are out of IBD when the test starts,
+        # see the tip age check in IsInitialBlockDownload().
+        gen_addresses = [k.address for k in TestNode.PRIV_KEYS][:3] + [create_deterministic_address_bcrt1_p2tr_op_true()[0]]
+        assert_equal(len(gen_addresses), 4)
+        for i in range(8):
+            self.generatetoaddress(
+                cache_node,
+                nblocks=25 if i != 7 else 24,
+                address=gen_addresses[i % len(gen_addresses)],
+            )
+
+        assert_equal(cache_node.getblockchaininfo()["blocks"], 199)
+
+        profile = CACHE_PROFILES[self.cache_profile]
+        if profile.build is not None:
+            profile.build(self, cache_node)
+            # Everything must be mined, as the mempool is not cached
+            assert_equal(cache_node.getmempoolinfo()["size"], 0)
+        height = cache_node.getblockcount()
+
+        # Shut it down, and clean up cache directories:
+        self.stop_nodes()
+        self.nodes = []
+
+        def cache_path(*paths):
+            return os.path.join(cache_node_dir, self.chain, *paths)
+
+        os.rmdir(cache_path('wallets'))  # Remove empty wallets dir
+        for entry in os.listdir(cache_path()):
+            if entry not in ['chainstate', 'blocks', 'indexes']:  # Only indexes, chainstate and blocks folders
+                os.remove(cache_path(entry))
+
+        with open(os.path.join(cachedir, CACHE_PROFILE_INFO_FILE), 'w', encoding='utf8') as f:
+            json.dump({"profile": profile.name, "height": height, "build_time": time.perf_counter() - start}, f)
 
     def _initialize_chain_clean(self):
         """Initialize empty blockchain for use by the test.
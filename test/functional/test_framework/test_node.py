@@ -28,6 +28,10 @@ from .authproxy import (
     JSONRPCException,
     serialization_fallback,
 )
+from .fswatch import (
+    DirectoryWatcher,
+    wait_any,
+)
 from .messages import NODE_P2P_V2
 from .p2p import P2P_SERVICES, P2P_SUBVERSION
 from .util import (
@@ -45,6 +49,17 @@ from .util import (
 )
 
 BITCOIND_PROC_WAIT_TIMEOUT = 60
+# Logged by bitcoind once RPC warmup has finished, see AppInitMain()
+STARTUP_DONE_LOG_MSG = b"init message: Done loading"
+# Logged when the mempool has been loaded from disk, usually after STARTUP_DONE_LOG_MSG
+MEMPOOL_IMPORTED_LOG_MSG = b"Imported mempool transactions"
+# Time between checks whether the mempool has been loaded, once RPC is up (in seconds)
+MEMPOOL_LOADED_RETRY_INTERVAL = 0.05
+# Maximum time between attempts to connect to RPC during startup (in seconds). Usually the connection is
+# made as soon as STARTUP_DONE_LOG_MSG is logged, this is for nodes which don't write debug.log.
+STARTUP_RETRY_INTERVAL = 0.25
+# Interval at which to check for the chain directory to be created during startup (in seconds)
+STARTUP_POLL_INTERVAL = 0.01
 # The size of the blocks xor key
 # from InitBlocksdirXorKey::xor_key.size()
 NUM_XOR_BYTES = 8
@@ -77,6 +92,22 @@ class ErrorMatch(Enum):
     PARTIAL_REGEX = 3
 
 
+def wait_for_rpc_connections(nodes, *, wait_for_import=True):
+    """Set up the RPC connections to the bitcoind processes of nodes, waiting for all of them concurrently.
+
+    Raises the error of the first node which fails to start, the other nodes are left running."""
+    steps = {node: node._rpc_connection_steps(wait_for_import=wait_for_import) for node in nodes}
+    while steps:
+        waits = []
+        for node, node_steps in list(steps.items()):
+            try:
+                waits.append(next(node_steps))
+            except StopIteration:
+                del steps[node]
+        if waits:
+            wait_any([watcher for watcher, _ in waits if watcher is not None], min(time_end for _, time_end in waits) - time.monotonic())
+
+
 class TestNode():
     """A class for representing a bitcoind node under test.
 
@@ -91,7 +122,7 @@ class TestNode():
     To make things easier for the test writer, any unrecognised messages will
     be dispatched to the RPC connection."""
 
-    def __init__(self, i, datadir_path, *, chain, rpchost, timewait, timeout_factor, binaries, coverage_dir, cwd, extra_conf=None, extra_args=None, use_cli=False, start_perf=False, use_valgrind=False, version=None, v2transport=False, uses_wallet=False, ipcbind=False):
+    def __init__(self, i, datadir_path, *, chain, rpchost, timewait, timeout_factor, binaries, coverage_dir, cwd, extra_conf=None, extra_args=None, use_cli=False, start_perf=False, use_valgrind=False, version=None, v2transport=False, uses_wallet=False, ipcbind=False, rpc_profile=None):
         """
         Kwargs:
             start_perf (bool): If True, begin profiling the node with `perf` as soon as
@@ -110,6 +141,7 @@ class TestNode():
         self.timeout_factor = timeout_factor
         self.binaries = binaries
         self.coverage_dir = coverage_dir
+        self.rpc_profile = rpc_profile
         self.cwd = cwd
         self.has_explicit_bind = False
         if extra_conf is not None:
@@ -197,6 +229,8 @@ class TestNode():
         self.p2ps = []
 
         self.mocktime = None
+        # Time from start() until the RPC connection was ready, for every start (in seconds)
+        self.startup_latencies = []
 
     AddressKeyPair = collections.namedtuple('AddressKeyPair', ['address', 'key'])
     PRIV_KEYS = [
@@ -287,6 +321,9 @@ class TestNode():
         if env is not None:
             subp_env.update(env)
 
+        # Only look for STARTUP_DONE_LOG_MSG in the lines logged by this start
+        self._startup_log_offset = self.debug_log_path.stat().st_size if self.debug_log_path.exists() else 0
+        self._start_time = time.monotonic()
         self.process = subprocess.Popen(self.args + extra_args, env=subp_env, stdout=stdout, stderr=stderr, cwd=cwd, **kwargs)
 
         self.running = True
@@ -295,94 +332,136 @@ class TestNode():
         if self.start_perf:
             self._start_perf()
 
+    def _read_startup_log(self):
+        """Return whether STARTUP_DONE_LOG_MSG or MEMPOOL_IMPORTED_LOG_MSG was logged since the last call."""
+        log, self._startup_log_offset = self.read_debug_log_since(self._startup_log_offset)
+        return STARTUP_DONE_LOG_MSG in log or MEMPOOL_IMPORTED_LOG_MSG in log
+
     def wait_for_rpc_connection(self, *, wait_for_import=True):
         """Sets up an RPC connection to the bitcoind process. Returns False if unable to connect."""
-        # Poll at a rate of four times per second
-        poll_per_s = 4
+        wait_for_rpc_connections([self], wait_for_import=wait_for_import)
 
+    def _rpc_connection_steps(self, *, wait_for_import):
+        """Generator setting up the RPC connection, see wait_for_rpc_connections().
+
+        Rather than polling RPC, this follows debug.log and connects as soon as the node has finished
+        loading, and then (with wait_for_import) checks again whether the mempool has been loaded as soon
+        as that is logged. The same RPC connection is kept for all attempts. Whenever there is nothing to
+        do, yields the DirectoryWatcher of the chain directory (or None before it exists) and the time
+        until which to wait for changes to it."""
         suppressed_errors = collections.defaultdict(int)
         latest_error = None
         def suppress_error(category: str, e: Exception):
             suppressed_errors[category] += 1
             return (category, repr(e))
 
-        for _ in range(poll_per_s * self.rpc_timeout):
-            if self.process.poll() is not None:
-                # Attach abrupt shutdown error/s to the exception message
-                self.stderr.seek(0)
-                str_error = ''.join(line.decode('utf-8') for line in self.stderr)
-                str_error += "************************\n" if str_error else ''
-
-                raise FailedToStartError(self._node_msg(
-                    f'bitcoind exited with status {self.process.returncode} during initialization. {str_error}'))
-            try:
-                rpc = get_rpc_proxy(
-                    rpc_url(self.datadir_path, self.index, self.chain, self.rpchost),
-                    self.index,
-                    timeout=self.rpc_timeout // 2,  # Shorter timeout to allow for one retry in case of ETIMEDOUT
-                    coveragedir=self.coverage_dir,
-                )
-                rpc.auth_service_proxy_instance.reuse_http_connections = self.reuse_http_connections
-                rpc.getblockcount()
-                # If the call to getblockcount() succeeds then the RPC connection is up
-                if self.version_is_at_least(190000) and wait_for_import:
-                    # getmempoolinfo.loaded is available since commit
-                    # bb8ae2c (version 0.19.0)
-                    self.wait_until(lambda: rpc.getmempoolinfo()['loaded'])
-                    # Wait for the node to finish reindex, block import, and
-                    # loading the mempool. Usually importing happens fast or
-                    # even "immediate" when the node is started. However, there
-                    # is no guarantee and sometimes ImportBlocks might finish
-                    # later. This is going to cause intermittent test failures,
-                    # because generally the tests assume the node is fully
-                    # ready after being started.
-                    #
-                    # For example, the node will reject block messages from p2p
-                    # when it is still importing with the error "Unexpected
-                    # block message received"
-                    #
-                    # The wait is done here to make tests as robust as possible
-                    # and prevent racy tests and intermittent failures as much
-                    # as possible. Some tests might not need this, but the
-                    # overhead is trivial, and the added guarantees are worth
-                    # the minimal performance cost.
-                self.log.debug("RPC successfully started")
-                # Set rpc_connected even if we are in use_cli mode so that we know we can call self.stop() if needed.
-                self.rpc_connected = True
-                if self.use_cli:
+        rpc = None
+        # Whether getblockcount() succeeded, and only the mempool is still being waited for
+        connected = False
+        watcher = None
+        next_attempt = time.monotonic() + STARTUP_RETRY_INTERVAL
+        time_end = time.monotonic() + self.rpc_timeout
+        try:
+            while time.monotonic() < time_end:
+                if self.process.poll() is not None:
+                    # Attach abrupt shutdown error/s to the exception message
+                    self.stderr.seek(0)
+                    str_error = ''.join(line.decode('utf-8') for line in self.stderr)
+                    str_error += "************************\n" if str_error else ''
+
+                    raise FailedToStartError(self._node_msg(
+                        f'bitcoind exited with status {self.process.returncode} during initialization. {str_error}'))
+                if watcher is None and self.chain_path.is_dir():
+                    watcher = DirectoryWatcher(self.chain_path)
+                if self._read_startup_log():
+                    next_attempt = time.monotonic()
+                if time.monotonic() < next_attempt:
+                    yield watcher, next_attempt if watcher is not None else time.monotonic() + STARTUP_POLL_INTERVAL
+                    continue
+                next_attempt = time.monotonic() + STARTUP_RETRY_INTERVAL
+                try:
+                    if rpc is None:
+                        rpc = get_rpc_proxy(
+                            rpc_url(self.datadir_path, self.index, self.chain, self.rpchost),
+                            self.index,
+                            timeout=self.rpc_timeout // 2,  # Shorter timeout to allow for one retry in case of ETIMEDOUT
+                            coveragedir=self.coverage_dir,
+                            rpc_profile=self.rpc_profile,
+                        )
+                        rpc.auth_service_proxy_instance.reuse_http_connections = self.reuse_http_connections
+                    if not connected:
+                        rpc.getblockcount()
+                        # If the call to getblockcount() succeeds then the RPC connection is up
+                        connected = True
+                        # Allow as long for loading the mempool as for connecting
+                        time_end = time.monotonic() + self.rpc_timeout
+                    if self.version_is_at_least(190000) and wait_for_import and not rpc.getmempoolinfo()['loaded']:
+                        # getmempoolinfo.loaded is available since commit
+                        # bb8ae2c (version 0.19.0)
+                        #
+                        # Wait for the node to finish reindex, block import, and
+                        # loading the mempool. Usually importing happens fast or
+                        # even "immediate" when the node is started. However, there
+                        # is no guarantee and sometimes ImportBlocks might finish
+                        # later. This is going to cause intermittent test failures,
+                        # because generally the tests assume the node is fully
+                        # ready after being started.
+                        #
+                        # For example, the node will reject block messages from p2p
+                        # when it is still importing with the error "Unexpected
+                        # block message received"
+                        #
+                        # The wait is done here to make tests as robust as possible
+                        # and prevent racy tests and intermittent failures as much
+                        # as possible. Some tests might not need this, but the
+                        # overhead is trivial, and the added guarantees are worth
+                        # the minimal performance cost.
+                        next_attempt = time.monotonic() + MEMPOOL_LOADED_RETRY_INTERVAL
+                        continue
+                    self.startup_latencies.append(time.monotonic() - self._start_time)
+                    self.log.debug("RPC successfully started after {:.0f} ms".format(self.startup_latencies[-1] * 1000))
+                    # Set rpc_connected even if we are in use_cli mode so that we know we can call self.stop() if needed.
+                    self.rpc_connected = True
+                    if self.use_cli:
+                        return
+                    self._rpc = rpc
+                    self.url = self._rpc.rpc_url
                     return
-                self._rpc = rpc
-                self.url = self._rpc.rpc_url
-                return
-            except JSONRPCException as e:
-                # Suppress these as they are expected during initialization.
-                # -28 RPC in warmup
-                # -342 Service unavailable, could be starting up or shutting down
-                if e.error['code'] not in [-28, -342]:
-                    raise  # unknown JSON RPC exception
-                latest_error = suppress_error(f"JSONRPCException {e.error['code']}", e)
-            except OSError as e:
-                error_num = e.errno
-                # Work around issue where socket timeouts don't have errno set.
-                # https://github.com/python/cpython/issues/109601
-                if error_num is None and isinstance(e, TimeoutError):
-                    error_num = errno.ETIMEDOUT
-
-                # Suppress similarly to the above JSONRPCException errors.
-                if error_num not in [
-                    errno.ECONNRESET,   # This might happen when the RPC server is in warmup,
-                                        # but shut down before the call to getblockcount succeeds.
-                    errno.ETIMEDOUT,    # Treat identical to ECONNRESET
-                    errno.ECONNREFUSED  # Port not yet open?
-                ]:
-                    raise  # unknown OS error
-                latest_error = suppress_error(f"OSError {errno.errorcode[error_num]}", e)
-            except ValueError as e:
-                # Suppress if cookie file isn't generated yet and no rpcuser or rpcpassword; bitcoind may be starting.
-                if "No RPC credentials" not in str(e):
-                    raise
-                latest_error = suppress_error("missing_credentials", e)
-            time.sleep(1.0 / poll_per_s)
+                except JSONRPCException as e:
+                    # Suppress these as they are expected during initialization.
+                    # -28 RPC in warmup
+                    # -342 Service unavailable, could be starting up or shutting down
+                    if e.error['code'] not in [-28, -342]:
+                        raise  # unknown JSON RPC exception
+                    latest_error = suppress_error(f"JSONRPCException {e.error['code']}", e)
+                except OSError as e:
+                    error_num = e.errno
+                    # Work around issue where socket timeouts don't have errno set.
+                    # https://github.com/python/cpython/issues/109601
+                    if error_num is None and isinstance(e, TimeoutError):
+                        error_num = errno.ETIMEDOUT
+
+                    # Suppress similarly to the above JSONRPCException errors.
+                    if error_num not in [
+                        errno.ECONNRESET,   # This might happen when the RPC server is in warmup,
+                                            # but shut down before the call to getblockcount succeeds.
+                        errno.ETIMEDOUT,    # Treat identical to ECONNRESET
+                        errno.ECONNREFUSED  # Port not yet open?
+                    ]:
+                        raise  # unknown OS error
+                    latest_error = suppress_error(f"OSError {errno.errorcode[error_num]}", e)
+                    # Reconnect on the next attempt
+                    rpc = None
+                except ValueError as e:
+                    # Suppress if cookie file isn't generated yet and no rpcuser or rpcpassword; bitcoind may be starting.
+                    if "No RPC credentials" not in str(e):
+                        raise
+                    latest_error = suppress_error("missing_credentials", e)
+        finally:
+            if watcher is not None:
+                watcher.close()
+        if connected:
+            self._raise_assertion_error(f"Mempool of bitcoind not loaded after {self.rpc_timeout}s")
         self._raise_assertion_error(f"Unable to connect to bitcoind after {self.rpc_timeout}s (ignored errors: {dict(suppressed_errors)!s}{'' if latest_error is None else f', latest: {latest_error[0]!r}/{latest_error[1]}'})")
 
     def wait_for_cookie_credentials(self):
@@ -539,6 +618,20 @@ class TestNode():
     def wallets_path(self) -> Path:
         return self.chain_path / "wallets"
 
+    def read_debug_log_since(self, offset):
+        """Return the complete lines appended to debug.log since offset, and the offset after them."""
+        try:
+            with open(self.debug_log_path, 'rb') as dl:
+                if dl.seek(0, 2) < offset:
+                    # The log was shrunk on startup
+                    offset = 0
+                dl.seek(offset)
+                log = dl.read()
+        except FileNotFoundError:
+            return b'', 0
+        log = log[:log.rfind(b'\n') + 1]
+        return log, offset + len(log)
+
     def debug_log_size(self, **kwargs) -> int:
         with open(self.debug_log_path, **kwargs) as dl:
             dl.seek(0, 2)
@@ -5,6 +5,7 @@
 """Helpful routines for regression testing."""
 
 from base64 import b64encode
+from collections import defaultdict
 from decimal import Decimal
 from subprocess import CalledProcessError
 import hashlib
@@ -17,12 +18,15 @@ import platform
 import random
 import re
 import shlex
+import statistics
+import threading
 import time
 import types
 
 from . import coverage
 from .authproxy import AuthServiceProxy, JSONRPCException
 from .descriptors import descsum_create
+from .rpc_profile import RPCProfile
 from collections.abc import Callable
 from typing import Optional, Union
 
@@ -387,9 +391,47 @@ def ensure_for(*, duration, f, check_interval=0.2):
         time.sleep(check_interval)
 
 
+# wait_until() checks the predicate every check_interval seconds. For long waits, it then backs off so that
+# the interval stays below WAIT_UNTIL_BACKOFF of the time waited so far, delaying noticing the predicate by
+# at most that fraction of the wait, and by at most max(check_interval, WAIT_UNTIL_MAX_INTERVAL) seconds.
+# Predicates on p2p_lock are cheap, so those waits start at WAIT_UNTIL_MIN_INTERVAL, doubling the interval
+# up to check_interval, as many of them become true within milliseconds. Other predicates usually make
+# RPCs, which would only add load to the nodes being waited for.
+WAIT_UNTIL_MIN_INTERVAL = 0.001
+WAIT_UNTIL_BACKOFF = 0.1
+WAIT_UNTIL_MAX_INTERVAL = 0.5
+
+
+class WaitStatistics:
+    """Number of polls and time spent in the wait helpers of the test framework, by kind of wait."""
+
+    def __init__(self):
+        self.waits = defaultdict(list)
+
+    def record(self, kind, *, polls, duration):
+        self.waits[kind].append((polls, duration))
+
+    def summary(self):
+        """Return one line per kind of wait, in the order the kinds were first used."""
+        lines = []
+        for kind, waits in self.waits.items():
+            durations = [duration for _, duration in waits]
+            lines.append("{}: {} waits, {} polls, median {:.0f} ms, max {:.0f} ms, total {:.1f} s".format(
+                kind, len(waits), sum(polls for polls, _ in waits),
+                statistics.median(durations) * 1000, max(durations) * 1000, sum(durations)))
+        return lines
+
+
+WAIT_STATS = WaitStatistics()
+
+
 def wait_until_helper_internal(predicate, *, timeout=60, lock=None, timeout_factor=1.0, check_interval=0.05):
     """Sleep until the predicate resolves to be True.
 
+    The predicate is checked every check_interval seconds, less often during long waits (see
+    WAIT_UNTIL_BACKOFF). If lock is a threading.Condition (like p2p_lock), the predicate is also
+    checked more often at the start of the wait, and whenever the condition is notified.
+
     Warning: Note that this method is not recommended to be used in tests as it is
     not aware of the context of the test framework. Using the `wait_until()` members
     from `BitcoinTestFramework` or `P2PInterface` class ensures the timeout is
@@ -397,18 +439,37 @@ def wait_until_helper_internal(predicate, *, timeout=60, lock=None, timeout_fact
     `p2p.py` has a preset lock.
     """
     timeout = timeout * timeout_factor
-    time_end = time.time() + timeout
+    time_start = time.time()
+    time_end = time_start + timeout
+    wait_on_lock = isinstance(lock, threading.Condition)
+    kind = "wait_until (p2p)" if wait_on_lock else "wait_until"
+    min_interval = WAIT_UNTIL_MIN_INTERVAL if wait_on_lock else check_interval
+    max_interval = max(check_interval, WAIT_UNTIL_MAX_INTERVAL)
+    polls = 0
 
-    while time.time() < time_end:
+    while True:
+        now = time.time()
+        if now >= time_end:
+            break
+        elapsed = now - time_start
+        interval = min(max(min_interval, min(elapsed, check_interval), elapsed * WAIT_UNTIL_BACKOFF), max_interval, time_end - now)
+        polls += 1
         if lock:
             with lock:
                 if predicate():
+                    WAIT_STATS.record(kind, polls=polls, duration=time.time() - time_start)
                     return
+                if wait_on_lock:
+                    # Releases the lock while waiting
+                    lock.wait(interval)
+                    continue
         else:
             if predicate():
+                WAIT_STATS.record(kind, polls=polls, duration=time.time() - time_start)
                 return
-        time.sleep(check_interval)
+        time.sleep(interval)
 
+    WAIT_STATS.record(kind, polls=polls, duration=time.time() - time_start)
     # Print the cause of the timeout
     predicate_source = "''''\n" + inspect.getsource(predicate) + "'''"
     logger.error("wait_until() failed. Predicate: {}".format(predicate_source))
@@ -455,7 +516,7 @@ class PortSeed:
     n = None
 
 
-def get_rpc_proxy(url: str, node_number: int, *, timeout: Optional[int]=None, coveragedir: Optional[str]=None) -> coverage.AuthServiceProxyWrapper:
+def get_rpc_proxy(url: str, node_number: int, *, timeout: Optional[int]=None, coveragedir: Optional[str]=None, rpc_profile: Optional[RPCProfile]=None) -> coverage.AuthServiceProxyWrapper:
     """
     Args:
         url: URL of the RPC server to call
@@ -464,6 +525,7 @@ def get_rpc_proxy(url: str, node_number: int, *, timeout: Optional[int]=None, co
     Kwargs:
         timeout: HTTP timeout in seconds
         coveragedir: Directory
+        rpc_profile: RPCProfile to record the calls in
 
     Returns:
         AuthServiceProxy. convenience object for making RPC calls.
@@ -477,7 +539,7 @@ def get_rpc_proxy(url: str, node_number: int, *, timeout: Optional[int]=None, co
 
     coverage_logfile = coverage.get_filename(coveragedir, node_number) if coveragedir else None
 
-    return coverage.AuthServiceProxyWrapper(proxy, url, coverage_logfile)
+    return coverage.AuthServiceProxyWrapper(proxy, url, coverage_logfile, rpc_profile)
 
 
 def p2p_port(n):
@@ -6,7 +6,7 @@
 
 import random
 
-from .crypto.bip324_cipher import FSChaCha20Poly1305
+from .crypto.bip324_cipher import FastFSChaCha20Poly1305
 from .crypto.chacha20 import FSChaCha20
 from .crypto.ellswift import ellswift_create, ellswift_ecdh_xonly
 from .crypto.hkdf import hkdf_sha256
@@ -231,17 +231,17 @@ class EncryptedP2PState:
             peer[name] = hkdf_sha256(salt=salt, ikm=ecdh_secret, info=name.encode('utf-8'), length=32)
         if self.initiating:
             self.peer['send_L'] = FSChaCha20(peer['initiator_L'])
-            self.peer['send_P'] = FSChaCha20Poly1305(peer['initiator_P'])
+            self.peer['send_P'] = FastFSChaCha20Poly1305(peer['initiator_P'])
             self.peer['send_garbage_terminator'] = peer['garbage_terminators'][:16]
             self.peer['recv_L'] = FSChaCha20(peer['responder_L'])
-            self.peer['recv_P'] = FSChaCha20Poly1305(peer['responder_P'])
+            self.peer['recv_P'] = FastFSChaCha20Poly1305(peer['responder_P'])
             self.peer['recv_garbage_terminator'] = peer['garbage_terminators'][16:]
         else:
             self.peer['send_L'] = FSChaCha20(peer['responder_L'])
-            self.peer['send_P'] = FSChaCha20Poly1305(peer['responder_P'])
+            self.peer['send_P'] = FastFSChaCha20Poly1305(peer['responder_P'])
             self.peer['send_garbage_terminator'] = peer['garbage_terminators'][16:]
             self.peer['recv_L'] = FSChaCha20(peer['initiator_L'])
-            self.peer['recv_P'] = FSChaCha20Poly1305(peer['initiator_P'])
+            self.peer['recv_P'] = FastFSChaCha20Poly1305(peer['initiator_P'])
             self.peer['recv_garbage_terminator'] = peer['garbage_terminators'][:16]
         self.peer['session_id'] = peer['session_id']
 
@@ -270,14 +270,14 @@ class EncryptedP2PState:
                 return 0, None
             enc_contents_len = response[:LENGTH_FIELD_LEN]
             self.contents_len = int.from_bytes(self.peer['recv_L'].crypt(enc_contents_len), 'little')
-        response = response[LENGTH_FIELD_LEN:]
-        if len(response) < HEADER_LEN + self.contents_len + CHACHA20POLY1305_EXPANSION:
+        length = LENGTH_FIELD_LEN + HEADER_LEN + self.contents_len + CHACHA20POLY1305_EXPANSION
+        if len(response) < length:
             return 0, None
-        aead_ciphertext = response[:HEADER_LEN + self.contents_len + CHACHA20POLY1305_EXPANSION]
-        plaintext = self.peer['recv_P'].decrypt(aad, aead_ciphertext)
-        if plaintext is None:
-            return -1, None  # disconnect
+        plaintext = bytearray(HEADER_LEN + self.contents_len)
+        # Decrypt directly from the receive buffer, without copying out the (possibly large) ciphertext
+        with memoryview(response) as view:
+            if self.peer['recv_P'].decrypt_into(aad, view[LENGTH_FIELD_LEN:length], plaintext) is None:
+                return -1, None  # disconnect
         header = plaintext[:HEADER_LEN]
-        length = LENGTH_FIELD_LEN + HEADER_LEN + self.contents_len + CHACHA20POLY1305_EXPANSION
         self.contents_len = -1
-        return length, None if (header[0] & (1 << IGNORE_BIT_POS)) else plaintext[HEADER_LEN:]
+        return length, None if (header[0] & (1 << IGNORE_BIT_POS)) else bytes(plaintext[HEADER_LEN:])
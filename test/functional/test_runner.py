@@ -13,11 +13,15 @@ For a description of arguments recognized by test scripts, see
 """
 
 import argparse
+import ast
+import asyncio
 from collections import deque
 from concurrent import futures
 import configparser
 import csv
 import datetime
+import heapq
+import json
 import os
 import pathlib
 import platform
@@ -30,12 +34,33 @@ import tempfile
 import re
 import logging
 
+from test_framework.chain_cache import (
+    BINARY_HASHES_DIR,
+    CHAINS_DIR,
+    prune_cache_dir,
+)
+from test_framework.pyprofile import (
+    PYPROFILE_FILE,
+    PYSAMPLE_FILE,
+    merge_pyprofiles,
+    merge_pysamples,
+)
+from test_framework.rpc_profile import RPCProfile
+
 # Minimum amount of space to run the tests.
 MIN_FREE_SPACE = 1.1 * 1024 * 1024 * 1024
 # Additional space to run an extra job.
 ADDITIONAL_SPACE_PER_JOB = 100 * 1024 * 1024
 # Minimum amount of space required for --nocleanup
 MIN_NO_CLEANUP_SPACE = 12 * 1024 * 1024 * 1024
+# Memory to keep available when starting an extra job, in addition to its expected peak use.
+MIN_FREE_MEMORY = 256 * 1024 * 1024
+# Don't start an extra job while the system load average per CPU is above this.
+MAX_LOAD_PER_CPU = 2
+# How often (in seconds) to measure the disk use of the running tests.
+DISK_SAMPLE_INTERVAL = 5
+# How often (in seconds) to measure the memory use of the running tests (and their nodes).
+MEMORY_SAMPLE_INTERVAL = 1
 
 # Formatting. Default colors to empty strings.
 DEFAULT, BOLD, GREEN, RED = ("", ""), ("", ""), ("", ""), ("", "")
@@ -258,6 +283,7 @@ BASE_SCRIPTS = [
     'mempool_package_limits.py',
     'mempool_package_rbf.py',
     'tool_utxo_to_sqlite.py',
+    'tool_blockfilter_index.py',
     'feature_versionbits_warning.py',
     'feature_blocksxor.py',
     'rpc_preciousblock.py',
@@ -364,6 +390,7 @@ BASE_SCRIPTS = [
     'rpc_help.py',
     'feature_framework_testshell.py',
     'tool_rpcauth.py',
+    'tool_linearize_data.py',
     'p2p_handshake.py',
     'p2p_handshake.py --v2transport',
     'feature_dirsymlinks.py',
@@ -384,6 +411,7 @@ NON_SCRIPTS = [
     # These are python files that live in the functional tests directory, but are not test scripts.
     "combine_logs.py",
     "create_cache.py",
+    "framework_bench.py",
     "test_runner.py",
 ]
 
@@ -403,14 +431,21 @@ def main():
     parser.add_argument('--extended', action='store_true', help='run the extended test suite in addition to the basic tests')
     parser.add_argument('--help', '-h', '-?', action='store_true', help='print help text and exit')
     parser.add_argument('--jobs', '-j', type=int, default=4, help='how many test scripts to run in parallel. Default=4.')
-    parser.add_argument('--keepcache', '-k', action='store_true', help='the default behavior is to flush the cache directory on startup. --keepcache retains the cache from the previous testrun.')
+    parser.add_argument('--keepcache', '-k', action='store_true', help='the default behavior is to flush the cache directory on startup, except for chain caches used in the last week (they are keyed by the bitcoind binary, so never stale). --keepcache retains the whole cache from the previous testrun.')
+    parser.add_argument('--pyprofile', action='store_true', help='profile the tests with cProfile and report the test harness functions taking the most time, merged over all tests')
+    parser.add_argument('--pysample', action='store_true', help='profile the tests with a sampling profiler and report the test harness functions taking the most CPU time, merged over all tests')
     parser.add_argument('--quiet', '-q', action='store_true', help='only print dots, results summary and failure logs')
+    parser.add_argument('--rpc-profile', action='store_true', help='report the number, latency, size and call sites of the RPC calls of all tests, and write them to rpc_profile.json in the temporary test directory')
     parser.add_argument('--tmpdirprefix', '-t', default=tempfile.gettempdir(), help="Root directory for datadirs")
     parser.add_argument('--failfast', '-F', action='store_true', help='stop execution after the first test failure')
     parser.add_argument('--filter', help='filter scripts to run by regular expression')
     parser.add_argument("--nocleanup", dest="nocleanup", default=False, action="store_true",
                         help="Leave bitcoinds and test.* datadir on exit or error")
     parser.add_argument('--resultsfile', '-r', help='store test results (as CSV) to the provided file')
+    parser.add_argument('--preload', action='store_true', help='run the test scripts in forked children of a process which has already imported the test framework, '
+                                                               'instead of starting a new Python interpreter for every test (not available on Windows)')
+    parser.add_argument('--nohistory', action='store_true', help='neither use nor update the durations and resource use of previous runs, which are otherwise used to run the longest tests first '
+                                                                 'and to limit parallelism to the free memory and disk space')
 
     args, unknown_args = parser.parse_known_args()
     fail_on_warn = args.ci
@@ -443,6 +478,10 @@ def main():
 
     logging.debug("Temporary test directory at %s" % tmpdir)
 
+    if args.preload and not hasattr(os, "fork"):
+        print("--preload is not supported on this platform")
+        sys.exit(1)
+
     results_filepath = None
     if args.resultsfile:
         results_filepath = pathlib.Path(args.resultsfile)
@@ -536,7 +575,11 @@ def main():
     check_script_prefixes()
 
     if not args.keepcache:
-        shutil.rmtree("%s/test/cache" % config["environment"]["BUILDDIR"], ignore_errors=True)
+        prune_cache_dir("%s/test/cache" % config["environment"]["BUILDDIR"])
+
+    history = None
+    if not args.nohistory:
+        history = TestHistory(pathlib.Path(config["environment"]["BUILDDIR"]) / "test" / "functional_test_history.json")
 
     run_tests(
         test_list=test_list,
@@ -544,14 +587,19 @@ def main():
         tmpdir=tmpdir,
         jobs=args.jobs,
         enable_coverage=args.coverage,
+        enable_rpc_profile=args.rpc_profile,
+        pyprofile=args.pyprofile,
+        pysample=args.pysample,
         args=passon_args,
         combined_logs_len=args.combinedlogslen,
         failfast=args.failfast,
         use_term_control=args.ansi,
         results_filepath=results_filepath,
+        history=history,
+        preload=args.preload,
     )
 
-def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, args=None, combined_logs_len=0, failfast=False, use_term_control, results_filepath=None):
+def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, enable_rpc_profile=False, pyprofile=False, pysample=False, args=None, combined_logs_len=0, failfast=False, use_term_control, results_filepath=None, history=None, preload=False):
     args = args or []
 
     # Warn if bitcoind is already running
@@ -563,9 +611,9 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
         # pgrep not supported
         pass
 
-    # Warn if there is a cache directory
+    # Warn if there is a cache directory, other than the chain cache which is keyed by the binaries
     cache_dir = "%s/test/cache" % build_dir
-    if os.path.isdir(cache_dir):
+    if os.path.isdir(cache_dir) and set(os.listdir(cache_dir)) - {CHAINS_DIR, BINARY_HASHES_DIR}:
         print("%sWARNING!%s There is a cache directory here: %s. If tests fail unexpectedly, try deleting the cache directory." % (BOLD[1], BOLD[0], cache_dir))
 
     # Warn if there is not enough space on the testing dir
@@ -588,13 +636,35 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
     else:
         coverage = None
 
+    if enable_rpc_profile:
+        rpc_profiler = RPCProfiler()
+        flags.append(rpc_profiler.flag)
+        logging.debug("Initializing RPC profile directory at %s" % rpc_profiler.dir)
+    else:
+        rpc_profiler = None
+
     if len(test_list) > 1 and jobs > 1:
-        # Populate cache
-        try:
-            subprocess.check_output([sys.executable, tests_dir + 'create_cache.py'] + flags + ["--tmpdir=%s/cache" % tmpdir])
-        except subprocess.CalledProcessError as e:
-            sys.stdout.buffer.write(e.output)
-            raise
+        # Populate cache, building the chain of every cache profile in parallel
+        cache_procs = [subprocess.Popen([sys.executable, tests_dir + 'create_cache.py', f"--cacheprofile={profile}"] + flags + [f"--tmpdir={tmpdir}/cache_{profile}"],
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                       for profile in get_cache_profiles(tests_dir, test_list)]
+        for proc in cache_procs:
+            output = proc.communicate()[0]
+            if proc.returncode:
+                sys.stdout.buffer.write(output)
+                raise subprocess.CalledProcessError(proc.returncode, proc.args, output)
+
+    predicted_runtime = None
+    if history is not None:
+        test_list, predicted_runtime = schedule_tests(test_list, history, jobs)
+        if predicted_runtime is not None:
+            logging.debug("Running the longest tests first, predicted runtime: %s s" % int(predicted_runtime))
+
+    # Profile only the tests, as the profiles of the cache creation above would be merged as tests
+    if pyprofile:
+        flags.append('--pyprofile')
+    if pysample:
+        flags.append('--pysample')
 
     #Run Tests
     job_queue = TestHandler(
@@ -604,6 +674,9 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
         test_list=test_list,
         flags=flags,
         use_term_control=use_term_control,
+        history=history,
+        preload=preload,
+        failfast=failfast,
     )
     start_time = time.time()
     test_results = []
@@ -648,9 +721,26 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
                              f"Additional storage is needed to execute testing.")
 
     runtime = int(time.time() - start_time)
-    print_results(test_results, max_len_name, runtime)
+    print_results(test_results, max_len_name, runtime, predicted_runtime)
+    if job_queue.preloader is not None:
+        preloader = job_queue.preloader
+        preload_time = job_queue.loop.run_until_complete(preloader.preload_time)
+        preloader.close()
+        logging.debug("Preloaded the test framework in %.0f ms" % (1000 * preload_time))
+        if preloader.fork_times:
+            fork_times = preloader.fork_times
+            saved = len(fork_times) * preloader.spawn_time - sum(fork_times)
+            print("Preload: starting a test took %.1f ms on average by forking, instead of %.0f ms for a new interpreter importing the framework, "
+                  "saving %.1f s of startup over %d tests" % (1000 * sum(fork_times) / len(fork_times), 1000 * preloader.spawn_time, saved, len(fork_times)))
+    if job_queue.scheduling_overheads:
+        overheads = job_queue.scheduling_overheads
+        logging.debug("Scheduling overhead per test: %.1f ms on average, %.1f ms at most" % (1000 * sum(overheads) / len(overheads), 1000 * max(overheads)))
     if results_filepath:
         write_results(test_results, results_filepath, runtime)
+    if history is not None:
+        for test_result in test_results:
+            history.record(test_result)
+        history.save()
 
     if coverage:
         coverage_passed = coverage.report_rpc_coverage()
@@ -660,6 +750,17 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
     else:
         coverage_passed = True
 
+    if rpc_profiler:
+        rpc_profiler.report(os.path.join(tmpdir, "rpc_profile.json"))
+        rpc_profiler.cleanup()
+
+    for enabled, profile_file, merge in [(pyprofile, PYPROFILE_FILE, merge_pyprofiles), (pysample, PYSAMPLE_FILE, merge_pysamples)]:
+        profiles = sorted(str(path) for path in pathlib.Path(tmpdir).glob(f"*/{profile_file}")) if enabled else []
+        if profiles:
+            merged_file = os.path.join(tmpdir, profile_file)
+            print("Python profile of the test harness, merged over %d tests and written to %s:" % (len(profiles), merged_file))
+            print(merge(profiles, merged_file))
+
     # Clear up the temp directory if all subdirectories are gone
     if not os.listdir(tmpdir):
         os.rmdir(tmpdir)
@@ -675,7 +776,7 @@ def run_tests(*, test_list, build_dir, tmpdir, jobs=1, enable_coverage=False, ar
     sys.exit(not all_passed)
 
 
-def print_results(test_results, max_len_name, runtime):
+def print_results(test_results, max_len_name, runtime, predicted_runtime=None):
     results = "\n" + BOLD[1] + "%s | %s | %s\n\n" % ("TEST".ljust(max_len_name), "STATUS   ", "DURATION") + BOLD[0]
 
     test_results.sort(key=TestResult.sort_key)
@@ -695,25 +796,288 @@ def print_results(test_results, max_len_name, runtime):
     if not all_passed:
         results += RED[0]
     results += "Runtime: %s s\n" % (runtime)
+    if predicted_runtime is not None:
+        results += "Predicted runtime: %s s\n" % int(predicted_runtime)
     print(results)
 
 
 def write_results(test_results, filepath, total_runtime):
     with open(filepath, mode="w", encoding="utf8") as results_file:
         results_writer = csv.writer(results_file)
-        results_writer.writerow(['test', 'status', 'duration(seconds)'])
+        results_writer.writerow(['test', 'status', 'duration(seconds)', 'max_rss(KiB)', 'max_disk(bytes)'])
         all_passed = True
         for test_result in test_results:
             all_passed = all_passed and test_result.was_successful
-            results_writer.writerow([test_result.name, test_result.status, str(test_result.time)])
-        results_writer.writerow(['ALL', ("Passed" if all_passed else "Failed"), str(total_runtime)])
+            results_writer.writerow([test_result.name, test_result.status, str(test_result.time),
+                                     "" if test_result.max_rss is None else str(test_result.max_rss),
+                                     "" if test_result.max_disk is None else str(test_result.max_disk)])
+        results_writer.writerow(['ALL', ("Passed" if all_passed else "Failed"), str(total_runtime), "", ""])
+
+
+class TestHistory:
+    """
+    Durations and resource use of the tests in previous runs, stored as JSON.
+
+    For every test, the duration (seconds), peak RSS (KiB) and peak disk use (bytes) of the
+    last MAX_RUNS passed runs are kept. Failed and skipped runs are not representative (a test
+    may fail or skip right away).
+    """
+    MAX_RUNS = 5
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        try:
+            with open(filepath, encoding="utf8") as history_file:
+                self.tests = json.load(history_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.tests = {}
+
+    def record(self, test_result):
+        if test_result.status != "Passed":
+            return
+        runs = self.tests.setdefault(test_result.name, [])
+        runs.append({"duration": test_result.time, "max_rss": test_result.max_rss, "max_disk": test_result.max_disk})
+        del runs[:-self.MAX_RUNS]
+
+    def estimate(self, test):
+        """Return the expected duration, peak RSS and peak disk use of a test, or None if it never ran."""
+        runs = self.tests.get(test)
+        if not runs:
+            return None
+        return (sum(run["duration"] for run in runs) / len(runs),
+                max(run["max_rss"] or 0 for run in runs),
+                max(run["max_disk"] or 0 for run in runs))
+
+    def save(self):
+        # Write to a temporary file first, so that concurrent runs never see a partially written file.
+        tmp_filepath = self.filepath.with_name(self.filepath.name + ".tmp%d" % os.getpid())
+        with open(tmp_filepath, "w", encoding="utf8") as history_file:
+            json.dump(self.tests, history_file, indent=1, sort_keys=True)
+        os.replace(tmp_filepath, self.filepath)
+
+
+def schedule_tests(test_list, history, jobs):
+    """
+    Order the tests longest first (LPT scheduling), based on their durations in previous runs.
+
+    Tests that never ran are assumed to take the average duration of the known tests, and keep
+    their relative order. Returns the ordered tests and the predicted runtime of running them in
+    jobs parallel slots, or None if there is no history for any of the tests.
+    """
+    estimates = {test: history.estimate(test) for test in test_list}
+    known_durations = [estimate[0] for estimate in estimates.values() if estimate is not None]
+    if not known_durations:
+        return test_list, None
+    default_duration = sum(known_durations) / len(known_durations)
+    durations = {test: default_duration if estimate is None else estimate[0] for test, estimate in estimates.items()}
+    ordered = deque(sorted(test_list, key=lambda test: -durations[test]))
+    # Each test starts in the slot which becomes free first.
+    slots = [0] * min(jobs, len(ordered))
+    for test in ordered:
+        heapq.heapreplace(slots, slots[0] + durations[test])
+    return ordered, max(slots)
+
+
+def get_cache_profiles(tests_dir, test_list):
+    """
+    Return the cache profiles (see test_framework/cache_profiles.py) used by the tests in test_list.
+
+    A test using another profile than the default one names it in a module-level CACHE_PROFILE string
+    constant, which it assigns to self.cache_profile.
+    """
+    profiles = {"default"}
+    for test in test_list:
+        source = pathlib.Path(tests_dir, test.split()[0]).read_text(encoding="utf8")
+        if "CACHE_PROFILE" not in source:
+            continue
+        for statement in ast.parse(source).body:
+            if isinstance(statement, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "CACHE_PROFILE" for target in statement.targets):
+                profiles.add(ast.literal_eval(statement.value))
+    return sorted(profiles)
+
+
+def get_available_memory():
+    """Return the memory available for new processes in bytes, or None if unknown (non-Linux)."""
+    try:
+        with open("/proc/meminfo", encoding="utf8") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def get_dir_size(path):
+    """Return the total size in bytes of the files in a directory tree, which may be changing or removed."""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def get_process_table():
+    """Return {pid: (parent pid, RSS in KiB)} of all processes, or None where /proc is not available."""
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    page_kib = os.sysconf("SC_PAGE_SIZE") // 1024
+    processes = {}
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            continue
+        # The fields after the command name, which may contain spaces and parentheses, starting at the state
+        fields = stat[stat.rfind(b")") + 2:].split()
+        processes[int(entry)] = int(fields[1]), int(fields[21]) * page_kib
+    return processes
+
+
+def get_tree_rss(pids, processes):
+    """
+    Return the summed RSS in KiB of each of the processes pids and all their descendants, using the
+    process table from get_process_table(). Pages shared between the processes are counted for each.
+    """
+    children = {}
+    for pid, (ppid, _) in processes.items():
+        children.setdefault(ppid, []).append(pid)
+    tree_rss = {}
+    for root in pids:
+        total = 0
+        stack = [root]
+        while stack:
+            pid = stack.pop()
+            if pid in processes:
+                total += processes[pid][1]
+                stack.extend(children.get(pid, []))
+        tree_rss[root] = total
+    return tree_rss
+
+
+def wait_for_max_rss(proc):
+    """
+    Wait for proc to exit and return the peak RSS in KiB of the largest single process among it and its
+    (waited for) children, or None where this is not available. See TestHandler.sample_memory_usage for
+    the memory use of the whole test.
+    """
+    if not hasattr(os, "wait4"):
+        proc.wait()
+        return None
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in bytes on macOS
+    return rusage.ru_maxrss // 1024 if platform.system() == 'Darwin' else rusage.ru_maxrss
+
+
+async def wait_process(proc, executor):
+    """
+    Wait for the subprocess.Popen proc to exit without blocking the event loop, and return the peak RSS
+    of its largest process (see wait_for_max_rss).
+
+    On Linux, the event loop watches a pidfd of the process, which becomes readable when it exits. The
+    process is then reaped with wait4, for its resource usage. Elsewhere, a thread of executor waits.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        return await loop.run_in_executor(executor, wait_for_max_rss, proc)
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    return wait_for_max_rss(proc)
+
+
+class Preloader:
+    """
+    Run test scripts in forked children of a long-lived process which has already imported the test
+    framework, saving every test the interpreter startup and imports (see test_framework/preload.py).
+    Nothing else is shared between tests.
+    """
+    def __init__(self, tests_dir, loop, *, failfast=False):
+        self.loop = loop
+        # Measure what starting a test without --preload costs: a new interpreter importing the framework
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import sys; sys.path.insert(0, {tests_dir!r}); from test_framework.preload import import_framework; import_framework()"],
+                       check=True)
+        self.spawn_time = time.perf_counter() - start
+        # The time it took to fork the child of every test run
+        self.fork_times = []
+        # With failfast, the preload process doesn't wait for the running tests when closed, see close()
+        self.proc = subprocess.Popen([sys.executable, "-c", f"import sys; sys.path.insert(0, {tests_dir!r}); from test_framework.preload import main; main({failfast})"],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.buffer = b""
+        self.next_id = 0
+        self.pending = {}
+        # Callbacks taking the pid of the child running a test, by request id
+        self.started = {}
+        self.preload_time = loop.create_future()
+        loop.add_reader(self.proc.stdout.fileno(), self.read_messages)
+
+    def read_messages(self):
+        data = os.read(self.proc.stdout.fileno(), 65536)
+        if not data:
+            self.loop.remove_reader(self.proc.stdout.fileno())
+            for future in list(self.pending.values()) + [self.preload_time]:
+                if not future.done():
+                    future.set_exception(RuntimeError("The preload process exited unexpectedly"))
+            return
+        *lines, self.buffer = (self.buffer + data).split(b"\n")
+        for line in lines:
+            message = json.loads(line)
+            if "preload_time" in message:
+                self.preload_time.set_result(message["preload_time"])
+            elif "pid" in message:
+                self.started.pop(message["id"])(message["pid"])
+            else:
+                self.fork_times.append(message["fork_time"])
+                self.pending.pop(message["id"]).set_result((message["returncode"], message["max_rss"]))
+
+    async def run(self, argv, stdout_path, stderr_path, started):
+        """
+        Run the test script argv[0] with its output written to the given files, calling started with the
+        pid of the process running it. Return its exit code and the peak RSS of its largest process.
+        """
+        self.next_id += 1
+        self.pending[self.next_id] = self.loop.create_future()
+        self.started[self.next_id] = started
+        request = {"id": self.next_id, "argv": argv, "stdout": stdout_path, "stderr": stderr_path}
+        self.proc.stdin.write((json.dumps(request) + "\n").encode())
+        self.proc.stdin.flush()
+        return await self.pending[self.next_id]
+
+    def close(self):
+        """Stop the preload process, after the running tests have finished unless started with failfast."""
+        self.loop.remove_reader(self.proc.stdout.fileno())
+        self.proc.stdin.close()
+        self.proc.wait()
+
 
 class TestHandler:
     """
     Trigger the test scripts passed in via the list.
+
+    The test processes are supervised by an asyncio event loop, which wakes up as soon as one of them
+    exits. Their stdout and stderr are written to files next to their test directories.
     """
-    def __init__(self, *, num_tests_parallel, tests_dir, tmpdir, test_list, flags, use_term_control):
+    def __init__(self, *, num_tests_parallel, tests_dir, tmpdir, test_list, flags, use_term_control, history=None, preload=False, failfast=False):
         assert num_tests_parallel >= 1
+        self.loop = asyncio.new_event_loop()
+        self.preloader = Preloader(tests_dir, self.loop, failfast=failfast) if preload else None
+        # Only used on platforms without pidfd support, see wait_process
         self.executor = futures.ThreadPoolExecutor(max_workers=num_tests_parallel)
         self.num_jobs = num_tests_parallel
         self.tests_dir = tests_dir
@@ -722,41 +1086,92 @@ class TestHandler:
         self.flags = flags
         self.jobs = {}
         self.use_term_control = use_term_control
+        self.history = history
+        # Peak disk use of the running tests, by test directory
+        self.max_disk = {}
+        self.last_disk_sample = time.time()
+        # Pid of the running tests' processes and peak summed RSS (KiB) of their process trees, by test directory
+        self.pids = {}
+        self.max_rss = {}
+        self.last_memory_sample = time.time()
+        # Times at which a test exited and its slot became free, and the time it then took to start the next test
+        self.free_slot_times = deque()
+        self.scheduling_overheads = []
 
     def done(self):
         return not (self.jobs or self.test_list)
 
+    def has_free_resources(self, test):
+        """Return whether there is enough free memory, disk space and CPU to start the test."""
+        estimate = self.history.estimate(test) if self.history is not None else None
+        _, max_rss, max_disk = estimate or (0, 0, 0)
+        available_memory = get_available_memory()
+        if available_memory is not None and available_memory < max_rss * 1024 + MIN_FREE_MEMORY:
+            return False
+        if shutil.disk_usage(self.tmpdir).free < max_disk + ADDITIONAL_SPACE_PER_JOB:
+            return False
+        if hasattr(os, "getloadavg") and os.getloadavg()[0] > MAX_LOAD_PER_CPU * os.cpu_count():
+            return False
+        return True
+
+    def sample_disk_usage(self):
+        for testdir in self.max_disk:
+            self.max_disk[testdir] = max(self.max_disk[testdir], get_dir_size(testdir))
+        self.last_disk_sample = time.time()
+
+    def sample_memory_usage(self):
+        """Measure the memory use of the running tests: the RSS of their processes, including their nodes."""
+        processes = get_process_table()
+        if processes is not None:
+            tree_rss = get_tree_rss(self.pids.values(), processes)
+            for testdir, pid in self.pids.items():
+                self.max_rss[testdir] = max(self.max_rss[testdir], tree_rss[pid])
+        self.last_memory_sample = time.time()
+
+    async def run_test(self, test, argv, testdir):
+        start_time = time.time()
+        log_paths = [testdir + ".stdout", testdir + ".stderr"]
+        if self.preloader is not None:
+            def started(pid):
+                self.pids[testdir] = pid
+            returncode, max_rss = await self.preloader.run(argv[1:], *log_paths, started)
+        else:
+            with open(log_paths[0], "w", encoding="utf8") as log_stdout, open(log_paths[1], "w", encoding="utf8") as log_stderr:
+                proc = subprocess.Popen(argv, text=True, stdout=log_stdout, stderr=log_stderr)
+            self.pids[testdir] = proc.pid
+            max_rss = await wait_process(proc, self.executor)
+            returncode = proc.returncode
+        # The pid may be reused from now on
+        self.pids.pop(testdir, None)
+        self.free_slot_times.append(time.monotonic())
+        [stdout, stderr] = [pathlib.Path(log_path).read_text(encoding="utf8") for log_path in log_paths]
+        for log_path in log_paths:
+            os.remove(log_path)
+        return test, start_time, returncode, testdir, stdout, stderr, max_rss
+
     def get_next(self):
+        return self.loop.run_until_complete(self.wait_next())
+
+    async def wait_next(self):
         while len(self.jobs) < self.num_jobs and self.test_list:
+            # Always keep at least one test running, even if resources are short.
+            if self.jobs and not self.has_free_resources(self.test_list[0]):
+                logging.debug("Not enough free memory, disk space or CPU to run more than %d tests in parallel" % len(self.jobs))
+                break
             # Add tests
             test = self.test_list.popleft()
             portseed = len(self.test_list)
             portseed_arg = ["--portseed={}".format(portseed)]
-            log_stdout = tempfile.SpooledTemporaryFile(max_size=2**16)
-            log_stderr = tempfile.SpooledTemporaryFile(max_size=2**16)
             test_argv = test.split()
             testdir = "{}/{}_{}".format(self.tmpdir, re.sub(".py$", "", test_argv[0]), portseed)
             tmpdir_arg = ["--tmpdir={}".format(testdir)]
-
-            def proc_wait(task):
-                task[2].wait()
-                return task
-
-            task = [
-                test,
-                time.time(),
-                subprocess.Popen(
-                    [sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg,
-                    text=True,
-                    stdout=log_stdout,
-                    stderr=log_stderr,
-                ),
-                testdir,
-                log_stdout,
-                log_stderr,
-            ]
-            fut = self.executor.submit(proc_wait, task)
-            self.jobs[fut] = test
+            argv = [sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg
+            job = self.loop.create_task(self.run_test(test, argv, testdir))
+            if self.free_slot_times:
+                self.scheduling_overheads.append(time.monotonic() - self.free_slot_times.popleft())
+            self.jobs[job] = test
+            self.max_disk[testdir] = 0
+            self.max_rss[testdir] = 0
         assert self.jobs  # Must not be empty here
 
         # Print remaining running jobs when all jobs have been started.
@@ -765,20 +1180,22 @@ class TestHandler:
 
         dot_count = 0
         while True:
-            # Return all procs that have finished, if any. Otherwise sleep until there is one.
-            procs = futures.wait(self.jobs.keys(), timeout=.5, return_when=futures.FIRST_COMPLETED)
-            self.jobs = {fut: self.jobs[fut] for fut in procs.not_done}
+            # Return all tests that have finished, if any. The timeout is only used to print progress dots.
+            done, _ = await asyncio.wait(self.jobs.keys(), timeout=.5, return_when=asyncio.FIRST_COMPLETED)
             ret = []
-            for job in procs.done:
-                (name, start_time, proc, testdir, log_out, log_err) = job.result()
+            for job in done:
+                del self.jobs[job]
+                (name, start_time, returncode, testdir, stdout, stderr, max_rss) = job.result()
+                max_disk = max(self.max_disk.pop(testdir), get_dir_size(testdir))
+                # The largest single process is a lower bound of the test's memory use, for tests too short to be sampled
+                sampled_rss = self.max_rss.pop(testdir)
+                if max_rss is not None or sampled_rss:
+                    max_rss = max(max_rss or 0, sampled_rss)
 
-                log_out.seek(0), log_err.seek(0)
-                [stdout, stderr] = [log_file.read().decode('utf-8') for log_file in (log_out, log_err)]
-                log_out.close(), log_err.close()
                 skip_reason = None
-                if proc.returncode == TEST_EXIT_PASSED and stderr == "":
+                if returncode == TEST_EXIT_PASSED and stderr == "":
                     status = "Passed"
-                elif proc.returncode == TEST_EXIT_SKIPPED:
+                elif returncode == TEST_EXIT_SKIPPED:
                     status = "Skipped"
                     skip_reason = re.search(r"Test Skipped: (.*)", stdout).group(1)
                 else:
@@ -788,19 +1205,25 @@ class TestHandler:
                     clearline = '\r' + (' ' * dot_count) + '\r'
                     print(clearline, end='', flush=True)
                 dot_count = 0
-                ret.append((TestResult(name, status, int(time.time() - start_time)), testdir, stdout, stderr, skip_reason))
+                ret.append((TestResult(name, status, int(time.time() - start_time), max_rss=max_rss, max_disk=max_disk), testdir, stdout, stderr, skip_reason))
             if ret:
                 return ret
+            if time.time() - self.last_disk_sample >= DISK_SAMPLE_INTERVAL:
+                self.sample_disk_usage()
+            if time.time() - self.last_memory_sample >= MEMORY_SAMPLE_INTERVAL:
+                self.sample_memory_usage()
             if self.use_term_control:
                 print('.', end='', flush=True)
             dot_count += 1
 
 
 class TestResult():
-    def __init__(self, name, status, time):
+    def __init__(self, name, status, time, *, max_rss=None, max_disk=None):
         self.name = name
         self.status = status
         self.time = time
+        self.max_rss = max_rss
+        self.max_disk = max_disk
         self.padding = 0
 
     def sort_key(self):
@@ -926,5 +1349,37 @@ class RPCCoverage():
         return all_cmds - covered_cmds
 
 
+class RPCProfiler():
+    """
+    RPC profile reporting utilities for test_runner.
+
+    Each test script subprocess writes the statistics of its RPC calls into
+    a particular directory, which are merged into one report after all tests
+    complete.
+
+    See also: test/functional/test_framework/rpc_profile.py
+
+    """
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="rpcprofile")
+        self.flag = '--rpcprofiledir=%s' % self.dir
+
+    def report(self, json_filename):
+        """
+        Print out the RPC methods the tests spent the most time in, and
+        write the full profile to json_filename.
+
+        """
+        rpc_profile = RPCProfile.read_all(self.dir)
+        print("RPC profile:")
+        print(rpc_profile.report())
+        with open(json_filename, 'w', encoding='utf8') as f:
+            json.dump(rpc_profile.to_json(), f, indent=2)
+        print("RPC profile written to %s" % json_filename)
+
+    def cleanup(self):
+        return shutil.rmtree(self.dir)
+
+
 if __name__ == '__main__':
     main()
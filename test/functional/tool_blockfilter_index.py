@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Test the blockfilter-index tool, which builds BIP158 filters from blk*.dat and rev*.dat files"""
+from pathlib import Path
+import subprocess
+import sys
+
+from test_framework.script import (
+    CScript,
+    OP_RETURN,
+)
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import (
+    assert_equal,
+    assert_greater_than,
+)
+from test_framework.wallet import MiniWallet
+
+
+class BlockfilterIndexToolTest(BitcoinTestFramework):
+    def set_test_params(self):
+        self.num_nodes = 1
+        self.extra_args = [[
+            '-blockfilterindex=1',
+            '-fastprune=1',  # use smaller block files
+        ]]
+
+    def run_tool(self, *args):
+        tool_path = Path(self.config["environment"]["SRCDIR"]) / "contrib" / "blockfilter" / "blockfilter-index.py"
+        return subprocess.run([sys.executable, tool_path, *args], check=True, capture_output=True, text=True).stdout
+
+    def run_test(self):
+        node = self.nodes[0]
+        wallet = MiniWallet(node)
+
+        self.log.info("Create blocks spread over multiple blk*.dat/rev*.dat files")
+        for _ in range(5):
+            wallet.send_self_transfer(from_node=node, target_vsize=20000)
+            self.generate(wallet, 1)
+        assert_greater_than(len(list(node.blocks_path.glob("blk[0-9][0-9][0-9][0-9][0-9].dat"))), 1)
+
+        self.log.info("Create a block paying to a script, and one spending it which also has an OP_RETURN output")
+        tagged_wallet = MiniWallet(node, tag_name="blockfilter")
+        script = tagged_wallet.get_output_script()
+        funding = wallet.send_to(from_node=node, scriptPubKey=script, amount=100000)
+        tagged_wallet.scan_tx(node.decoderawtransaction(funding["hex"]))
+        funding_hash = self.generate(wallet, 1)[0]
+        tagged_wallet.send_self_transfer(from_node=node)
+        op_return_script = CScript([OP_RETURN, b'filter'])
+        wallet.send_to(from_node=node, scriptPubKey=op_return_script, amount=0)
+        spending_hash = self.generate(wallet, 1)[0]
+
+        self.log.info("Create a stale block, which must not be indexed")
+        stale_hash = self.generate(wallet, 1)[0]
+        node.invalidateblock(stale_hash)
+        self.generate(wallet, 2)
+        node.reconsiderblock(stale_hash)
+        assert stale_hash not in [node.getblockhash(height) for height in range(node.getblockcount() + 1)]
+        self.wait_until(lambda: node.getindexinfo()["basic block filter index"]["synced"])
+
+        self.log.info("Build the index from the block files")
+        index_dir = Path(self.options.tmpdir) / "blockfilter-index"
+        self.run_tool("build", "--blocksdir", node.blocks_path, "--netmagic", "fabfb5da", "-j", "2", index_dir)
+
+        self.log.info("Compare the filters and filter headers with getblockfilter")
+        output = self.run_tool("verify", "--rpcurl", node.url, index_dir)
+        assert_equal(output.strip(), f"All {node.getblockcount() + 1} filters and filter headers match")
+
+        self.log.info("Query the index for the script, which is in the funding and spending block")
+        output = self.run_tool("query", "-j", "2", index_dir, script.hex(), op_return_script.hex())
+        matches = [line.split() for line in output.splitlines()]
+        assert_equal(matches, [
+            [str(node.getblockheader(funding_hash)["height"]), funding_hash, script.hex()],
+            [str(node.getblockheader(spending_hash)["height"]), spending_hash, script.hex()],
+        ])
+
+
+if __name__ == "__main__":
+    BlockfilterIndexToolTest(__file__).main()
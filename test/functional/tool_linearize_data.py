@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Test the extent index mode of contrib/linearize/linearize-data.py on synthetic block files.
+
+The blocks are stored out of order, obfuscated with an xor key and followed by preallocated zeros, as
+bitcoind stores them. The chain then grows, and the block files are rewritten.
+"""
+import importlib.util
+import os
+from pathlib import Path
+import random
+import shutil
+import struct
+import subprocess
+import sys
+
+from test_framework.messages import hash256
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import assert_equal
+
+NETMAGIC = bytes.fromhex("fabfb5da")
+# Preallocated space at the end of the block files, which isn't obfuscated
+ZERO_TAIL_SIZE = 4096
+
+
+class LinearizeDataTest(BitcoinTestFramework):
+    def set_test_params(self):
+        self.num_nodes = 0  # No node/datadir needed
+        self.setup_clean_chain = True
+
+    def setup_network(self):
+        pass
+
+    def load_linearize_data(self):
+        """Load linearize-data.py as a module, as its name isn't a valid identifier."""
+        spec = importlib.util.spec_from_file_location("linearize_data", self.script)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def make_blocks(self, count, prev_hash):
+        """Return count records (netmagic, size, header, block data) of a chain extending prev_hash, and their hashes."""
+        records = []
+        hashes = []
+        for _ in range(count):
+            header = struct.pack("<i32s32sIII", 4, prev_hash, self.rng.randbytes(32), 1700000000 + len(records) * 600, 0x207fffff, self.rng.getrandbits(32))
+            data = self.rng.randbytes(self.rng.randrange(1, 2000))
+            records.append(NETMAGIC + struct.pack("<I", len(header) + len(data)) + header + data)
+            prev_hash = hash256(header)
+            hashes.append(prev_hash[::-1].hex())
+        return records, hashes
+
+    def write_block_file(self, fn, records):
+        """Write an obfuscated block file. Returns the size of the block data, without the zeros after it."""
+        data = b"".join(records)
+        with open(self.blocks_dir / f"blk{fn:05}.dat", "wb") as f:
+            f.write(bytes(byte ^ self.xor_key[i % len(self.xor_key)] for i, byte in enumerate(data)))
+            f.write(bytes(ZERO_TAIL_SIZE))
+        return len(data)
+
+    def run_linearize(self, hashes):
+        with open(self.hashlist, "w", encoding="utf8") as f:
+            f.write("".join(block_hash + "\n" for block_hash in hashes))
+        return subprocess.run([sys.executable, self.script, self.cfg_file], check=True, capture_output=True, text=True).stdout
+
+    def assert_output(self, records):
+        output = b"".join(path.read_bytes() for path in sorted(self.output_dir.glob("blk*.dat")))
+        assert_equal(output, b"".join(records))
+
+    def run_test(self):
+        self.script = Path(self.config["environment"]["SRCDIR"]) / "contrib" / "linearize" / "linearize-data.py"
+        linearize_data = self.load_linearize_data()
+        self.rng = random.Random(0)
+        tmpdir = Path(self.options.tmpdir)
+        self.blocks_dir = tmpdir / "blocks"
+        self.blocks_dir.mkdir()
+        self.xor_key = self.rng.randbytes(8)
+        (self.blocks_dir / "xor.dat").write_bytes(self.xor_key)
+        self.output_dir = tmpdir / "output"
+        self.output_dir.mkdir()
+        self.hashlist = tmpdir / "hashlist.txt"
+        index_path = tmpdir / "extent-index.dat"
+
+        records, hashes = self.make_blocks(20, bytes(32))
+        stale_records, _ = self.make_blocks(1, bytes.fromhex(hashes[5])[::-1])
+        self.cfg_file = tmpdir / "linearize.cfg"
+        with open(self.cfg_file, "w", encoding="utf8") as cfg:
+            cfg.write(f"netmagic={NETMAGIC.hex()}\n")
+            cfg.write(f"genesis={hashes[0]}\n")
+            cfg.write(f"input={self.blocks_dir}\n")
+            cfg.write(f"hashlist={self.hashlist}\n")
+            cfg.write(f"output={self.output_dir}\n")
+            cfg.write(f"extent_index={index_path}\n")
+            cfg.write("max_out_sz=8000\n")
+            cfg.write("scan_jobs=2\n")
+
+        self.log.info("Copy shuffled blocks, including a stale one, from two block files")
+        order = list(range(15))
+        self.rng.shuffle(order)
+        file_records = [[records[height] for height in order[:7]] + stale_records, [records[height] for height in order[7:]]]
+        sizes = [self.write_block_file(fn, file_records[fn]) for fn in range(2)]
+        self.run_linearize(hashes[:15])
+        self.assert_output(records[:15])
+        assert_equal(len(list(self.output_dir.glob("blk*.dat"))) > 1, True)
+        index = linearize_data.read_extent_index(str(index_path), os.path.realpath(self.blocks_dir), NETMAGIC, self.xor_key)
+        assert_equal({fn: scanned for fn, (scanned, _, _) in index.items()}, {0: sizes[0], 1: sizes[1]})
+        assert_equal(len(index[0][2]), 8)
+
+        self.log.info("Scan a block file from an offset")
+        path = str(self.blocks_dir / "blk00001.dat")
+        start = len(file_records[1][0])
+        fn, scanned, blocks = linearize_data.scan_block_file((1, path, start, NETMAGIC, self.xor_key))
+        assert_equal((fn, scanned), (1, sizes[1]))
+        assert_equal([block_hash[::-1].hex() for block_hash, _, _ in blocks], [hashes[height] for height in order[8:]])
+        assert_equal([offset for _, offset, _ in blocks], [offset for _, offset, _ in index[1][2][1:]])
+
+        self.log.info("The extent index of another blocks directory is ignored")
+        assert_equal(linearize_data.read_extent_index(str(index_path), str(tmpdir / "other"), NETMAGIC, self.xor_key), {})
+
+        self.log.info("Grow the chain into the preallocated space and a new block file, and resume")
+        first_output = self.output_dir / "blk00000.dat"
+        first_output_mtime = first_output.stat().st_mtime_ns
+        file_records[1] += records[15:18]
+        self.write_block_file(1, file_records[1])
+        file_records.append(records[18:])
+        self.write_block_file(2, file_records[2])
+        stdout = self.run_linearize(hashes)
+        assert "Scanning 2 block files" in stdout
+        assert "Keeping" in stdout
+        self.assert_output(records)
+        assert_equal(first_output.stat().st_mtime_ns, first_output_mtime)
+        stdout = self.run_linearize(hashes)
+        assert "Scanning" not in stdout
+        self.assert_output(records)
+
+        self.log.info("Rescan block files which were rewritten without shrinking")
+        file_records[0].reverse()
+        self.write_block_file(0, file_records[0])
+        shutil.rmtree(self.output_dir)
+        self.output_dir.mkdir()
+        stdout = self.run_linearize(hashes)
+        assert "rescanning all block files" in stdout
+        self.assert_output(records)
+
+
+if __name__ == '__main__':
+    LinearizeDataTest(__file__).main()
@@ -3,11 +3,13 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Test utxo-to-sqlite conversion tool"""
+from array import array
 import os.path
 try:
     import sqlite3
 except ImportError:
     pass
+import json
 import subprocess
 import sys
 
@@ -38,20 +40,50 @@ from test_framework.util import (
 from test_framework.wallet import MiniWallet
 
 
-def calculate_muhash_from_sqlite_utxos(filename):
+def calculate_muhash(utxos):
     muhash = MuHash3072()
-    con = sqlite3.connect(filename)
-    cur = con.cursor()
-    for (txid_hex, vout, value, coinbase, height, spk_hex) in cur.execute("SELECT * FROM utxos"):
+    for (txid, vout, value, coinbase, height, spk) in utxos:
         # serialize UTXO for MuHash (see function `TxOutSer` in the  coinstats module)
-        utxo_ser = COutPoint(int(txid_hex, 16), vout).serialize()
+        utxo_ser = COutPoint(int.from_bytes(txid, 'big'), vout).serialize()
         utxo_ser += (height * 2 + coinbase).to_bytes(4, 'little')
-        utxo_ser += CTxOut(value, bytes.fromhex(spk_hex)).serialize()
+        utxo_ser += CTxOut(value, spk).serialize()
         muhash.insert(utxo_ser)
-    con.close()
     return muhash.digest()[::-1].hex()
 
 
+def calculate_muhash_from_sqlite_utxos(filename):
+    con = sqlite3.connect(filename)
+    cur = con.cursor()
+    utxos = []
+    for (txid, vout, value, coinbase, height, spk) in cur.execute("SELECT txid, vout, value, coinbase, height, scriptpubkey FROM utxos"):
+        # txid and scriptpubkey are hex strings, or BLOBs with --blob
+        if isinstance(txid, str):
+            txid, spk = bytes.fromhex(txid), bytes.fromhex(spk)
+        utxos.append((txid, vout, value, coinbase, height, spk))
+    con.close()
+    return calculate_muhash(utxos)
+
+
+def calculate_muhash_from_columnar_utxos(dirname):
+    def read_column(name, typecode):
+        with open(os.path.join(dirname, name), 'rb') as f:
+            column = array(typecode, f.read())
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+    with open(os.path.join(dirname, "txid.bin"), 'rb') as f:
+        txids = f.read()
+    with open(os.path.join(dirname, "scriptpubkey.bin"), 'rb') as f:
+        spks = f.read()
+    with open(os.path.join(dirname, "coinbase.u8"), 'rb') as f:
+        coinbases = f.read()
+    vouts, values, heights = read_column("vout.u32", 'I'), read_column("value.u64", 'Q'), read_column("height.u32", 'I')
+    offsets = read_column("scriptpubkey_offsets.u64", 'Q')
+    return calculate_muhash((txids[i * 32:(i + 1) * 32], vouts[i], values[i], coinbases[i], heights[i], spks[offsets[i]:offsets[i + 1]])
+                            for i in range(len(vouts)))
+
+
 class UtxoToSqliteTest(BitcoinTestFramework):
     def set_test_params(self):
         self.num_nodes = 1
@@ -67,6 +99,7 @@ class UtxoToSqliteTest(BitcoinTestFramework):
         key = ECKey()
 
         self.log.info('Create UTXOs with various output script types')
+        all_output_scripts = []
         for i in range(1, 10+1):
             key.generate(compressed=False)
             uncompressed_pubkey = key.get_pubkey().get_bytes()
@@ -91,6 +124,7 @@ class UtxoToSqliteTest(BitcoinTestFramework):
                 CScript([CScriptOp.encode_op_n(i)]*(1000*i)),  # large script (up to 10000 bytes)
             )
 
+            all_output_scripts += output_scripts
             # create outputs and mine them in a block
             for output_script in output_scripts:
                 wallet.send_to(from_node=node, scriptPubKey=output_script, amount=i, fee=20000)
@@ -112,6 +146,45 @@ class UtxoToSqliteTest(BitcoinTestFramework):
         muhash_compact_serialized = node.gettxoutsetinfo('muhash')['muhash']
         assert_equal(muhash_sqlite, muhash_compact_serialized)
 
+        self.log.info('Convert UTXO set to sqlite format with BLOB columns and indexes')
+        output_filename = os.path.join(self.options.tmpdir, "utxos_blob.sqlite")
+        subprocess.run([sys.executable, utxo_to_sqlite_path, "--blob", "--index", "scriptpubkey", "--index", "height",
+                        input_filename, output_filename], check=True, stderr=subprocess.STDOUT)
+        assert_equal(calculate_muhash_from_sqlite_utxos(output_filename), muhash_compact_serialized)
+        con = sqlite3.connect(output_filename)
+        assert_equal(sorted(name for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'index'")),
+                     ["utxos_height", "utxos_scriptpubkey"])
+        con.close()
+
+        self.log.info('Convert UTXO set to columnar format, decoding in parallel')
+        for jobs in [1, 2]:
+            output_dirname = os.path.join(self.options.tmpdir, f"utxos_columnar_{jobs}")
+            subprocess.run([sys.executable, utxo_to_sqlite_path, "--format", "columnar", f"--jobs={jobs}", input_filename, output_dirname],
+                           check=True, stderr=subprocess.STDOUT)
+            assert_equal(calculate_muhash_from_columnar_utxos(output_dirname), muhash_compact_serialized)
+
+        self.log.info('Index the sqlite UTXO set and look up coins by script')
+        utxo_explorer_path = os.path.join(base_dir, "contrib", "utxo-tools", "utxo_explorer.py")
+        output_filename = os.path.join(self.options.tmpdir, "utxos.sqlite")
+        subprocess.run([sys.executable, utxo_explorer_path, output_filename, "index"], check=True, stderr=subprocess.STDOUT)
+        scripts = [bytes(script).hex() for script in all_output_scripts[::7]]
+        lookup = subprocess.run([sys.executable, utxo_explorer_path, output_filename, "lookup", *scripts],
+                                check=True, stdout=subprocess.PIPE, text=True).stdout
+        con = sqlite3.connect(output_filename)
+        expected = sorted(con.execute(f"SELECT txid, vout FROM utxos WHERE scriptpubkey IN ({','.join('?' * len(scripts))})", scripts))
+        con.close()
+        assert_equal(sorted((coin["txid"], coin["vout"]) for coin in map(json.loads, lookup.splitlines())), expected)
+        assert len(expected) >= len(scripts)
+
+        self.log.info('Refresh the indexed UTXO set from a newer dump')
+        for _ in range(5):
+            wallet.send_self_transfer(from_node=node)
+        self.generate(wallet, 1)
+        input_filename = os.path.join(self.options.tmpdir, "utxos_new.dat")
+        node.dumptxoutset(input_filename, "latest")
+        subprocess.run([sys.executable, utxo_explorer_path, output_filename, "refresh", input_filename], check=True, stderr=subprocess.STDOUT)
+        assert_equal(calculate_muhash_from_sqlite_utxos(output_filename), node.gettxoutsetinfo('muhash')['muhash'])
+
 
 if __name__ == "__main__":
     UtxoToSqliteTest(__file__).main()